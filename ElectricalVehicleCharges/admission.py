@@ -0,0 +1,98 @@
+import asyncio
+import collections
+import logging
+import random
+import time
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    """
+    Spreads reconnect storms out using the load of this process: the rate of
+    new connections, the event loop lag and the number of database calls
+    queued or running.
+
+    Connections are refused outright (the charger retries with its own
+    backoff) only while the event loop or the database is saturated, as
+    connecting costs database work. When connections merely arrive faster
+    than `max_connect_rate`, or the load is high, BootNotification answers
+    Pending with a jittered retry interval instead. Accepted chargers get a
+    heartbeat interval that widens with the fleet so that the whole fleet
+    stays around `heartbeat_target_rate` heartbeats per second.
+    """
+
+    def __init__(self, max_connect_rate=200, max_loop_lag=0.25, max_db_queue=200, pending_interval=30,
+                 heartbeat_interval=60, heartbeat_max_interval=900, heartbeat_target_rate=100,
+                 window=5.0, probe_interval=0.5):
+        self.max_connect_rate = max_connect_rate
+        self.max_loop_lag = max_loop_lag
+        self.max_db_queue = max_db_queue
+        self.pending_interval = pending_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_max_interval = heartbeat_max_interval
+        self.heartbeat_target_rate = heartbeat_target_rate
+        self.window = window
+        self.probe_interval = probe_interval
+        self.loop_lag = 0.0
+        self._connects = collections.deque()  # monotonic times of recent connection attempts
+        self._probe_task = None
+
+    def _ensure_probe(self):
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.get_running_loop().create_task(self._probe())
+
+    async def _probe(self):
+        """Measure how late the loop wakes a sleeping task, smoothed."""
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.probe_interval)
+            lag = max(0.0, time.monotonic() - started - self.probe_interval)
+            self.loop_lag = 0.7 * self.loop_lag + 0.3 * lag
+            metrics.EVENT_LOOP_LAG_SECONDS.set(self.loop_lag)
+
+    def connect_rate(self, now=None):
+        now = now if now is not None else time.monotonic()
+        while self._connects and self._connects[0] < now - self.window:
+            self._connects.popleft()
+        return len(self._connects) / self.window
+
+    def saturated(self):
+        """Why this process cannot take on more work right now, or None."""
+        if self.loop_lag > self.max_loop_lag:
+            return f"event loop lag {self.loop_lag * 1000:.0f}ms"
+        db_queue = metrics.DB_CALLS_IN_FLIGHT.value()
+        if db_queue > self.max_db_queue:
+            return f"{db_queue} database calls queued"
+        return None
+
+    def admit_connection(self):
+        """Record a connection attempt; False if it should be refused."""
+        self._ensure_probe()
+        self._connects.append(time.monotonic())
+        reason = self.saturated()
+        if reason:
+            metrics.ADMISSIONS.inc("connect", "refused")
+            logger.warning(f"🚧 Refusing connection: {reason}")
+            return False
+        metrics.ADMISSIONS.inc("connect", "accepted")
+        return True
+
+    def boot_decision(self, fleet_size):
+        """(accepted, interval) to answer a BootNotification with."""
+        self._ensure_probe()
+        rate = self.connect_rate()
+        if rate > self.max_connect_rate or self.saturated():
+            # The busier the process, the further out the retries are spread
+            load = max(1.0, rate / self.max_connect_rate)
+            metrics.ADMISSIONS.inc("boot", "pending")
+            return False, round(self.pending_interval * load * random.uniform(0.5, 1.5))
+        metrics.ADMISSIONS.inc("boot", "accepted")
+        return True, self.heartbeat_interval_for(fleet_size)
+
+    def heartbeat_interval_for(self, fleet_size):
+        """Heartbeat interval keeping the fleet near the target rate, with 10% jitter."""
+        interval = max(self.heartbeat_interval, fleet_size / self.heartbeat_target_rate)
+        interval = min(interval, self.heartbeat_max_interval)
+        return max(1, round(interval * random.uniform(0.9, 1.1)))
@@ -6,6 +6,7 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
+import logging
 import os
 from django.core.asgi import get_asgi_application
 from channels.auth import AuthMiddlewareStack
@@ -17,6 +18,21 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ElectricalVehicleCharges.settin
 # is populated before importing code that may import ORM models.
 django_asgi_app = get_asgi_application()
 
+# Warm the charger registry with a single query so that a reconnect storm
+# right after startup does not turn into one lookup per charger.
+from api.registry import charger_registry  # noqa: E402
+try:
+    charger_registry.preload()
+except Exception as e:
+    logging.getLogger(__name__).warning(f"⚠️ Charger registry preload failed, loading lazily: {e}")
+
+# Same for the authorization list, Authorize should never wait on the database
+from api.authorization import id_tags  # noqa: E402
+try:
+    id_tags.preload()
+except Exception as e:
+    logging.getLogger(__name__).warning(f"⚠️ Id tag preload failed, loading lazily: {e}")
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
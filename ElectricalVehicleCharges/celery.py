@@ -0,0 +1,9 @@
+import os
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ElectricalVehicleCharges.settings")
+
+# Background jobs (api/tasks.py); settings prefixed CELERY_ in settings.py
+app = Celery("ElectricalVehicleCharges")
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
@@ -1,110 +1,437 @@
-# how run this py module 
-# docker exec -it evcharges_backend bash (then) python charge_point.py
+# how run this py module
+# docker exec -it evcharges_backend bash (then) python -m ElectricalVehicleCharges.charge_point_client --help
+#
+# Fleet simulator for load-testing the CSMS. Examples:
+#   one charger, the old walkthrough:   --chargers 1 --mix session=1 --duration 30
+#   boot storm of 10k chargers:         --chargers 10000 --rate 0 --mix boot=1
+#   steady fleet on 4 processes:        --chargers 20000 --processes 4 --rate 500 --mix heartbeat=80,session=15,remote=5
+# Chargers are provisioned in the database (sim-000000, sim-000001, ...) unless --no-provision.
+# Large fleets need a raised file descriptor limit (ulimit -n).
 
+import argparse
 import asyncio
-import websockets
+import json
 import logging
-from datetime import datetime , timezone 
-from ocpp.v16 import call
+import multiprocessing
+import random
+import time
+from collections import defaultdict
+from datetime import datetime , timezone
+import websockets
+from ocpp.exceptions import OCPPError
+from ocpp.v16 import call, call_result
 from ocpp.v16 import ChargePoint as cp
 from ocpp.routing import on
 
 logger = logging.getLogger(__name__)
 
+
+class Stats:
+    """Round trip latencies and errors seen by the chargers of one process."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)  # action -> [seconds]
+        self.errors = defaultdict(int)  # "action: error" -> count
+
+    def record(self, action, seconds):
+        self.latencies[action].append(seconds)
+
+    def error(self, action, kind):
+        self.errors[f"{action}: {kind}"] += 1
+
+    def as_dict(self):
+        return {"latencies": dict(self.latencies), "errors": dict(self.errors)}
+
+    def merge(self, other):
+        """Add the as_dict() of another process."""
+        for action, values in other["latencies"].items():
+            self.latencies[action].extend(values)
+        for key, count in other["errors"].items():
+            self.errors[key] += count
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) of an already sorted list."""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def summarize(stats, elapsed):
+    """Per action count, throughput, error rate and p50/p90/p99/max in milliseconds."""
+    errors_by_action = defaultdict(int)
+    for key, count in stats.errors.items():
+        errors_by_action[key.split(":", 1)[0]] += count
+    actions = {}
+    for action in sorted(set(stats.latencies) | set(errors_by_action)):
+        values = sorted(stats.latencies.get(action, ()))
+        failed = errors_by_action.get(action, 0)
+        total = len(values) + failed
+        actions[action] = {
+            "count": total,
+            "per_second": round(total / elapsed, 2) if elapsed else None,
+            "error_rate": round(failed / total, 4) if total else 0.0,
+            **{
+                name: round(value * 1000, 3) if value is not None else None
+                for name, value in (
+                    ("p50_ms", percentile(values, 50)),
+                    ("p90_ms", percentile(values, 90)),
+                    ("p99_ms", percentile(values, 99)),
+                    ("max_ms", values[-1] if values else None),
+                )
+            },
+        }
+    return {"elapsed_s": round(elapsed, 3), "actions": actions, "errors": dict(sorted(stats.errors.items()))}
+
+
+def print_report(summary):
+    print(f"\n📊 {summary['elapsed_s']}s")
+    print(f"{'action':<28}{'count':>9}{'/s':>10}{'err %':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for action, row in summary["actions"].items():
+        cells = [f"{row[key]:>10}" if row[key] is not None else f"{'-':>10}" for key in ("p50_ms", "p90_ms", "p99_ms", "max_ms")]
+        print(f"{action:<28}{row['count']:>9}{row['per_second']:>10}{row['error_rate'] * 100:>8.2f}{''.join(cells)}")
+    for key, count in summary["errors"].items():
+        print(f"❌ {key}: {count}")
+
+
 class ChargePointClient(cp):
     """ Charge Point """
+
+    def __init__(self, id, connection, stats=None, **kwargs):
+        super().__init__(id, connection, **kwargs)
+        self.stats = stats or Stats()
+        self.transaction_id = None
+        self.meter = 0  # Energy register (Wh)
+
+    async def timed_call(self, request):
+        """ Send a request, recording its round trip; returns None if it failed """
+        action = request.__class__.__name__
+        started = time.perf_counter()
+        try:
+            response = await self.call(request, suppress=False, skip_schema_validation=True)
+        except asyncio.TimeoutError:
+            self.stats.error(action, "timeout")
+            return None
+        except OCPPError as e:
+            self.stats.error(action, type(e).__name__)
+            return None
+        self.stats.record(action, time.perf_counter() - started)
+        return response
+
     async def send_boot_notification(self):
         """ Send BootNotification to the OCPP Server (CSMS) """
         request = call.BootNotification(
             charge_point_model="EVSE-123",
             charge_point_vendor="EV-Charger Inc."
         )
-        response = await self.call(request)
-        print(f'📡 BootNotification Response: {response}')
+        response = await self.timed_call(request)
+        logger.debug(f'📡 BootNotification Response: {response}')
+        return response
 
     async def send_authorize(self, id_tag):
         """ Send Authorize request """
         request = call.Authorize(id_tag=id_tag)
-        response = await self.call(request)
-        print(f"🔒 Authorize Response: {response}")
+        response = await self.timed_call(request)
+        logger.debug(f"🔒 Authorize Response: {response}")
+        return response
 
     async def send_start_transaction(self, id_tag, connector_id):
         """ Send StartTransaction request """
         request = call.StartTransaction(
             connector_id=connector_id,
             id_tag=id_tag,
-            meter_start=0,
+            meter_start=self.meter,
             timestamp=datetime.now(timezone.utc).isoformat()
         )
-        response = await self.call(request)
-        print(f"⚡ StartTransaction Response: {response}")
+        response = await self.timed_call(request)
+        logger.debug(f"⚡ StartTransaction Response: {response}")
+        self.transaction_id = response.transaction_id if response else None
+        return response
+
+    async def send_meter_values(self, connector_id):
+        """ Send MeterValues for the running transaction """
+        request = call.MeterValues(
+            connector_id=connector_id,
+            transaction_id=self.transaction_id,
+            meter_value=[{
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "sampled_value": [
+                    {"value": str(self.meter), "measurand": "Energy.Active.Import.Register", "unit": "Wh"},
+                    {"value": str(round(random.uniform(7000, 11000))), "measurand": "Power.Active.Import", "unit": "W"},
+                ],
+            }],
+        )
+        return await self.timed_call(request)
 
     async def send_stop_transaction(self, transaction_id):
         """ Send StopTransaction request """
         request = call.StopTransaction(
             transaction_id=transaction_id,
-            meter_stop=100,
+            meter_stop=self.meter,
             timestamp=datetime.now(timezone.utc).isoformat(),
             reason="Local"
         )
-        response = await self.call(request)
-        print(f"🚫 StopTransaction Response: {response}")
+        response = await self.timed_call(request)
+        logger.debug(f"🚫 StopTransaction Response: {response}")
+        self.transaction_id = None
+        return response
+
+    async def send_status_notification(self, connector_id, status):
+        """ Send StatusNotification request """
+        request = call.StatusNotification(connector_id=connector_id, error_code="NoError", status=status)
+        return await self.timed_call(request)
 
-    async def send_heartbeat(self):
+    async def send_heartbeat(self, interval=60):
         """ Send Heartbeat request """
         while True:
             request = call.Heartbeat()
-            response = await self.call(request)
-            print(f"⏱ Heartbeat Response: {response}")
-            await asyncio.sleep(60)
-    
-async def connect_to_server():
-    uri = "ws://localhost:8000/ws/evcharger/cfcf351e-47ed-4e9a-93b1-62d2ce26d550/"  
+            response = await self.timed_call(request)
+            logger.debug(f"⏱ Heartbeat Response: {response}")
+            await asyncio.sleep(interval)
 
-    try:
-        async with websockets.connect(uri) as ws:
-            charge_point = ChargePointClient("EVSE-123", ws)
-            
-            # Start listening for incoming messages
-            listener_task = asyncio.create_task(charge_point.start())  
-            await asyncio.sleep(2)  # Give time for connection setup
+    @on("RemoteStartTransaction")
+    async def on_remote_start_transaction(self, id_tag, **kwargs):
+        return call_result.RemoteStartTransaction(status="Accepted")
 
-            # ✅ Step 1: Send Boot Notification (Initial Registration)
-            await charge_point.send_boot_notification()
+    @on("RemoteStopTransaction")
+    async def on_remote_stop_transaction(self, transaction_id, **kwargs):
+        return call_result.RemoteStopTransaction(status="Accepted")
 
-            # ✅ Step 2: Start Heartbeat in Background
-            heartbeat_task = asyncio.create_task(charge_point.send_heartbeat())
 
-            # ✅ Step 3: Authorize the User
-            await asyncio.sleep(2)  # Small delay before authorization
-            await charge_point.send_authorize("123456")
+# Scenarios run after the BootNotification until the end of the run
 
-            # ✅ Step 4: Start Charging Transaction
-            await asyncio.sleep(2)  # Ensure authorization is completed
-            await charge_point.send_start_transaction("123456", 1)  
+async def scenario_boot(client, args, http):
+    """ Boot storm: disconnect --boot-hold seconds after booting, the charger reconnects """
+    await asyncio.sleep(args.boot_hold)
 
-            # ✅ Step 5: Simulate Charging (wait time)
-            await asyncio.sleep(10)  # Simulating a charging session
 
-            # ✅ Step 6: Stop the Charging Transaction
-            await charge_point.send_stop_transaction(transaction_id=1)
+async def scenario_heartbeat(client, args, http):
+    """ Idle charger: heartbeats only """
+    await asyncio.sleep(random.uniform(0, args.heartbeat_interval))
+    await client.send_heartbeat(args.heartbeat_interval)
 
-            # ✅ Cleanup: Stop heartbeat and WebSocket listener
-            heartbeat_task.cancel()
-            listener_task.cancel()
 
+async def scenario_session(client, args, http):
+    """ Metered charging sessions back to back, with heartbeats in between """
+    heartbeat_task = asyncio.create_task(client.send_heartbeat(args.heartbeat_interval))
+    try:
+        while True:
+            await asyncio.sleep(random.expovariate(1 / args.session_gap) if args.session_gap else 0)
+            id_tag = f"tag-{random.randrange(args.id_tags)}"
+            await client.send_authorize(id_tag)
+            await client.send_status_notification(1, "Preparing")
+            if not await client.send_start_transaction(id_tag, 1):
+                continue
+            await client.send_status_notification(1, "Charging")
+            ends_at = time.monotonic() + args.session_length
+            while time.monotonic() < ends_at:
+                await asyncio.sleep(args.meter_interval)
+                client.meter += round(args.meter_interval * random.uniform(2, 3))  # 7-11 kW
+                await client.send_meter_values(1)
+            await client.send_stop_transaction(client.transaction_id)
+            await client.send_status_notification(1, "Available")
+    finally:
+        heartbeat_task.cancel()
+
+
+async def scenario_remote(client, args, http):
+    """ Heartbeats, plus RemoteStartTransaction sent through the FastAPI service """
+    heartbeat_task = asyncio.create_task(client.send_heartbeat(args.heartbeat_interval))
+    try:
+        while True:
+            await asyncio.sleep(random.expovariate(1 / args.remote_interval))
+            started = time.perf_counter()
             try:
-                await heartbeat_task
-                await listener_task
-            except asyncio.CancelledError:
-                logger.info("🛑 Tasks stopped gracefully.")
+                response = await http.post(
+                    f"{args.api_url.rstrip('/')}/remote_start/{client.id}",
+                    params={"id_tag": "remote", "connector_id": 1},
+                )
+            except Exception as e:
+                client.stats.error("api remote_start", type(e).__name__)
+                continue
+            if response.status_code == 200:
+                client.stats.record("api remote_start", time.perf_counter() - started)
+            else:
+                client.stats.error("api remote_start", f"HTTP {response.status_code}")
+    finally:
+        heartbeat_task.cancel()
 
-    except websockets.exceptions.ConnectionClosedOK:
-        logger.info("✅ WebSocket connection closed normally.")
 
-    except Exception as e:
-        logger.error(f"❌ WebSocket Error: {e}")
+SCENARIOS = {
+    "boot": scenario_boot,
+    "heartbeat": scenario_heartbeat,
+    "session": scenario_session,
+    "remote": scenario_remote,
+}
 
-if __name__ == "__main__":
-    asyncio.run(connect_to_server())
 
+async def run_charger(charger_id, scenario, args, stats, stop_at, http):
+    """ Keep one charger connected and running its scenario until stop_at """
+    loop = asyncio.get_running_loop()
+    uri = f"{args.url.rstrip('/')}/{charger_id}/"
+    while loop.time() < stop_at:
+        started = time.perf_counter()
+        try:
+            async with websockets.connect(uri, open_timeout=args.timeout, ping_interval=None) as ws:
+                stats.record("connect", time.perf_counter() - started)
+                client = ChargePointClient(charger_id, ws, stats=stats, response_timeout=args.timeout)
+                listener_task = asyncio.create_task(client.start())
+                try:
+                    response = await client.send_boot_notification()
+                    # A Pending server wants the boot repeated after `interval` seconds
+                    while response is not None and response.status == "Pending":
+                        stats.error("BootNotification", "Pending")
+                        await asyncio.wait_for(asyncio.sleep(response.interval), max(0, stop_at - loop.time()))
+                        response = await client.send_boot_notification()
+                    await asyncio.wait_for(SCENARIOS[scenario](client, args, http), max(0, stop_at - loop.time()))
+                except asyncio.TimeoutError:
+                    return  # End of the run
+                finally:
+                    listener_task.cancel()
+            # The scenario ended (boot storm): reconnect after a jittered delay
+            delay = args.reconnect_delay * random.uniform(1 - args.reconnect_jitter, 1 + args.reconnect_jitter)
+            await asyncio.sleep(max(0, min(delay, stop_at - loop.time())))
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+            stats.error("connect", type(e).__name__)
+            await asyncio.sleep(random.uniform(1, 5))  # Back off like a real charger would
+
+
+async def run_fleet(charger_ids, args):
+    """ Start the chargers at the arrival rate and let them run; returns Stats """
+    logging.getLogger("ocpp").setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    names, weights = zip(*args.mix.items())
+    stats = Stats()
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + args.duration
+    http = None
+    if "remote" in names:
+        import httpx
+        http = httpx.AsyncClient(timeout=args.timeout + 5)
+    tasks = []
+    for charger_id in charger_ids:
+        scenario = rng.choices(names, weights)[0]
+        tasks.append(asyncio.create_task(run_charger(charger_id, scenario, args, stats, stop_at, http)))
+        if args.rate:
+            # Poisson arrivals at `rate` chargers per second
+            await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.wait(tasks, timeout=max(0, stop_at - loop.time()) + args.timeout)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if http is not None:
+        await http.aclose()
+    return stats
+
+
+def run_worker(charger_ids, args):
+    """ Entry point of a simulator process """
+    return asyncio.run(run_fleet(charger_ids, args)).as_dict()
+
+
+def provision(count, prefix, connectors, id_tags=0):
+    """ Create the simulated chargers (and their connectors) and id tags if missing, returns the charger ids """
+    import api.django_setup  # Load Django settings before importing models
+    from api.models import ChargePoint, Connector, IdTag
+    IdTag.objects.bulk_create(
+        [IdTag(id_tag=id_tag) for id_tag in ["remote"] + [f"tag-{i}" for i in range(id_tags)]],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    names = [f"{prefix}-{i:06d}" for i in range(count)]
+    existing = set(ChargePoint.objects.filter(name__startswith=f"{prefix}-").values_list("name", flat=True))
+    chargers = [ChargePoint(name=name, max_power_kw=22) for name in names if name not in existing]
+    ChargePoint.objects.bulk_create(chargers, batch_size=1000)
+    Connector.objects.bulk_create(
+        [
+            Connector(charge_point=charger, number=number, type="Type2", max_current=32, status="Available", power_type="AC")
+            for charger in chargers for number in range(1, connectors + 1)
+        ],
+        batch_size=1000,
+    )
+    logger.info(f"🏭 Provisioned {len(chargers)} chargers, {len(existing)} already existed")
+    ids = dict(ChargePoint.objects.filter(name__in=names).values_list("name", "id"))
+    return [str(ids[name]) for name in names]
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}, choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="OCPP 1.6 charger fleet simulator")
+    parser.add_argument("--url", default="ws://localhost:8000/ws/evcharger", help="WebSocket base url")
+    parser.add_argument("--api-url", default="http://localhost:9000", help="FastAPI base url (remote scenario)")
+    parser.add_argument("--chargers", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=1, help="spread the chargers over this many processes")
+    parser.add_argument("--rate", type=float, default=100, help="new chargers per second, 0 connects all at once")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("heartbeat=80,session=15,remote=5"),
+                        help="scenario weights, e.g. heartbeat=80,session=15,remote=5 (scenarios: %s)" % ", ".join(SCENARIOS))
+    parser.add_argument("--heartbeat-interval", type=float, default=60)
+    parser.add_argument("--meter-interval", type=float, default=15, help="seconds between MeterValues in a session")
+    parser.add_argument("--session-length", type=float, default=120, help="seconds per charging session")
+    parser.add_argument("--session-gap", type=float, default=30, help="mean idle seconds between sessions")
+    parser.add_argument("--remote-interval", type=float, default=30, help="mean seconds between remote starts")
+    parser.add_argument("--boot-hold", type=float, default=1, help="seconds a boot scenario charger stays connected")
+    parser.add_argument("--reconnect-delay", type=float, default=1,
+                        help="seconds before a boot scenario charger reconnects")
+    parser.add_argument("--reconnect-jitter", type=float, default=0.5,
+                        help="random share of the reconnect delay, 0.5 means 50%%-150%% of it")
+    parser.add_argument("--id-tags", type=int, default=1000, help="number of distinct id tags used")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for a connection or a reply")
+    parser.add_argument("--prefix", default="sim", help="name prefix of the provisioned chargers")
+    parser.add_argument("--connectors", type=int, default=1, help="connectors per provisioned charger")
+    parser.add_argument("--no-provision", dest="provision", action="store_false",
+                        help="use existing chargers named <prefix>-NNNNNN")
+    parser.add_argument("--charger-id", action="append", help="simulate these charger ids instead (repeatable)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    if args.charger_id:
+        charger_ids = args.charger_id
+    elif args.provision:
+        charger_ids = provision(args.chargers, args.prefix, args.connectors, args.id_tags)
+    else:
+        import api.django_setup  # Load Django settings before importing models
+        from api.models import ChargePoint
+        charger_ids = [
+            str(charger_id) for charger_id in ChargePoint.objects.filter(name__startswith=f"{args.prefix}-")
+            .order_by("name").values_list("id", flat=True)[:args.chargers]
+        ]
+
+    processes = max(1, min(args.processes, len(charger_ids)))
+    logger.info(f"🚗 Simulating {len(charger_ids)} chargers on {processes} processes for {args.duration}s")
+    started = time.monotonic()
+    if processes == 1:
+        stats = asyncio.run(run_fleet(charger_ids, args))
+    else:
+        args.rate /= processes
+        chunks = [charger_ids[i::processes] for i in range(processes)]
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            results = pool.starmap(run_worker, [(chunk, args) for chunk in chunks])
+        stats = Stats()
+        for result in results:
+            stats.merge(result)
+
+    summary = summarize(stats, time.monotonic() - started)
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
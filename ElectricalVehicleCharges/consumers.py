@@ -1,118 +1,324 @@
 from dataclasses import asdict
 import api.django_setup # Load Django settings before importing models
+import asyncio
 import json
 import logging
+import time
 from datetime import datetime, timezone
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from ocpp.routing import on
+from ocpp.routing import after, on
 from ocpp.v16 import call_result , call
-from ocpp.v16 import ChargePoint as cp
 from ocpp.v16.enums import RegistrationStatus
-from ocpp.messages import CallResult
-from api.models import Messages , ChargePoint , Connector , Transaction
+from ocpp.messages import MessageType, unpack
+from ocpp.exceptions import GenericError, OCPPError
+from api.models import Messages , ChargePoint , Connector , Transaction , MeterSample , EncodedJSON
+from api.meter_values import flatten_meter_values, update_rollups
+from api import metrics, outbox, rpc
+from api.tracing import record_span, tracer, untraced
+from api.authorization import id_tags
+from api.presence import presence
+from api.registry import charger_registry
+from api.transactions import (
+    aactive_transactions_of, aclose_transaction, active_transactions, aopen_transaction, transaction_ids,
+)
+from .admission import AdmissionController
+from .last_seen import LastSeenTracker
+from .ocpp_charge_point import ChargePointV16 as cp, ResponseTemplate
+from .rate_limit import RateLimiter, limits_for
+from .write_behind import WriteBehindBuffer
 logger = logging.getLogger(__name__)
 
+# Messages are logged through a per-process write-behind buffer so that the
+# reply to the charger never waits on a Postgres INSERT.
+message_log = WriteBehindBuffer(
+    Messages,
+    batch_size=settings.MESSAGE_LOG_BATCH_SIZE,
+    flush_interval=settings.MESSAGE_LOG_FLUSH_INTERVAL,
+    max_pending=settings.MESSAGE_LOG_MAX_PENDING,
+    overflow_policy=settings.MESSAGE_LOG_OVERFLOW_POLICY,
+)
+
+# MeterValues samples take the same route; the rollups are updated right
+# after each batch is written.
+meter_samples = WriteBehindBuffer(
+    MeterSample,
+    batch_size=settings.METER_SAMPLES_BATCH_SIZE,
+    flush_interval=settings.METER_SAMPLES_FLUSH_INTERVAL,
+    max_pending=settings.METER_SAMPLES_MAX_PENDING,
+    overflow_policy=settings.METER_SAMPLES_OVERFLOW_POLICY,
+    after_write=update_rollups,
+)
+
+# last_seen / last_heartbeat of every charger, written in bulk
+last_seen = LastSeenTracker(
+    flush_interval=settings.LAST_SEEN_FLUSH_INTERVAL,
+    batch_size=settings.LAST_SEEN_BATCH_SIZE,
+)
+
+# Refuses connections and defers BootNotification while this process is overloaded
+admission = AdmissionController(
+    max_connect_rate=settings.ADMISSION_MAX_CONNECT_RATE,
+    max_loop_lag=settings.ADMISSION_MAX_LOOP_LAG,
+    max_db_queue=settings.ADMISSION_MAX_DB_QUEUE,
+    pending_interval=settings.BOOT_PENDING_INTERVAL,
+    heartbeat_interval=settings.HEARTBEAT_INTERVAL,
+    heartbeat_max_interval=settings.HEARTBEAT_MAX_INTERVAL,
+    heartbeat_target_rate=settings.HEARTBEAT_TARGET_RATE,
+)
+
 class OCPPConsumer(AsyncWebsocketConsumer , cp):
     """OCPP Central System Management Server (CSMS)"""
+
+    # Heartbeat, MeterValues and StatusNotification make up most of the
+    # traffic and their replies always have the same shape, so they skip the
+    # generic serialize / camelCase / schema validation path.
+    _response_templates = {
+        call_result.Heartbeat: ResponseTemplate({"currentTime": ("current_time", str)}),
+        call_result.MeterValues: ResponseTemplate({}),
+        call_result.StatusNotification: ResponseTemplate({}),
+    }
+    # Delivery of queued commands (deliver_outbox), at most one per connection;
+    # outbox_dirty tells a running delivery that more commands were queued
+    outbox_task = None
+    outbox_dirty = False
     
-    @database_sync_to_async
-    def get_charger(self, charger_id):
-        return ChargePoint.objects.filter(id=charger_id).first()
+    async def get_charger(self, charger_id):
+        return await charger_registry.aget(charger_id)
     
     async def connect(self):
         """ Handle new Charge Point WebSocket connection """
         self.charger_id = self.scope["url_route"]["kwargs"]["charger_id"]
+        if not admission.admit_connection():
+            await self.close()
+            return
         self.charge_point = await self.get_charger(self.charger_id)
             
         if not self.charge_point:
             logger.error(f"❌ Charger {self.charger_id} not found in the database.")
             await self.close()
             return
+        # Commands from FastAPI that are waiting for the charger's answer
+        self.command_tasks = set()
+        # Inbound Calls are bounded per connection, tuned by charger model
+        self.rate_limiter = RateLimiter(limits_for(
+            self.charge_point.charge_point_model, settings.OCPP_RATE_LIMITS, settings.OCPP_RATE_LIMITS_BY_MODEL
+        ))
+        self.rate_limited = False
         # Explicitly initialize ChargePoint (cp) properly
-        cp.__init__(self, self.charger_id, self )
+        cp.__init__(self, self.charger_id, self, max_concurrent_calls=settings.OCPP_MAX_CONCURRENT_CALLS)
         await self.accept()
-        await self.channel_layer.group_add(f"charger_{self.charger_id}", self.channel_name)
-        logger.info(f"🔌 Added {self.charger_id} to WebSocket group: charger_{self.charger_id}")
+        self.accepted = True
+        metrics.CONNECTED_CHARGERS.inc()
+        metrics.publisher.ensure_started()
+        # Commands are sent straight to self.channel_name, found through presence
+        client = self.scope.get("client") or (None,)
+        await presence.connected(self.charge_point.id, self.channel_name, client[0])
+        # Sessions still running from a previous connection; the entries are
+        # left in place on disconnect and replaced here on the next connect.
+        active_transactions.load(self.charge_point.id, await aactive_transactions_of(self.charge_point))
         logger.info(f"🔌 Charger {self.charger_id} connected")
+        # Commands queued while the charger was away; during a reconnect storm
+        # this waits for an accepted BootNotification instead
+        if not admission.saturated():
+            self.drain_outbox()
     
     async def receive(self, text_data):
         """Handles incoming OCPP messages."""
-        logger.info(f'Data {text_data}')
+        logger.debug("%s: receive %s", self.charger_id, text_data)
+        trace = tracer.start(self.charger_id)
+        message_type = "Unknown"
         try:
-            data = json.loads(text_data) # text_data is list 
-            message_type = data[2] if len(data) > 2 else "Unknown"
-            # save the incoming request from cp (client side)
-            logger.info(f'text_data {type(text_data)}')
-            await self.save_message(charge_point=self.charge_point , message_type = message_type , payload = text_data)
-            response = await self.route_message(text_data)
-            logger.info(f'{response}')
-            if response is not None:
-                if isinstance(response, CallResult):
-                    response_data = response.to_json()  # ✅ Correct way to serialize CallResult
-                elif hasattr(response, "to_json"):
-                    response_data = response.to_json()
-                elif isinstance(response, dict):
-                    response_data = json.dumps(response)
-                else:
-                    response_data = json.dumps(response.__dict__)  # Convert object attributes to JSON
-
-                # Logging for debugging
-                logger.info(f"Serialized response: {response_data}")
-
-                # Save response to the database
-                await self.save_message(charge_point=self.charge_point,  message_type=message_type, payload=response_data)
-                
-                # Send response back to client
-                await self.send(response_data)  # ✅ Already in JSON format
+            # The frame is decoded exactly once; route_message() takes the
+            # decoded message as is.
+            msg = unpack(text_data)
+            if msg.message_type_id == MessageType.Call:
+                message_type = msg.action
+            else:
+                message_type = self._pending_call_action(msg.unique_id) or "Unknown"
+            trace.unique_id, trace.action = msg.unique_id, message_type
+            metrics.FRAMES_RECEIVED.inc(metrics.action_label(message_type))
+            if msg.message_type_id == MessageType.Call and not await self.admit(msg):
+                tracer.finish(trace)
+                return
+            last_seen.touch(self.charge_point)
+            # save the incoming frame from cp (client side)
+            await self.save_message(charge_point=self.charge_point , message_type = message_type , payload = EncodedJSON(text_data), direction = Messages.INBOUND)
+            # Replies (CallResult / CallError) go out through _send()
+            started = time.perf_counter()
+            await self.route_message(msg)
+            record_span("route_message", started)
         except Exception as e:
             logger.error(f"❌ Error processing message from {self.charger_id}: {e}", exc_info=True)
             await self.send(json.dumps({"error": "Invalid request"}))
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - trace.t0, "receive", metrics.action_label(message_type))
+        tracer.finish(trace)
+
+    async def admit(self, msg):
+        """
+        Wait for the rate limiter to let a Call through, or answer it with a
+        CallError. Rejected Calls are neither handled nor logged, so a flooding
+        charger costs one send per frame and no database work.
+        """
+        waited = 0.0
+        while True:
+            wait = self.rate_limiter.check(msg.action)
+            if not wait:
+                if waited:
+                    metrics.RATE_LIMITED.inc(metrics.action_label(msg.action), "delayed")
+                if self.rate_limited:
+                    self.rate_limited = False
+                    logger.info(f"🚦 Charger {self.charger_id} is back within its rate limits")
+                return True
+            if settings.OCPP_RATE_LIMIT_POLICY != "delay" or waited + wait > settings.OCPP_RATE_LIMIT_MAX_DELAY:
+                break
+            await asyncio.sleep(wait)
+            waited += wait
+        metrics.RATE_LIMITED.inc(metrics.action_label(msg.action), "rejected")
+        if not self.rate_limited:
+            self.rate_limited = True
+            logger.warning(f"🚦 Charger {self.charger_id} exceeded its rate limit on {msg.action}, rejecting calls")
+        error = msg.create_call_error(GenericError(description="Rate limit exceeded"))
+        await self.send(text_data=error.to_json())
+        return False
+
+    async def _send(self, message, action=None):
+        """
+        Single exit point for outbound frames. The frame is serialized once by
+        the OCPP library and the same string is sent, logged and persisted.
+        """
+        logger.debug("%s: send %s", self.charger_id, message)
+        started = time.perf_counter()
+        await self.send(text_data=message)
+        elapsed = time.perf_counter() - started
+        metrics.STAGE_SECONDS.observe(elapsed, "send", metrics.action_label(action))
+        record_span("send", started, elapsed)
+        await self.save_message(charge_point=self.charge_point, message_type=action or "Unknown", payload=EncodedJSON(message), direction=Messages.OUTBOUND)
+
+    def _spawn(self, coroutine):
+        # Background work is not part of the frame being traced
+        return untraced(coroutine)
+
+    def _observe_stage(self, stage, action, seconds):
+        metrics.STAGE_SECONDS.observe(seconds, stage, metrics.action_label(action))
+        record_span(stage, time.perf_counter() - seconds, seconds)
+
+    async def call(self, payload, *args, **kwargs):
+        try:
+            return await super().call(payload, *args, **kwargs)
+        except asyncio.TimeoutError:
+            metrics.CALL_TIMEOUTS.inc(payload.__class__.__name__)
+            raise
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(f"charger_{self.charger_id}", self.channel_name)
+        if getattr(self, "accepted", False):
+            metrics.CONNECTED_CHARGERS.dec()
+            await presence.disconnected(self.charge_point.id, self.channel_name)
+        for task in list(getattr(self, "command_tasks", ())):
+            task.cancel()
+        if self.outbox_task:
+            self.outbox_task.cancel()
         logger.info(f"🚫 Charger {self.charger_id} disconnected")
     
-    async def remote_start(self, event):
-        """Handle RemoteStartTransaction request from FastAPI """
-        logger.info(f"📩 Received Remote Start request: {event}")
+    def drain_outbox(self):
+        """Start delivering the charger's queued commands, or have the running delivery look again."""
+        self.outbox_dirty = True
+        if self.outbox_task is None or self.outbox_task.done():
+            self.outbox_task = self._spawn(self.deliver_outbox())
 
-        try:
-            request_data = json.loads(event["request"])
-            request = call.RemoteStartTransaction(**request_data)
+    async def outbox_drain(self, event):
+        """A command was queued for this charger while it is connected"""
+        self.drain_outbox()
 
-            # Send the OCPP command to the charge point
-            response = await self.call(request)
+    async def deliver_outbox(self):
+        """Send queued commands one at a time, in batches; each outcome is recorded."""
+        while True:
+            self.outbox_dirty = False
+            batch = await outbox.anext_batch(self.charge_point.id, settings.OUTBOX_BATCH_SIZE)
+            delivered, retry_later = [], False
+            try:
+                for command in batch:
+                    delivered.append(command)
+                    if not await self.deliver_queued(command):
+                        retry_later = True
+                        break
+            finally:
+                # Also on disconnect: a command cut off mid-call stays queued with its attempt counted
+                if delivered:
+                    await asyncio.shield(outbox.arecord(delivered))
+            if retry_later or (len(batch) < settings.OUTBOX_BATCH_SIZE and not self.outbox_dirty):
+                return
 
-            logger.info(f"✅ Remote Start Response from CP: {response}")
+    async def deliver_queued(self, command):
+        """Send one queued command; False if it stays queued for the next connection."""
+        command.attempts += 1
+        if command.expires_at <= datetime.now(timezone.utc):
+            command.status = "expired"
+        else:
+            try:
+                response = await self.call(rpc.build_call(command.action, command.payload), suppress=False)
+                command.status, command.result, command.error = rpc.STATUS_OK, asdict(response), None
+            except asyncio.TimeoutError:
+                command.error = "Charger did not answer in time"
+                # Retried on the next connection until out of attempts
+                if command.attempts < settings.OUTBOX_MAX_ATTEMPTS:
+                    return False
+                command.status = rpc.STATUS_TIMEOUT
+            except OCPPError as e:
+                command.status, command.error = rpc.STATUS_ERROR, f"{e.code}: {e.description}"
+            except Exception as e:
+                command.status, command.error = rpc.STATUS_ERROR, str(e)
+        command.finished_at = datetime.now(timezone.utc)
+        metrics.OUTBOX_DELIVERED.inc(command.action, command.status)
+        logger.info(f"📬 Queued {command.action} to {self.charger_id}: {command.status}")
+        return True
 
-            # Send response back to FastAPI
-            return response
-        except Exception as e:
-            logger.error(f"❌ Error in remote_start: {e}")
-            
-    async def remote_stop(self,event):
-        """Handle RemoteStopTransaction request from FastAPI """
-        logger.info(f"📩 Received Remote Stop request: {event}")
+    async def ocpp_command(self, event):
+        """Handle an OCPP command (RemoteStartTransaction, Reset, ...) from FastAPI """
+        logger.info(f"📩 Received {event['action']} request: {event['payload']}")
+        # The charger's CallResult is delivered by receive(), which only runs
+        # once this handler returns, so the call is made in the background.
+        task = self._spawn(self.run_command(event))
+        self.command_tasks.add(task)
+        task.add_done_callback(self.command_tasks.discard)
+
+    async def run_command(self, event):
+        """Send the command to the charge point and reply to FastAPI with its result"""
+        remaining = event["deadline"] - time.time()
+        if remaining <= 0:
+            logger.warning(f"⌛ Dropping expired {event['action']} for {self.charger_id}")
+            await rpc.send_reply(self.channel_layer, event, rpc.STATUS_EXPIRED, error="Deadline passed before delivery")
+            return
         try:
-            request_data = json.loads(event["request"])
-            request = call.RemoteStopTransaction(**request_data)
-            # Send the OCPP command to the charge point
-            response = await self.call(request)
-            logger.info(f"✅ Remote Stop Response from CP: {response}")
-            # Send response back to FastAPI
-            return response
+            request = getattr(call, event["action"])(**event["payload"])
+            response = await asyncio.wait_for(self.call(request, suppress=False), remaining)
+            logger.info(f"✅ {event['action']} Response from CP: {response}")
+            await rpc.send_reply(self.channel_layer, event, rpc.STATUS_OK, result=asdict(response))
+        except asyncio.TimeoutError:
+            logger.error(f"⌛ {event['action']} to {self.charger_id} timed out")
+            await rpc.send_reply(self.channel_layer, event, rpc.STATUS_TIMEOUT, error="Charger did not answer in time")
+        except asyncio.CancelledError:
+            await rpc.send_reply(self.channel_layer, event, rpc.STATUS_DISCONNECTED, error="Charger disconnected")
+            raise
+        except OCPPError as e:
+            logger.error(f"❌ {event['action']} to {self.charger_id} failed: {e}")
+            await rpc.send_reply(self.channel_layer, event, rpc.STATUS_ERROR, error=f"{e.code}: {e.description}")
         except Exception as e:
-            logger.error(f"❌ Error in remote_stop: {e}")
+            logger.error(f"❌ Error in {event['action']}: {e}")
+            await rpc.send_reply(self.channel_layer, event, rpc.STATUS_ERROR, error=str(e))
             
     @on("BootNotification")
     async def on_boot_notification(self, charge_point_model, **kwargs):
         try:
             logger.info(f"🚀 Charger {self.charger_id} sent BootNotification: {charge_point_model}")
+            # Pending asks the charger to boot again after `interval` seconds
+            accepted, interval = admission.boot_decision(max(len(presence.cluster), len(presence.local)))
+            self.boot_accepted = accepted
             response = call_result.BootNotification(
                 current_time=datetime.now(timezone.utc).isoformat(),
-                interval=60,
-                status=RegistrationStatus.accepted  # Correct enum usage
+                interval=interval,
+                status=RegistrationStatus.accepted if accepted else RegistrationStatus.pending  # Correct enum usage
             )
             logger.info(f"✅ Returning BootNotification response: {response}")
             return response
@@ -120,47 +326,86 @@ class OCPPConsumer(AsyncWebsocketConsumer , cp):
             logger.error(f"❌ Error in on_boot_notification: {e}")
             return None  # Explicitly return None if an error occurs
         
+    @after("BootNotification")
+    def after_boot_notification(self, **kwargs):
+        # Runs once the reply is sent, so queued commands follow an accepted boot
+        if getattr(self, "boot_accepted", False):
+            self.drain_outbox()
+        elif self.outbox_task:
+            self.outbox_task.cancel()
+
     @on("Authorize")
     async def on_authorize(self, id_tag, **kwargs):
         """ Handle 'Authorize' request from Charge Point """
         logger.info(f"🔒 Charger {self.charger_id} sent Authorize: {id_tag}")
         return call_result.Authorize(
-            id_tag_info={"status":"Accepted"}
+            id_tag_info=await id_tags.authorize(id_tag)
             )
 
     @on("StartTransaction")
     async def on_start_transaction(self,id_tag,connector_id, meter_start,timestamp ,**kwargs):
-        logger.info(f"⚡ Charger {self.charger_id} started a transaction")
-        return call_result.StartTransaction(transaction_id=1,id_tag_info={"status":"Accepted"})
+        """ Handle 'StartTransaction' request from Charge Point """
+        # A transaction id is returned whatever the tag's status, the charger
+        # ends a session that was not Accepted with a StopTransaction.
+        id_tag_info = await id_tags.authorize(id_tag)
+        transaction_id = await transaction_ids.allocate()
+        connector = next(
+            (c for c in charger_registry.connectors(self.charge_point) if c.number == connector_id), None
+        )
+        await aopen_transaction(self.charge_point, connector, connector_id, transaction_id, id_tag, meter_start, timestamp)
+        active_transactions.start(self.charge_point.id, connector_id, transaction_id)
+        logger.info(f"⚡ Charger {self.charger_id} started transaction {transaction_id} on connector {connector_id}")
+        return call_result.StartTransaction(transaction_id=transaction_id,id_tag_info=id_tag_info)
     
     @on("MeterValues")
     async def on_meter_values(self,connector_id,meter_value,transaction_id=None ,**kwargs):
         """ Handle 'MeterValues' request from Charge Point """
-        logger.info(f"⚡ MeterValues received for transaction {transaction_id}: {meter_value}")
+        if transaction_id is None:
+            transaction_id = active_transactions.get(self.charge_point.id, connector_id)
+        logger.debug(f"⚡ MeterValues received for transaction {transaction_id}: {meter_value}")
+        for sample in flatten_meter_values(self.charge_point, connector_id, transaction_id, meter_value):
+            await meter_samples.put(**sample)
         return call_result.MeterValues()
 
     @on("StopTransaction")
     async def on_stop_transaction(self,meter_stop , timestamp , transaction_id , reason=None , id_tag=None,transaction_data=None,**kwargs):
         """ Handle 'StopTransaction' request from Charge Point """
-        logger.info(f"⚡ Charger {self.charger_id} stopped a transaction")
+        session = active_transactions.stop(self.charge_point.id, transaction_id)
+        if not await aclose_transaction(self.charge_point, transaction_id, meter_stop, timestamp, reason):
+            logger.warning(f"⚠️ Charger {self.charger_id} stopped unknown transaction {transaction_id}")
+        if transaction_data:
+            connector_id = session[1] if session else 0
+            for sample in flatten_meter_values(self.charge_point, connector_id, transaction_id, transaction_data):
+                await meter_samples.put(**sample)
+        logger.info(f"⚡ Charger {self.charger_id} stopped transaction {transaction_id} ({reason or 'Local'})")
         return call_result.StopTransaction(
-            id_tag_info={"status":"Accepted"}
+            id_tag_info=await id_tags.authorize(id_tag) if id_tag else None
         )
         
+    @on("StatusNotification")
+    async def on_status_notification(self, connector_id, error_code, status, **kwargs):
+        """ Handle 'StatusNotification' request from Charge Point """
+        logger.info(f"🔔 Charger {self.charger_id} connector {connector_id} is {status} ({error_code})")
+        return call_result.StatusNotification()
+
     @on('Heartbeat')
     async def on_heartbeat(self, **kwargs):
         """ Handle 'Heartbeat' request from Charge Point """
         logger.info(f"⏱ Charger {self.charger_id} sent Heartbeat")
+        now = datetime.now(timezone.utc)
+        last_seen.touch(self.charge_point, heartbeat=True, now=now)
         return call_result.Heartbeat(
-            current_time=datetime.now(timezone.utc).isoformat()
+            current_time=now.isoformat()
         )
         
     # Database operation
-    @database_sync_to_async
-    def save_message(self,charge_point, message_type, payload):
-        """Save incoming OCPP messages to the database."""
-        return Messages.objects.create(
+    async def save_message(self,charge_point, message_type, payload, direction=Messages.INBOUND):
+        """Queue an OCPP message for the batched write to the database."""
+        started = time.perf_counter()
+        await message_log.put(
             charge_point=charge_point,
             message_type=message_type,
+            direction=direction,
             payload=payload
         )
+        record_span("save_message", started)
@@ -0,0 +1,70 @@
+import asyncio
+import atexit
+import logging
+import time
+from django.utils import timezone
+from api import metrics
+from api.models import ChargePoint
+
+logger = logging.getLogger(__name__)
+
+
+class LastSeenTracker:
+    """
+    Coalesces ChargePoint.last_seen / last_heartbeat updates.
+
+    The timestamps are set right away on the charger instance held by the
+    charger registry, so readers in this process see them immediately, and the
+    charger is marked dirty. Every ``flush_interval`` seconds all dirty chargers
+    are written with ``bulk_update`` (one UPDATE per ``batch_size`` chargers),
+    however many frames they sent in between.
+    """
+    fields = ["last_seen", "last_heartbeat"]
+
+    def __init__(self, flush_interval=30.0, batch_size=1000):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._dirty = {}  # charger pk -> ChargePoint
+        self._task = None
+        self._write_async = metrics.timed_database_sync_to_async(self._write)
+        atexit.register(self.flush_sync)
+
+    def touch(self, charge_point, heartbeat=False, now=None):
+        """Record that a frame (or a Heartbeat) was just received from a charger."""
+        now = now or timezone.now()
+        charge_point.last_seen = now
+        if heartbeat:
+            charge_point.last_heartbeat = now
+        self._dirty[charge_point.pk] = charge_point
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _take(self):
+        dirty, self._dirty = self._dirty, {}
+        return list(dirty.values())
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        chargers = self._take()
+        started = time.perf_counter()
+        await self._write_async(chargers)
+        metrics.DB_WRITE_SECONDS.observe(time.perf_counter() - started, ChargePoint.__name__)
+        metrics.DB_ROWS_WRITTEN.inc(ChargePoint.__name__, amount=len(chargers))
+
+    def _write(self, chargers):
+        try:
+            ChargePoint.objects.bulk_update(chargers, self.fields, batch_size=self.batch_size)
+        except Exception as e:
+            # Timestamps only, the next touch marks the chargers dirty again
+            logger.error(f"❌ Could not update last seen of {len(chargers)} chargers: {e}")
+
+    def flush_sync(self):
+        """Flush from synchronous code (process shutdown)."""
+        if self._dirty:
+            self._write(self._take())
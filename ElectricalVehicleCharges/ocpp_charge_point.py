@@ -0,0 +1,644 @@
+# ocpp's ChargePoint (ocpp/charge_point.py of ocpp 2.0.0) with this project's
+# changes: route_message() returns the response and takes decoded frames, a
+# pending-call table with bounded concurrency, precompiled dispatch plans,
+# ResponseTemplates and the _send / _observe_stage hooks. It is part of the
+# package, so the stock ocpp from requirements.txt is all that is installed.
+import asyncio
+import functools
+import inspect
+import logging
+import re
+import time
+import uuid
+from dataclasses import Field, asdict, is_dataclass
+from typing import Any, Dict, List, Union, get_args, get_origin
+
+from ocpp.exceptions import NotImplementedError, NotSupportedError, OCPPError
+from ocpp.messages import (
+    Call,
+    CallError,
+    CallResult,
+    MessageType,
+    unpack,
+    validate_payload,
+)
+from ocpp.routing import create_route_map
+from ocpp.v16 import call as v16_call, call_result as v16_call_result
+
+LOGGER = logging.getLogger("ocpp")
+
+
+# The set of keys used by OCPP is small and fixed, so translated keys are
+# memoized. The caches are bounded because keys come from untrusted input.
+@functools.lru_cache(maxsize=4096)
+def _camel_to_snake_key(key):
+    key = key.replace("ocppCSMSURL", "ocpp_csms_url")
+    key = key.replace("V2X", "_v2x").replace("V2G", "_v2g")
+    s1 = re.sub("(.)([A-Z][a-z]+)", r"\1_\2", key)
+    return re.sub("([a-z0-9])([A-Z])(?=\\S)", r"\1_\2", s1).lower()
+
+
+@functools.lru_cache(maxsize=4096)
+def _snake_to_camel_key(key):
+    key = key.replace("soc", "SoC")
+    key = key.replace("_v2x", "V2X")
+    # The spec uses inconsent casing for "csms" and "url".
+    # E.g. "OcppCsmsUrl" vs "ResponderURL" and "CSMSRootCertificate"
+    key = key.replace("ocpp_csms_url", "ocppCsmsUrl")
+    key = key.replace("csms", "CSMS")
+    key = key.replace("_url", "URL")
+    key = key.replace("soc", "SoC").replace("_SoCket", "Socket")
+    key = key.replace("_v2x", "V2X")
+    key = key.replace("soc_limit_reached", "SOCLimitReached")
+    key = key.replace("_v2x", "V2X").replace("_v2g", "V2G")
+    components = key.split("_")
+    return components[0] + "".join(x[:1].upper() + x[1:] for x in components[1:])
+
+
+def camel_to_snake_case(data):
+    """
+    Convert all keys of all dictionaries inside the given argument from
+    camelCase to snake_case.
+
+    Inspired by: https://stackoverflow.com/a/1176023/1073222
+
+    """
+    if isinstance(data, dict):
+        return {
+            _camel_to_snake_key(key): camel_to_snake_case(value)
+            for key, value in data.items()
+        }
+
+    if isinstance(data, list):
+        snake_case_list = []
+        for value in data:
+            snake_case_list.append(camel_to_snake_case(value))
+
+        return snake_case_list
+
+    return data
+
+
+def snake_to_camel_case(data):
+    """
+    Convert all keys of all dictionaries inside given argument from
+    snake_case to camelCase.
+
+    Inspired by: https://stackoverflow.com/a/19053800/1073222
+    """
+    if isinstance(data, dict):
+        return {
+            _snake_to_camel_key(key): snake_to_camel_case(value)
+            for key, value in data.items()
+        }
+
+    if isinstance(data, list):
+        camel_case_list = []
+        for value in data:
+            camel_case_list.append(snake_to_camel_case(value))
+
+        return camel_case_list
+
+    return data
+
+
+def _is_dataclass_instance(input: Any) -> bool:
+    """Verify if given `input` is a dataclass."""
+    return is_dataclass(input) and not isinstance(input, type)
+
+
+def _is_optional_field(field: Field) -> bool:
+    """Verify if given `field` allows `None` as value.
+
+    The fields `schema` and `host` on the following class would return `False`.
+    While the fields `post` and `query` return `True`.
+
+        @dataclass
+        class URL:
+            schema: str,
+            host: str,
+            post: Optional[str],
+            query: Union[None, str]
+
+    """
+    return get_origin(field.type) is Union and type(None) in get_args(field.type)
+
+
+def serialize_as_dict(dataclass):
+    """Serialize the given `dataclass` as a `dict` recursively.
+
+    @dataclass
+    class StatusInfoType:
+        reason_code: str
+        additional_info: Optional[str] = None
+
+    with_additional_info = StatusInfoType(
+        reason="Unknown",
+        additional_info="More details"
+    )
+
+    assert serialize_as_dict(with_additional_info) == {
+        'reason': 'Unknown',
+        'additional_info': 'More details',
+    }
+
+    without_additional_info = StatusInfoType(reason="Unknown")
+
+    assert serialize_as_dict(with_additional_info) == {
+        'reason': 'Unknown',
+        'additional_info': None,
+    }
+
+    """
+    serialized = asdict(dataclass)
+
+    for field in dataclass.__dataclass_fields__.values():
+        value = getattr(dataclass, field.name)
+        if _is_dataclass_instance(value):
+            serialized[field.name] = serialize_as_dict(value)
+            continue
+
+        if isinstance(value, list):
+            serialized[field.name] = []
+            for item in value:
+                if _is_dataclass_instance(item):
+                    serialized[field.name].append(serialize_as_dict(item))
+                else:
+                    serialized[field.name].append(item)
+
+    return serialized
+
+
+def remove_nones(data: Union[List, Dict]) -> Union[List, Dict]:
+    if isinstance(data, dict):
+        return {k: remove_nones(v) for k, v in data.items() if v is not None}
+
+    elif isinstance(data, list):
+        return [remove_nones(v) for v in data if v is not None]
+
+    return data
+
+
+def _raise_key_error(action, version):
+    """
+    Checks whether a keyerror returned by _handle_call
+    is supported by the OCPP version or is simply
+    not implemented by the server/client and raises
+    the appropriate error.
+    """
+
+    from ocpp.v16.enums import Action as v16_Action
+    from ocpp.v201.enums import Action as v201_Action
+
+    if version == "1.6":
+        try:
+            v16_Action(action)
+            raise NotImplementedError(
+                details={"cause": f"No handler for {action} registered."}
+            )
+        except ValueError:
+            raise NotSupportedError(
+                details={"cause": f"{action} not supported by OCPP{version}."}
+            )
+    elif version in ["2.0", "2.0.1"]:
+        try:
+            v201_Action(action)
+            raise NotImplementedError(
+                details={"cause": f"No handler for {action} registered."}
+            )
+        except ValueError:
+            raise NotSupportedError(
+                details={"cause": f"{action} not supported by OCPP{version}."}
+            )
+
+    return
+
+
+class _DispatchPlan:
+    """
+    What _handle_call() needs to know about the handlers of one action.
+
+    None of it changes between messages, so it is worked out once per
+    ChargePoint class and action instead of inspecting signatures per message.
+    """
+
+    __slots__ = (
+        "has_on_action",
+        "has_after_action",
+        "on_action_wants_unique_id",
+        "after_action_wants_unique_id",
+        "skip_schema_validation",
+    )
+
+    def __init__(self, handlers):
+        on_action = handlers.get("_on_action")
+        after_action = handlers.get("_after_action")
+        self.has_on_action = on_action is not None
+        self.has_after_action = after_action is not None
+        self.on_action_wants_unique_id = self.has_on_action and (
+            "call_unique_id" in inspect.signature(on_action).parameters
+        )
+        self.after_action_wants_unique_id = self.has_after_action and (
+            "call_unique_id" in inspect.signature(after_action).parameters
+        )
+        self.skip_schema_validation = handlers.get("_skip_schema_validation", False)
+
+
+# Dispatch plans keyed by (ChargePoint class, action).
+_dispatch_plans = {}
+
+
+class ResponseTemplate:
+    """
+    Fast-path encoder for a CallResult whose payload always has the same shape.
+
+    `fields` maps each camelCase payload key to the dataclass attribute it is
+    read from and the type the value must have, e.g.:
+
+        ResponseTemplate({"currentTime": ("current_time", str)})
+
+    The first payload produced from the template is schema validated; after
+    that the template is trusted and per-message validation is skipped. A
+    response with a missing (None) or unexpected value makes encode() return
+    None, so that the generic path handles it.
+    """
+
+    def __init__(self, fields):
+        self._fields = [(key, attr, kind) for key, (attr, kind) in fields.items()]
+        self.validated = False
+
+    def encode(self, response):
+        payload = {}
+        for key, attr, kind in self._fields:
+            value = getattr(response, attr, None)
+            if not isinstance(value, kind):
+                return None
+            payload[key] = value
+        return payload
+
+
+class ChargePoint:
+    """
+    Base Element containing all the necessary OCPP1.6J messages for messages
+    initiated and received by the Central System
+    """
+
+    # ResponseTemplates for fixed-shape CallResults, keyed by call_result
+    # class. Subclasses fill this in for their high-frequency replies.
+    _response_templates = {}
+
+    def __init__(
+        self,
+        id,
+        connection,
+        response_timeout=30,
+        logger=LOGGER,
+        max_concurrent_calls=1,
+    ):
+        """
+
+        Args:
+
+            charger_id (str): ID of the charger.
+            connection: Connection to CP.
+            response_timeout (int): When no response on a request is received
+                within this interval, a asyncio.TimeoutError is raised.
+            logger: Optional Logger instance used for logging.
+                By default, the 'ocpp' logger is used.
+            max_concurrent_calls (int): Number of CALLs that may wait for a
+                response at the same time. OCPP allows one outstanding CALL
+                per connection, which is the default. Higher values are opt-in
+                for chargers known to handle pipelined requests.
+
+        """
+        self.id = id
+
+        # The maximum time in seconds it may take for a CP to respond to a
+        # CALL. An asyncio.TimeoutError will be raised if this limit has been
+        # exceeded.
+        self._response_timeout = response_timeout
+
+        # A connection to the client. Currently this is an instance of gh
+        self._connection = connection
+
+        # A dictionary that hooks for Actions. So if the CS receives a it will
+        # look up the Action into this map and execute the corresponding hooks
+        # if exists.
+        self.route_map = create_route_map(self)
+
+        # Limits the number of CALLs in flight. A caller that cannot get a
+        # slot within the response timeout gets an asyncio.TimeoutError, so
+        # commands for an unresponsive charger never pile up indefinitely.
+        self._call_semaphore = asyncio.Semaphore(max_concurrent_calls)
+
+        # (action, future) of the CALLs waiting for a response, keyed by
+        # unique id. route_message() resolves the futures as CallResults and
+        # CallErrors arrive, in whatever order that happens.
+        self._pending_calls = {}
+
+        # Function used to generate unique ids for CALLs. By default
+        # uuid.uuid4() is used, but it can be changed. This is meant primarily
+        # for testing purposes to have predictable unique ids.
+        self._unique_id_generator = uuid.uuid4
+
+        # The logger used to log messages
+        self.logger = logger
+
+    async def start(self):
+        while True:
+            message = await self._connection.recv()
+            self.logger.info("%s: receive message %s", self.id, message)
+
+            await self.route_message(message)
+
+    async def route_message(self, raw_msg):
+        """
+        Route a message received from a CP.
+
+        `raw_msg` is either the raw frame or a message the caller already
+        decoded with unpack(), so that a frame is never parsed twice.
+
+        If the message is a of type Call, the corresponding hooks are executed.
+        If the message is of type CallResult or CallError, the message is passed
+        to the call() waiting for it via its pending-call future.
+        """
+        if isinstance(raw_msg, (Call, CallResult, CallError)):
+            msg = raw_msg
+        else:
+            try:
+                msg = unpack(raw_msg)
+            except OCPPError as e:
+                self.logger.exception(
+                    "Unable to parse message: '%s', it doesn't seem "
+                    "to be valid OCPP: %s",
+                    raw_msg,
+                    e,
+                )
+                return {"error": "Invalid OCPP message"}
+
+        if msg.message_type_id == MessageType.Call:
+            try:
+                response = await self._handle_call(msg)
+                return response  # Returning response instead of just sending it
+            except OCPPError as error:
+                self.logger.exception("Error while handling request '%s'", msg)
+                response = msg.create_call_error(error).to_json()
+                await self._send(response, action=msg.action)
+                return response  # Return response for logging/debugging
+
+        elif msg.message_type_id in [MessageType.CallResult, MessageType.CallError]:
+            pending = self._pending_calls.get(msg.unique_id)
+            if pending is None or pending[1].done():
+                # Late (already timed out) or unsolicited response.
+                self.logger.error("Ignoring response with unknown unique id: %s", msg)
+                return {"status": "Response ignored"}
+            msg.action, response_future = pending
+            response_future.set_result(msg)
+            return {"status": "Response queued"}
+
+    async def _handle_call(self, msg):
+        """
+        Execute all hooks installed for based on the Action of the message.
+
+        First the '_on_action' hook is executed and its response is returned to
+        the client. If there is no '_on_action' hook for Action in the message
+        a CallError with a NotImplementedError is returned. If the Action is
+        not supported by the OCPP version a NotSupportedError is returned.
+
+        Next the '_after_action' hook is executed.
+
+        """
+        try:
+            handlers = self.route_map[msg.action]
+        except KeyError:
+            _raise_key_error(msg.action, self._ocpp_version)
+            return
+
+        plan = self._get_dispatch_plan(msg.action, handlers)
+
+        if not plan.has_on_action:
+            _raise_key_error(msg.action, self._ocpp_version)
+
+        if not plan.skip_schema_validation:
+            started = time.perf_counter()
+            await validate_payload(msg, self._ocpp_version)
+            self._observe_stage("validate", msg.action, time.perf_counter() - started)
+
+        # OCPP uses camelCase for the keys in the payload. It's more pythonic
+        # to use snake_case for keyword arguments. Therefore the keys must be
+        # 'translated'. Some examples:
+        #
+        # * chargePointVendor becomes charge_point_vendor
+        # * firmwareVersion becomes firmwareVersion
+        snake_case_payload = camel_to_snake_case(msg.payload)
+
+        handler = handlers["_on_action"]
+        started = time.perf_counter()
+        try:
+            # call_unique_id should be passed as kwarg only if is defined explicitly
+            # in the handler signature
+            if plan.on_action_wants_unique_id:
+                response = handler(**snake_case_payload, call_unique_id=msg.unique_id)
+            else:
+                response = handler(**snake_case_payload)
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as e:
+            self.logger.exception("Error while handling request '%s'", msg)
+            response = msg.create_call_error(e).to_json()
+            await self._send(response, action=msg.action)
+
+            return
+        self._observe_stage("handler", msg.action, time.perf_counter() - started)
+
+        # Fixed-shape responses are encoded straight from a template that was
+        # validated on first use; everything else takes the generic path.
+        template = self._response_templates.get(type(response))
+        camel_case_payload = template.encode(response) if template else None
+
+        if camel_case_payload is not None:
+            response = msg.create_call_result(camel_case_payload)
+            if not template.validated and not plan.skip_schema_validation:
+                started = time.perf_counter()
+                await validate_payload(response, self._ocpp_version)
+                self._observe_stage("validate", msg.action, time.perf_counter() - started)
+                template.validated = True
+        else:
+            temp_response_payload = serialize_as_dict(response)
+
+            # Remove nones ensures that we strip out optional arguments
+            # which were not set and have a default value of None
+            response_payload = remove_nones(temp_response_payload)
+
+            # The response payload must be 'translated' from snake_case to
+            # camelCase. So:
+            #
+            # * charge_point_vendor becomes chargePointVendor
+            # * firmware_version becomes firmwareVersion
+            camel_case_payload = snake_to_camel_case(response_payload)
+
+            response = msg.create_call_result(camel_case_payload)
+
+            if not plan.skip_schema_validation:
+                started = time.perf_counter()
+                await validate_payload(response, self._ocpp_version)
+                self._observe_stage("validate", msg.action, time.perf_counter() - started)
+
+        await self._send(response.to_json(), action=msg.action)
+
+        # '_on_after' hooks are not required.
+        if plan.has_after_action:
+            handler = handlers["_after_action"]
+            # call_unique_id should be passed as kwarg only if is defined explicitly
+            # in the handler signature
+            if plan.after_action_wants_unique_id:
+                after_response = handler(
+                    **snake_case_payload, call_unique_id=msg.unique_id
+                )
+            else:
+                after_response = handler(**snake_case_payload)
+            # Create task to avoid blocking when making a call inside the
+            # after handler
+            if inspect.isawaitable(after_response):
+                self._spawn(after_response)
+        return response
+
+    def _spawn(self, coroutine):
+        """
+        Run background work (after handlers) as a task. Subclasses override it
+        to choose the context the task runs in.
+        """
+        return asyncio.ensure_future(coroutine)
+
+    def _get_dispatch_plan(self, action, handlers):
+        """Return the cached dispatch plan for this class and action."""
+        key = (type(self), action)
+        plan = _dispatch_plans.get(key)
+        if plan is None:
+            plan = _DispatchPlan(handlers)
+            _dispatch_plans[key] = plan
+        return plan
+
+    async def call(
+        self, payload, suppress=True, unique_id=None, skip_schema_validation=False
+    ):
+        """
+        Send Call message to client and return payload of response.
+
+        The given payload is transformed into a Call object by looking at the
+        type of the payload. A payload of type BootNotificationPayload will
+        turn in a Call with Action BootNotification, a HeartbeatPayload will
+        result in a Call with Action Heartbeat etc.
+
+        A timeout is raised when no response has arrived before expiring of
+        the configured timeout.
+
+        By default only one Call can wait for a response at a time, which is
+        in line with the OCPP specification. Other callers wait for a free slot
+        for at most the response timeout. Responses are matched to their Call
+        by unique id, so a late or out of order response never blocks or
+        satisfies another Call.
+
+        Suppress is used to maintain backwards compatibility. When set to True,
+        if response is a CallError, then this call will be suppressed. When
+        set to False, an exception will be raised for users to handle this
+        CallError.
+
+        Schema validation can be skipped for the request and the response
+        for this call by setting `skip_schema_validation` to `True`.
+
+        """
+        camel_case_payload = snake_to_camel_case(serialize_as_dict(payload))
+
+        unique_id = (
+            unique_id if unique_id is not None else str(self._unique_id_generator())
+        )
+
+        action_name = payload.__class__.__name__
+
+        call = Call(
+            unique_id=unique_id,
+            action=action_name,
+            payload=remove_nones(camel_case_payload),
+        )
+
+        if not skip_schema_validation:
+            await validate_payload(call, self._ocpp_version)
+
+        if call.unique_id in self._pending_calls:
+            raise ValueError(
+                f"A Call with unique id {call.unique_id} is already waiting "
+                "for a response."
+            )
+
+        try:
+            await asyncio.wait_for(
+                self._call_semaphore.acquire(), self._response_timeout
+            )
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(
+                f"Waited {self._response_timeout}s for a free call slot for "
+                f"{call.to_json()}."
+            )
+
+        response_future = asyncio.get_running_loop().create_future()
+        self._pending_calls[call.unique_id] = (call.action, response_future)
+        try:
+            await self._send(call.to_json(), action=call.action)
+            response = await asyncio.wait_for(
+                response_future, self._response_timeout
+            )
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(
+                f"Waited {self._response_timeout}s for response on "
+                f"{call.to_json()}."
+            )
+        finally:
+            # Never leak the entry, whether the Call succeeded, timed out or
+            # was cancelled.
+            self._pending_calls.pop(call.unique_id, None)
+            self._call_semaphore.release()
+
+        if response.message_type_id == MessageType.CallError:
+            self.logger.warning("Received a CALLError: %s'", response)
+            if suppress:
+                return
+            raise response.to_exception()
+        elif not skip_schema_validation:
+            response.action = call.action
+            await validate_payload(response, self._ocpp_version)
+
+        snake_case_payload = camel_to_snake_case(response.payload)
+        # Create the correct Payload instance based on the received payload. If
+        # this method is called with a call.BootNotificationPayload, then it
+        # will create a call_result.BootNotificationPayload. If this method is
+        # called with a call.HeartbeatPayload, then it will create a
+        # call_result.HeartbeatPayload etc.
+        cls = getattr(self._call_result, payload.__class__.__name__)  # noqa
+        return cls(**snake_case_payload)
+
+    def _observe_stage(self, stage, action, seconds):
+        """
+        Called with the duration of the 'validate' and 'handler' stages of an
+        incoming Call. Subclasses override it to feed metrics or traces.
+        """
+
+    def _pending_call_action(self, unique_id):
+        """Return the action of the outstanding CALL with this id, if any."""
+        pending = self._pending_calls.get(unique_id)
+        return pending[0] if pending is not None else None
+
+    async def _send(self, message, action=None):
+        """
+        Send a serialized frame. `action` is the OCPP action the frame belongs
+        to, for subclasses that want to record outbound traffic.
+        """
+        self.logger.info("%s: send %s", self.id, message)
+        await self._connection.send(message)
+
+
+class ChargePointV16(ChargePoint):
+    """OCPP 1.6 flavour, as ocpp.v16.ChargePoint is of the stock class."""
+    _call = v16_call
+    _call_result = v16_call_result
+    _ocpp_version = "1.6"
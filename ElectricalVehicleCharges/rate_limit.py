@@ -0,0 +1,66 @@
+import time
+
+# Limits table key that applies to every inbound Call of a connection
+ALL_CALLS = "*"
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, now=None):
+        """Take a token: 0 if one was available, else the seconds until the next one."""
+        now = now if now is not None else time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+def limits_for(charge_point_model, limits, limits_by_model):
+    """
+    {action: (rate, burst)} for a charger: the model's entries override the
+    defaults action by action, a null entry removes the limit.
+    """
+    merged = {**limits, **limits_by_model.get(charge_point_model or "", {})}
+    return {action: tuple(limit) for action, limit in merged.items() if limit}
+
+
+class RateLimiter:
+    """
+    Inbound token buckets of one connection: ALL_CALLS for every Call and one
+    per action. `check` says how long a Call would have to wait for its
+    tokens; nothing is taken unless the Call is let through.
+    """
+
+    def __init__(self, limits):
+        self.buckets = {action: TokenBucket(rate, burst) for action, (rate, burst) in limits.items()}
+
+    def check(self, action):
+        """0 if the Call may be handled now, else the seconds until it may."""
+        now = time.monotonic()
+        taken = []
+        for key in (ALL_CALLS, action):
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                continue
+            wait = bucket.take(now)
+            if wait:
+                for other in taken:
+                    other.refund()
+                return wait
+            taken.append(bucket)
+        return 0.0
@@ -11,7 +11,9 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
+import socket
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -151,11 +153,157 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Redis instances the channel layer is sharded over, comma separated host:port pairs or redis:// URLs
+CHANNEL_REDIS_HOSTS = []
+for host in filter(None, map(str.strip, os.getenv("CHANNEL_REDIS_HOSTS", "redis:6379").split(","))):
+    if "://" in host:
+        CHANNEL_REDIS_HOSTS.append(host)
+    else:
+        name, _, port = host.partition(":")
+        CHANNEL_REDIS_HOSTS.append((name, int(port or 6379)))
+
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "api.channel_layers.ShardedRedisChannelLayer",
         "CONFIG": {
-            "hosts": [("redis", 6379)],  # ✅ Use Redis for channel layers
+            "hosts": CHANNEL_REDIS_HOSTS,  # ✅ Use Redis for channel layers
         },
     },
 }
+
+# CHANNEL_LAYER=memory swaps Redis for the in-process layer (benchmarks, single process runs)
+if os.getenv("CHANNEL_LAYER") == "memory":
+    CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+# OCPP message log write-behind buffer (see ElectricalVehicleCharges/write_behind.py)
+MESSAGE_LOG_BATCH_SIZE = int(os.getenv("MESSAGE_LOG_BATCH_SIZE", 500))  # Rows per bulk_create
+MESSAGE_LOG_FLUSH_INTERVAL = float(os.getenv("MESSAGE_LOG_FLUSH_INTERVAL", 1.0))  # Seconds between flushes
+MESSAGE_LOG_MAX_PENDING = int(os.getenv("MESSAGE_LOG_MAX_PENDING", 10000))  # Rows kept in memory at most
+MESSAGE_LOG_OVERFLOW_POLICY = os.getenv("MESSAGE_LOG_OVERFLOW_POLICY", "drop")  # "drop" or "block" when full
+
+# Outbound OCPP calls allowed in flight per charger connection. OCPP 1.6
+# expects one at a time; raise only for chargers that accept pipelined calls.
+OCPP_MAX_CONCURRENT_CALLS = int(os.getenv("OCPP_MAX_CONCURRENT_CALLS", 1))
+
+# Seconds the FastAPI endpoints wait for a charger to answer a remote command
+OCPP_COMMAND_TIMEOUT = float(os.getenv("OCPP_COMMAND_TIMEOUT", 30))
+
+# Seconds a cached charger stays valid in the in-process registry (api/registry.py).
+# Saves and deletes in the same process invalidate entries immediately.
+CHARGER_REGISTRY_TTL = int(os.getenv("CHARGER_REGISTRY_TTL", 300))
+
+# Identifies this process in metrics, traces and presence data
+NODE_ID = os.getenv("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+# Redis used for cross-process state (metrics, presence); the channel layer has its own config
+REDIS_URL = os.getenv("REDIS_URL", f"redis://{os.getenv('REDIS_HOST', 'redis')}:6379/0")
+
+# Seconds between metric snapshots published to Redis for the /metrics endpoint
+METRICS_PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", 10))
+
+# Per-message tracing (api/tracing.py): share of frames traced, frames slower
+# than the threshold are always traced, and how many traces are kept
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+TRACE_SLOW_THRESHOLD_MS = float(os.getenv("TRACE_SLOW_THRESHOLD_MS", 250))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 1000))
+
+# MeterValues sample store write-behind buffer; samples feed energy analytics, so block rather than drop by default
+METER_SAMPLES_BATCH_SIZE = int(os.getenv("METER_SAMPLES_BATCH_SIZE", 1000))
+METER_SAMPLES_FLUSH_INTERVAL = float(os.getenv("METER_SAMPLES_FLUSH_INTERVAL", 2.0))
+METER_SAMPLES_MAX_PENDING = int(os.getenv("METER_SAMPLES_MAX_PENDING", 50000))
+METER_SAMPLES_OVERFLOW_POLICY = os.getenv("METER_SAMPLES_OVERFLOW_POLICY", "block")
+
+# OCPP transaction ids reserved from the database per process at a time (api/transactions.py)
+TRANSACTION_ID_BLOCK_SIZE = int(os.getenv("TRANSACTION_ID_BLOCK_SIZE", 100))
+
+# Seconds between bulk writes of ChargePoint.last_seen / last_heartbeat, and chargers per UPDATE.
+# The in-memory values are current regardless; a longer interval only delays what other processes see.
+LAST_SEEN_FLUSH_INTERVAL = float(os.getenv("LAST_SEEN_FLUSH_INTERVAL", 30))
+LAST_SEEN_BATCH_SIZE = int(os.getenv("LAST_SEEN_BATCH_SIZE", 1000))
+
+# Presence of connected chargers in Redis (api/presence.py): entry TTL and how often the owning
+# node refreshes it, how often API processes re-read the cluster view, and how often is_online
+# is reconciled with Postgres
+PRESENCE_TTL = int(os.getenv("PRESENCE_TTL", 90))
+PRESENCE_REFRESH_INTERVAL = float(os.getenv("PRESENCE_REFRESH_INTERVAL", 30))
+PRESENCE_MIRROR_INTERVAL = float(os.getenv("PRESENCE_MIRROR_INTERVAL", 5))
+PRESENCE_RECONCILE_INTERVAL = float(os.getenv("PRESENCE_RECONCILE_INTERVAL", 60))
+
+# Id tag authorization cache (api/authorization.py): tags kept in memory, seconds a cached tag
+# and an unknown tag stay valid, and whether tags missing from the list are accepted (the default,
+# as before the list existed; set to false once every tag in use is in the IdTag table)
+ID_TAG_CACHE_SIZE = int(os.getenv("ID_TAG_CACHE_SIZE", 500000))
+ID_TAG_CACHE_TTL = int(os.getenv("ID_TAG_CACHE_TTL", 300))
+ID_TAG_MISSING_TTL = int(os.getenv("ID_TAG_MISSING_TTL", 30))
+ID_TAG_ACCEPT_UNKNOWN = os.getenv("ID_TAG_ACCEPT_UNKNOWN", "true").lower() == "true"
+
+# Message log retention (python manage.py messages_partitions maintain, run daily): days of messages
+# kept, daily partitions created ahead of time, and where expired days are archived as .jsonl.gz
+MESSAGE_RETENTION_DAYS = int(os.getenv("MESSAGE_RETENTION_DAYS", 30))
+MESSAGE_PARTITION_PREMAKE_DAYS = int(os.getenv("MESSAGE_PARTITION_PREMAKE_DAYS", 7))
+MESSAGE_ARCHIVE_DIR = os.getenv("MESSAGE_ARCHIVE_DIR", os.path.join(BASE_DIR, "archive", "messages"))
+
+# Fleet-wide commands (api/command_jobs.py): commands in flight per job by default and at most,
+# seconds between writes of results and progress, results per bulk insert, and seconds without a
+# progress write after which a running job is marked interrupted (its process went away)
+BULK_COMMAND_CONCURRENCY = int(os.getenv("BULK_COMMAND_CONCURRENCY", 500))
+BULK_COMMAND_MAX_CONCURRENCY = int(os.getenv("BULK_COMMAND_MAX_CONCURRENCY", 2000))
+BULK_COMMAND_FLUSH_INTERVAL = float(os.getenv("BULK_COMMAND_FLUSH_INTERVAL", 1.0))
+BULK_COMMAND_RESULT_BATCH_SIZE = int(os.getenv("BULK_COMMAND_RESULT_BATCH_SIZE", 500))
+BULK_COMMAND_STALE_AFTER = float(os.getenv("BULK_COMMAND_STALE_AFTER", 60))
+
+# Inbound rate limits per charger connection (ElectricalVehicleCharges/rate_limit.py), as
+# {"action": [calls per second, burst]}; "*" covers every Call. OCPP_RATE_LIMITS_BY_MODEL overrides
+# them per charge_point_model, e.g. {"EVSE-123": {"MeterValues": [10, 50]}}, null removes a limit.
+# Over the limit a Call is delayed (policy "delay", up to OCPP_RATE_LIMIT_MAX_DELAY seconds) or
+# answered with a CallError (policy "reject", or when the delay would be longer).
+OCPP_RATE_LIMITS = json.loads(os.getenv("OCPP_RATE_LIMITS") or json.dumps({
+    "*": [10, 50],
+    "MeterValues": [2, 20],
+    "StatusNotification": [5, 20],
+    "Heartbeat": [1, 5],
+    "Authorize": [2, 10],
+    "StartTransaction": [1, 5],
+    "StopTransaction": [1, 5],
+    "BootNotification": [0.1, 3],
+}))
+OCPP_RATE_LIMITS_BY_MODEL = json.loads(os.getenv("OCPP_RATE_LIMITS_BY_MODEL") or "{}")
+OCPP_RATE_LIMIT_POLICY = os.getenv("OCPP_RATE_LIMIT_POLICY", "delay")
+OCPP_RATE_LIMIT_MAX_DELAY = float(os.getenv("OCPP_RATE_LIMIT_MAX_DELAY", 2.0))
+
+# Admission control during reconnect storms (ElectricalVehicleCharges/admission.py). Connections are
+# refused while the event loop lags more than ADMISSION_MAX_LOOP_LAG seconds or more than
+# ADMISSION_MAX_DB_QUEUE database calls are queued; above ADMISSION_MAX_CONNECT_RATE new connections
+# per second (or under that load) BootNotification is answered Pending, retry after about
+# BOOT_PENDING_INTERVAL seconds. Heartbeat intervals start at HEARTBEAT_INTERVAL and widen so that
+# the fleet sends about HEARTBEAT_TARGET_RATE heartbeats per second, up to HEARTBEAT_MAX_INTERVAL.
+ADMISSION_MAX_CONNECT_RATE = float(os.getenv("ADMISSION_MAX_CONNECT_RATE", 200))
+ADMISSION_MAX_LOOP_LAG = float(os.getenv("ADMISSION_MAX_LOOP_LAG", 0.25))
+ADMISSION_MAX_DB_QUEUE = int(os.getenv("ADMISSION_MAX_DB_QUEUE", 200))
+BOOT_PENDING_INTERVAL = int(os.getenv("BOOT_PENDING_INTERVAL", 30))
+HEARTBEAT_INTERVAL = int(os.getenv("HEARTBEAT_INTERVAL", 60))
+HEARTBEAT_TARGET_RATE = float(os.getenv("HEARTBEAT_TARGET_RATE", 100))
+HEARTBEAT_MAX_INTERVAL = int(os.getenv("HEARTBEAT_MAX_INTERVAL", 900))
+
+# Outbox of commands for offline chargers (api/outbox.py): seconds a queued command stays valid by
+# default and at most, commands read per query when a charger connects, and deliveries tried
+# before a command that gets no answer is given up
+OUTBOX_DEFAULT_TTL = int(os.getenv("OUTBOX_DEFAULT_TTL", 86400))
+OUTBOX_MAX_TTL = int(os.getenv("OUTBOX_MAX_TTL", 7 * 86400))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 20))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 3))
+
+# Hourly usage rollups (api/usage.py): run by Celery beat (ROLLUP_RUNNER=celery, start a worker
+# and beat) or on the FastAPI event loop (ROLLUP_RUNNER=inprocess) every ROLLUP_INTERVAL seconds,
+# reading only rows older than ROLLUP_SAFETY_LAG seconds
+ROLLUP_RUNNER = os.getenv("ROLLUP_RUNNER", "celery")
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", 60))
+ROLLUP_SAFETY_LAG = int(os.getenv("ROLLUP_SAFETY_LAG", 60))
+
+# Celery (ElectricalVehicleCharges/celery.py); CELERY_TASK_ALWAYS_EAGER=true runs tasks in the caller
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", REDIS_URL)
+CELERY_TASK_ALWAYS_EAGER = os.getenv("CELERY_TASK_ALWAYS_EAGER", "false").lower() == "true"
+CELERY_BEAT_SCHEDULE = {
+    "usage-rollups": {"task": "api.tasks.update_usage_rollups_task", "schedule": ROLLUP_INTERVAL},
+}
@@ -0,0 +1,136 @@
+import asyncio
+import atexit
+import logging
+import time
+from collections import deque
+from django.db import transaction
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP = "drop"
+OVERFLOW_BLOCK = "block"
+
+
+class WriteBehindBuffer:
+    """
+    Per-process write-behind buffer for append-only model rows.
+
+    Rows are collected in memory off the hot path and written with
+    ``bulk_create`` once ``batch_size`` rows are pending or ``flush_interval``
+    seconds have passed, whichever comes first. At most ``max_pending`` rows are
+    kept in memory; when the buffer is full ``overflow_policy`` decides whether
+    new rows are dropped ("drop") or the producer waits for a flush ("block").
+    Whatever is still pending when the process exits is flushed synchronously.
+    ``after_write``, if given, is called in the database thread with the rows of
+    each batch that made it to the database.
+    """
+
+    def __init__(self, model, batch_size=500, flush_interval=1.0, max_pending=10000, overflow_policy=OVERFLOW_DROP,
+                 after_write=None):
+        if overflow_policy not in (OVERFLOW_DROP, OVERFLOW_BLOCK):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.overflow_policy = overflow_policy
+        self.after_write = after_write
+        self.dropped = 0
+        self._pending = deque()
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._task = None
+        self._write_async = metrics.timed_database_sync_to_async(self._write)
+        atexit.register(self.flush_sync)
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def put(self, **fields):
+        """Queue one row; returns without touching the database."""
+        if len(self._pending) >= self.max_pending:
+            if self.overflow_policy == OVERFLOW_DROP:
+                self.dropped += 1
+                metrics.DB_ROWS_DROPPED.inc(self.model.__name__)
+                if self.dropped == 1 or self.dropped % 1000 == 0:
+                    logger.warning(f"⚠️ {self.model.__name__} buffer full, dropped {self.dropped} rows so far")
+                return
+            self._ensure_started()
+            while len(self._pending) >= self.max_pending:
+                self._wakeup.set()
+                self._drained.clear()
+                await self._drained.wait()
+
+        self._pending.append(self.model(**fields))
+        self._ensure_started()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _take_batch(self):
+        size = min(self.batch_size, len(self._pending))
+        return [self._pending.popleft() for _ in range(size)]
+
+    async def flush(self):
+        """Write everything that is pending, one batch at a time."""
+        table = self.model.__name__
+        while self._pending:
+            batch = self._take_batch()
+            started = time.perf_counter()
+            written = await self._write_async(batch)
+            metrics.DB_WRITE_SECONDS.observe(time.perf_counter() - started, table)
+            metrics.DB_ROWS_WRITTEN.inc(table, amount=written)
+            self._drained.set()
+        self._drained.set()
+
+    def _write(self, batch):
+        """Insert a batch, returning the number of rows written."""
+        try:
+            self.model.objects.bulk_create(batch)
+            written = batch
+        except Exception as e:
+            # One bad row must not cost the whole batch, retry them one by one.
+            logger.error(f"❌ Bulk insert of {len(batch)} {self.model.__name__} rows failed: {e}")
+            written = []
+            for obj in batch:
+                try:
+                    with transaction.atomic():
+                        obj.save(force_insert=True)
+                    written.append(obj)
+                except Exception as row_error:
+                    logger.error(f"❌ Dropping {self.model.__name__} row: {row_error}")
+        if self.after_write is not None and written:
+            try:
+                self.after_write(written)
+            except Exception as e:
+                logger.error(f"❌ after_write of {self.model.__name__} failed: {e}", exc_info=True)
+        return len(written)
+
+    def flush_sync(self):
+        """Flush pending rows from synchronous code (process shutdown)."""
+        while self._pending:
+            self._write(self._take_batch())
+
+    async def close(self):
+        """Stop the background flusher and write what is left."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -1,15 +1,117 @@
 from django.contrib import admin
-from .models import ChargePoint , Connector , Transaction , Messages
-# Register your models here.
+from django.core.paginator import Paginator
+from django.db import connections
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .models import ChargePoint , Connector , Transaction , Messages , IdTag
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that does not COUNT(*) large tables. An unfiltered changelist
+    on PostgreSQL uses the planner's row estimate (summed over partitions);
+    a filtered one counts at most `exact_limit` + 1 matching rows.
+    """
+    exact_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.estimate(queryset)
+            if estimate is not None and estimate > self.exact_limit:
+                return estimate
+        return queryset.order_by()[:self.exact_limit + 1].count()
+
+    @staticmethod
+    def estimate(queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+        table = queryset.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT SUM(GREATEST(reltuples, 0)) FROM pg_class
+                WHERE oid = %s::regclass OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)
+                """,
+                [table, table],
+            )
+            estimate = cursor.fetchone()[0]
+        return int(estimate) if estimate is not None else None
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables that grow with the fleet."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
 @admin.register(ChargePoint)
-class ChargePointAdmin(admin.ModelAdmin):
-    pass
+class ChargePointAdmin(LargeTableAdmin):
+    list_display = ('name', 'status', 'is_online', 'firmware_version', 'last_seen', 'message_log')
+    list_filter = ('is_online', 'status')
+    search_fields = ('=name',)
+    ordering = ('name',)
+    readonly_fields = ('last_seen', 'last_heartbeat', 'created_at', 'updated_at')
+
+    @admin.display(description='Messages')
+    def message_log(self, charge_point):
+        url = reverse('admin:api_messages_changelist')
+        return format_html('<a href="{}?charge_point__id__exact={}">Messages</a>', url, charge_point.pk)
+
+
 @admin.register(Connector)
-class ConnectorAdmin(admin.ModelAdmin):
-    pass
+class ConnectorAdmin(LargeTableAdmin):
+    list_display = ('id', 'charge_point', 'number', 'type', 'power_type', 'status')
+    list_select_related = ('charge_point',)
+    list_filter = ('status', 'power_type')
+    raw_id_fields = ('charge_point',)
+    search_fields = ('=charge_point__name',)
+
+
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
-    pass
+class TransactionAdmin(LargeTableAdmin):
+    list_display = ('transaction_id', 'charge_point', 'connector_number', 'id_tag', 'status',
+                    'start_time', 'stop_time', 'meter_start', 'meter_stop')
+    list_select_related = ('charge_point',)
+    list_filter = ('status',)
+    date_hierarchy = 'start_time'
+    raw_id_fields = ('charge_point', 'connector')
+    search_fields = ('=id_tag',)
+    ordering = ('-start_time',)
+
+
+@admin.register(IdTag)
+class IdTagAdmin(LargeTableAdmin):
+    list_display = ('id_tag', 'status', 'expiry_date', 'parent_id_tag', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('=id_tag', '=parent_id_tag')
+    ordering = ('-updated_at',)
+
+
 @admin.register(Messages)
-class MessagesAdmin(admin.ModelAdmin):
-    pass
\ No newline at end of file
+class MessagesAdmin(LargeTableAdmin):
+    """
+    Read-only view of the message log. There is no date hierarchy, it would
+    scan the whole table for its links; the timestamp filter uses ranges instead.
+    Open a charger's log from the Messages link on the charge point list.
+    """
+    list_display = ('timestamp', 'charge_point', 'message_type', 'direction')
+    list_select_related = ('charge_point',)
+    list_filter = ('message_type', 'direction', 'timestamp')
+    ordering = ('-timestamp', '-message_id')
+    fields = ('message_id', 'charge_point', 'message_type', 'direction', 'timestamp', 'payload')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # Old messages are dropped by the messages_partitions command
+        return False
@@ -0,0 +1,125 @@
+import logging
+import time
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from api.metrics import timed_database_sync_to_async
+from api.models import IdTag
+
+logger = logging.getLogger(__name__)
+
+# What the cache keeps per tag: a tuple instead of a model instance, there may be millions
+TagInfo = namedtuple("TagInfo", ["status", "expiry_date", "parent_id_tag"])
+
+INVALID = {"status": "Invalid"}
+
+
+class IdTagCache:
+    """
+    LRU + TTL cache in front of the IdTag table, answering Authorize and
+    StartTransaction without a query.
+
+    The list is bulk loaded at startup (at most `max_size` tags, most recently
+    changed first); after that a miss costs one query and the least recently
+    used tag makes room for it. Unknown tags are cached too, for
+    `missing_ttl` seconds, so a charger retrying a bad card does not reach
+    the database every time. Saves and deletes in this process invalidate
+    entries immediately, the TTL bounds how long changes made elsewhere go
+    unnoticed.
+    """
+
+    def __init__(self, max_size=500000, ttl=300, missing_ttl=30, accept_unknown=False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.accept_unknown = accept_unknown
+        self._entries = OrderedDict()  # id tag -> (TagInfo or None, expires at), least recently used first
+        self._loaded = False
+        self._get_async = timed_database_sync_to_async(self.get)
+
+    def _store(self, id_tag, info, ttl):
+        self._entries[id_tag] = (info, time.monotonic() + ttl)
+        self._entries.move_to_end(id_tag)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def preload(self):
+        """Load the authorization list in one pass."""
+        rows = (
+            IdTag.objects.order_by("-updated_at")
+            .values_list("id_tag", "status", "expiry_date", "parent_id_tag")[:self.max_size]
+        )
+        expires_at = time.monotonic() + self.ttl
+        entries = OrderedDict(
+            (id_tag, (TagInfo(status, expiry_date, parent), expires_at))
+            for id_tag, status, expiry_date, parent in rows.iterator(chunk_size=10000)
+        )
+        self._entries = entries
+        self._loaded = True
+        logger.info(f"🪪 Id tag cache loaded {len(entries)} tags")
+
+    def _cached(self, id_tag):
+        entry = self._entries.get(id_tag)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(id_tag)
+            return entry
+        return None
+
+    def get(self, id_tag):
+        """TagInfo of a tag, or None if it is not on the list. Sync version."""
+        if not self._loaded:
+            self.preload()
+        entry = self._cached(id_tag)
+        if entry is not None:
+            return entry[0]
+        row = IdTag.objects.filter(id_tag=id_tag).values_list("status", "expiry_date", "parent_id_tag").first()
+        info = TagInfo(*row) if row else None
+        self._store(id_tag, info, self.ttl if info else self.missing_ttl)
+        return info
+
+    async def aget(self, id_tag):
+        """TagInfo of a tag, or None, without a thread hop on a hit."""
+        entry = self._cached(id_tag) if self._loaded else None
+        if entry is not None:
+            return entry[0]
+        return await self._get_async(id_tag)
+
+    def id_tag_info(self, info, now=None):
+        """OCPP idTagInfo for a TagInfo (or None for an unknown tag)."""
+        if info is None:
+            return {"status": "Accepted"} if self.accept_unknown else INVALID
+        status = info.status
+        if status == "Accepted" and info.expiry_date is not None and info.expiry_date <= (now or timezone.now()):
+            status = "Expired"
+        id_tag_info = {"status": status}
+        if info.expiry_date is not None:
+            id_tag_info["expiry_date"] = info.expiry_date.isoformat()
+        if info.parent_id_tag:
+            id_tag_info["parent_id_tag"] = info.parent_id_tag
+        return id_tag_info
+
+    async def authorize(self, id_tag):
+        """idTagInfo to answer an Authorize or StartTransaction with."""
+        return self.id_tag_info(await self.aget(id_tag))
+
+    def invalidate(self, id_tag):
+        self._entries.pop(id_tag, None)
+
+    def clear(self):
+        self._entries = OrderedDict()
+        self._loaded = False
+
+
+id_tags = IdTagCache(
+    max_size=settings.ID_TAG_CACHE_SIZE,
+    ttl=settings.ID_TAG_CACHE_TTL,
+    missing_ttl=settings.ID_TAG_MISSING_TTL,
+    accept_unknown=settings.ID_TAG_ACCEPT_UNKNOWN,
+)
+
+
+@receiver([post_save, post_delete], sender=IdTag)
+def invalidate_id_tag(sender, instance, **kwargs):
+    id_tags.invalidate(instance.id_tag)
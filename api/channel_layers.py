@@ -0,0 +1,49 @@
+import bisect
+import hashlib
+from channels_redis.core import RedisChannelLayer
+
+
+def _hash(value):
+    if isinstance(value, str):
+        value = value.encode("utf8")
+    return int.from_bytes(hashlib.md5(value).digest()[:8], "big")
+
+
+def _host_key(host):
+    """Stable identity of a decoded channels_redis host entry."""
+    if "address" in host:
+        return str(host["address"])
+    return f"{host.get('host')}:{host.get('port')}"
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    RedisChannelLayer that spreads channels over its hosts with a consistent
+    hash ring (`replicas` virtual nodes per host) instead of CRC32 modulo the
+    number of hosts, so adding a Redis instance moves about 1/N of the
+    channels rather than nearly all of them.
+
+    Process-specific channels ("specific.<client>!<id>") are placed by their
+    process part, on send as well as on receive: the stock layer hashes the
+    full name on send, which only works with a single host.
+    """
+
+    def __init__(self, hosts=None, replicas=160, **kwargs):
+        super().__init__(hosts=hosts, **kwargs)
+        ring = sorted(
+            (_hash(f"{_host_key(host)}#{replica}"), index)
+            for index, host in enumerate(self.hosts)
+            for replica in range(replicas)
+        )
+        self._ring_points = [point for point, _ in ring]
+        self._ring_hosts = [index for _, index in ring]
+
+    def consistent_hash(self, value):
+        if self.ring_size == 1:
+            return 0
+        if isinstance(value, bytes):
+            value = value.decode("utf8")
+        if "!" in value:
+            value = self.non_local_name(value)
+        position = bisect.bisect(self._ring_points, _hash(value)) % len(self._ring_points)
+        return self._ring_hosts[position]
@@ -0,0 +1,340 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import timedelta
+from typing import Optional
+from django.conf import settings
+from django.utils import timezone
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from channels.layers import get_channel_layer
+from api import rpc
+from api.metrics import timed_database_sync_to_async
+from api.models import ChargePoint, CommandJob, CommandJobResult
+from api.presence import presence
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Result of a charger that was not connected when its turn came; nothing was sent
+STATUS_OFFLINE = "offline"
+
+# ChargePoint lookups a target filter may use
+FILTER_FIELDS = {
+    "status", "is_online", "firmware_version", "charge_point_model", "charge_point_vendor",
+    "name__startswith", "location",
+}
+
+
+class CommandTargets(BaseModel):
+    all: bool = False
+    charger_ids: Optional[list[str]] = None
+    filter: Optional[dict] = None  # ChargePoint field lookups, see FILTER_FIELDS
+
+
+class BulkCommand(BaseModel):
+    action: str  # OCPP action, e.g. ChangeConfiguration
+    payload: dict = {}  # Call fields in snake_case, e.g. {"key": "HeartbeatInterval", "value": "300"}
+    targets: CommandTargets
+    concurrency: Optional[int] = Field(None, ge=1)
+    timeout: Optional[float] = Field(None, gt=0)
+
+
+def target_ids(selector):
+    """Charger ids matching a CommandTargets selector, as stored in CommandJob.selector."""
+    chargers = ChargePoint.objects.all()
+    if selector.get("charger_ids") is not None:
+        ids = []
+        for charger_id in selector["charger_ids"]:
+            try:
+                ids.append(uuid.UUID(charger_id))
+            except ValueError:
+                raise ValueError(f"Invalid charger id {charger_id!r}")
+        chargers = chargers.filter(id__in=ids)
+    if selector.get("filter"):
+        unknown = set(selector["filter"]) - FILTER_FIELDS
+        if unknown:
+            raise ValueError(f"Unsupported filter fields {sorted(unknown)}, use {sorted(FILTER_FIELDS)}")
+        chargers = chargers.filter(**selector["filter"])
+    elif not selector.get("all") and selector.get("charger_ids") is None:
+        raise ValueError("Select targets with all, charger_ids or filter")
+    return [str(charger_id) for charger_id in chargers.order_by("id").values_list("id", flat=True).iterator()]
+
+
+def create_job(command, selector):
+    """The CommandJob for a validated BulkCommand, and the chargers it goes to."""
+    charger_ids = target_ids(selector)
+    job = CommandJob.objects.create(
+        action=command.action,
+        payload=command.payload,
+        selector=selector,
+        concurrency=min(command.concurrency or settings.BULK_COMMAND_CONCURRENCY, settings.BULK_COMMAND_MAX_CONCURRENCY),
+        timeout=command.timeout or settings.OCPP_COMMAND_TIMEOUT,
+        total=len(charger_ids),
+    )
+    return job, charger_ids
+
+
+def job_summary(job):
+    return {
+        "job_id": str(job.id),
+        "action": job.action,
+        "status": job.status,
+        "total": job.total,
+        "succeeded": job.succeeded,
+        "failed": job.failed,
+        "pending": job.total - job.succeeded - job.failed,
+        "concurrency": job.concurrency,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def read_results(job_id, after=0, limit=1000, status=None):
+    results = CommandJobResult.objects.filter(job_id=job_id, id__gt=after)
+    if status:
+        results = results.filter(status=status)
+    return [
+        {
+            "id": row["id"],
+            "charger_id": str(row["charge_point_id"]),
+            "status": row["status"],
+            "result": row["result"],
+            "error": row["error"],
+            "finished_at": row["finished_at"].isoformat(),
+        }
+        for row in results.order_by("id").values(
+            "id", "charge_point_id", "status", "result", "error", "finished_at"
+        )[:limit]
+    ]
+
+
+class CommandJobRunner:
+    """
+    Sends a job's command to its chargers through the consumers, at most
+    `job.concurrency` at a time, and records the outcomes.
+
+    A fixed pool of workers takes chargers off a shared iterator, so 20k
+    targets never mean 20k outstanding requests on the channel layer.
+    Chargers the presence mirror does not know are recorded as offline
+    without sending anything. Results are written in batches together with
+    the job's counters. A job canceled from any process is noticed at the
+    next flush; workers then finish the charger they are on and take no
+    new ones.
+    """
+
+    def __init__(self, job, charger_ids, channel_layer, flush_interval=1.0, batch_size=500):
+        self.job = job
+        self.charger_ids = charger_ids
+        self.channel_layer = channel_layer
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending = []
+        self.canceled = False
+        self._write_async = timed_database_sync_to_async(self._write)
+
+    async def run(self):
+        targets = iter(self.charger_ids)
+        workers = [
+            asyncio.ensure_future(self.worker(targets))
+            for _ in range(min(self.job.concurrency, len(self.charger_ids)) or 1)
+        ]
+        flusher = asyncio.ensure_future(self.flush_periodically())
+        started = time.perf_counter()
+        try:
+            outcomes = await asyncio.gather(*workers, return_exceptions=True)
+            errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+            for error in errors:
+                logger.error(f"❌ Command job {self.job.id} worker failed: {error}")
+            self.job.status = "failed" if errors else "canceled" if self.canceled else "completed"
+        except asyncio.CancelledError:
+            self.job.status = "canceled"
+            raise
+        finally:
+            for task in workers + [flusher]:
+                task.cancel()
+            self.job.finished_at = timezone.now()
+            await asyncio.shield(self.flush())
+            if self.canceled:
+                self.job.status = "canceled"
+            logger.info(
+                f"📣 {self.job.action} to {self.job.total} chargers {self.job.status} in "
+                f"{time.perf_counter() - started:.1f}s: {self.job.succeeded} ok, {self.job.failed} failed"
+            )
+
+    async def worker(self, targets):
+        for charger_id in targets:
+            if self.canceled:
+                return
+            if not presence.is_connected(charger_id):
+                self.record(charger_id, {"status": STATUS_OFFLINE, "error": "Charger is not connected"})
+                continue
+            try:
+                reply = await rpc.send_command(
+                    self.channel_layer, charger_id, self.job.action, self.job.payload, timeout=self.job.timeout
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                reply = {"status": rpc.STATUS_ERROR, "error": str(e)}
+            self.record(charger_id, reply)
+
+    def record(self, charger_id, reply):
+        if reply["status"] == rpc.STATUS_OK:
+            self.job.succeeded += 1
+        else:
+            self.job.failed += 1
+        self.pending.append(CommandJobResult(
+            job_id=self.job.id,
+            charge_point_id=charger_id,
+            status=reply["status"],
+            result=reply.get("result"),
+            error=reply.get("error"),
+        ))
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Shielded: when the job ends mid-flush, the rows already taken off
+            # self.pending are still written (before the final flush)
+            await asyncio.shield(self.flush())
+
+    async def flush(self):
+        rows, self.pending = self.pending, []
+        try:
+            self.canceled = await self._write_async(rows) or self.canceled
+        except Exception as e:
+            logger.error(f"❌ Failed to write {len(rows)} results of command job {self.job.id}: {e}")
+
+    def _write(self, rows):
+        """Store results and counters; True if the job was canceled meanwhile."""
+        for start in range(0, len(rows), self.batch_size):
+            CommandJobResult.objects.bulk_create(rows[start:start + self.batch_size], ignore_conflicts=True)
+        fields = {"succeeded": self.job.succeeded, "failed": self.job.failed, "heartbeat_at": timezone.now()}
+        # Cancellation is a status change made by whichever process got the
+        # request, and the final status is only written over "running"
+        if self.job.finished_at:
+            fields["finished_at"] = self.job.finished_at
+            if CommandJob.objects.filter(id=self.job.id, status="running").update(status=self.job.status, **fields):
+                return False
+            CommandJob.objects.filter(id=self.job.id).update(**fields)
+            return True
+        return not CommandJob.objects.filter(id=self.job.id, status="running").update(**fields)
+
+
+# Jobs run by this process, so they are not garbage collected while running
+running_jobs = {}
+
+
+def start_job(job, charger_ids, channel_layer=None):
+    runner = CommandJobRunner(
+        job,
+        charger_ids,
+        channel_layer or get_channel_layer(),
+        flush_interval=settings.BULK_COMMAND_FLUSH_INTERVAL,
+        batch_size=settings.BULK_COMMAND_RESULT_BATCH_SIZE,
+    )
+    task = asyncio.ensure_future(runner.run())
+    running_jobs[job.id] = task
+    task.add_done_callback(lambda _: running_jobs.pop(job.id, None))
+    return task
+
+
+def interrupt_orphaned_jobs(stale_after):
+    """
+    Mark running jobs whose process stopped writing progress (a restart, a
+    reload, a crash) `stale_after` seconds ago as interrupted; their number.
+    """
+    now = timezone.now()
+    return CommandJob.objects.filter(
+        status="running", heartbeat_at__lt=now - timedelta(seconds=stale_after)
+    ).update(status="interrupted", finished_at=now)
+
+
+async def reap_orphaned_jobs(interval, stale_after):
+    """Run interrupt_orphaned_jobs now and every `interval` seconds."""
+    while True:
+        try:
+            interrupted = await timed_database_sync_to_async(interrupt_orphaned_jobs)(stale_after)
+            if interrupted:
+                logger.warning(f"⚠️ Marked {interrupted} command jobs without a running process as interrupted")
+        except Exception as e:
+            logger.error(f"❌ Could not check for orphaned command jobs: {e}")
+        await asyncio.sleep(interval)
+
+
+async def get_job(job_id):
+    try:
+        return await timed_database_sync_to_async(CommandJob.objects.get)(id=job_id)
+    except (CommandJob.DoesNotExist, ValueError):
+        raise HTTPException(status_code=404, detail="Command job not found")
+
+
+@router.post("/commands")
+async def create_command_job(command: BulkCommand):
+    """
+    Send an OCPP command to every charger matched by `targets`, in the
+    background. Poll /commands/{job_id} for progress and
+    /commands/{job_id}/results for the per-charger outcomes.
+    """
+    try:
+        command.payload = rpc.build_call(command.action, command.payload).__dict__
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        job, charger_ids = await timed_database_sync_to_async(create_job)(
+            command, command.targets.model_dump(exclude_none=True)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    start_job(job, charger_ids)
+    logger.info(f"📣 Sending {job.action} to {job.total} chargers, {job.concurrency} at a time (job {job.id})")
+    return job_summary(job)
+
+
+@router.get("/commands/{job_id}")
+async def command_job(job_id: str):
+    """Progress of a command job."""
+    return job_summary(await get_job(job_id))
+
+
+@router.post("/commands/{job_id}/cancel")
+async def cancel_command_job(job_id: str):
+    """Stop sending a command job; commands already sent still get their results recorded."""
+    job = await get_job(job_id)
+    await timed_database_sync_to_async(CommandJob.objects.filter(id=job.id, status="running").update)(status="canceled")
+    return job_summary(await get_job(job_id))
+
+
+@router.get("/commands/{job_id}/results")
+async def command_job_results(job_id: str, after: int = 0, limit: int = Query(1000, ge=1, le=10000),
+                              status: str = None, follow: bool = False):
+    """
+    Per-charger results of a command job after result id `after`. With
+    follow=true, results are streamed as JSON lines until the job is done.
+    """
+    job = await get_job(job_id)
+    if not follow:
+        results = await timed_database_sync_to_async(read_results)(job.id, after, limit, status)
+        return {"job": job_summary(job), "results": results}
+
+    async def stream(after):
+        while True:
+            job = await get_job(job_id)
+            results = await timed_database_sync_to_async(read_results)(job.id, after, limit, status)
+            for result in results:
+                yield json.dumps(result) + "\n"
+            if results:
+                after = results[-1]["id"]
+            # Results are written before the final status, an empty read after that is the end
+            if not results and job.status != "running":
+                yield json.dumps({"job": job_summary(job)}) + "\n"
+                return
+            if len(results) < limit:
+                await asyncio.sleep(settings.BULK_COMMAND_FLUSH_INTERVAL)
+
+    return StreamingResponse(stream(after), media_type="application/x-ndjson")
@@ -0,0 +1,240 @@
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import datetime, time, timedelta, timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.utils.dateparse import parse_datetime
+from api.models import Messages
+
+logger = logging.getLogger(__name__)
+
+TABLE = Messages._meta.db_table
+LEGACY = f"{TABLE}_legacy"
+DEFAULT = f"{TABLE}_default"
+_BOUNDS = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def _day(value):
+    return datetime.combine(value, time.min, tzinfo=timezone.utc)
+
+
+def _partition_name(day):
+    return f"{TABLE}_p{day:%Y%m%d}"
+
+
+def _bound(value):
+    """A partition bound from pg_get_expr(): a datetime, or None for MINVALUE/MAXVALUE."""
+    value = value.strip("'")
+    return None if value in ("MINVALUE", "MAXVALUE") else parse_datetime(value)
+
+
+def _structured(payload):
+    # Rows written before payloads were stored as structured JSON hold the frame as a JSON string
+    if isinstance(payload, str):
+        try:
+            return json.loads(payload)
+        except ValueError:
+            return payload
+    return payload
+
+
+class Command(BaseCommand):
+    help = (
+        "Keep the OCPP message log bounded. On PostgreSQL api_messages is range partitioned by day: "
+        "'setup' converts the table once, 'maintain' (run daily) creates the coming partitions and "
+        "archives and drops those past the retention period. On other databases 'maintain' archives "
+        "and deletes old rows instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["setup", "maintain"])
+        parser.add_argument("--retention-days", type=int, default=settings.MESSAGE_RETENTION_DAYS)
+        parser.add_argument("--premake-days", type=int, default=settings.MESSAGE_PARTITION_PREMAKE_DAYS)
+        parser.add_argument("--archive-dir", default=settings.MESSAGE_ARCHIVE_DIR)
+        parser.add_argument("--no-archive", dest="archive", action="store_false", help="drop without exporting")
+        parser.add_argument("--dry-run", action="store_true", help="only show what would be done")
+
+    def handle(self, action, **options):
+        self.options = options
+        self.partitioned = connection.vendor == "postgresql"
+        if action == "setup":
+            self.setup()
+        elif self.partitioned:
+            self.maintain_partitions()
+        else:
+            self.maintain_rows()
+
+    def execute_sql(self, sql, params=None):
+        if self.options["dry_run"]:
+            self.stdout.write(f"[dry run] {sql}")
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    # PostgreSQL
+
+    def is_partitioned(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", [TABLE])
+            return cursor.fetchone()[0] == "p"
+
+    def partitions(self):
+        """[(name, lower bound, upper bound)] of the attached partitions, DEFAULT excluded."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+                FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = %s::regclass
+                """,
+                [TABLE],
+            )
+            rows = cursor.fetchall()
+        partitions = []
+        for name, expression in rows:
+            match = _BOUNDS.search(expression)
+            if match:
+                partitions.append((name, _bound(match.group(1)), _bound(match.group(2))))
+        return sorted(partitions, key=lambda partition: partition[2] or datetime.max.replace(tzinfo=timezone.utc))
+
+    def setup(self):
+        if not self.partitioned:
+            self.stdout.write(f"{connection.vendor} has no declarative partitioning, 'maintain' purges old rows instead.")
+            return
+        if self.is_partitioned():
+            self.stdout.write(f"{TABLE} is already partitioned.")
+            return
+        # The existing rows stay where they are and become the partition
+        # for everything before tomorrow; new partitions start there.
+        boundary = _day(datetime.now(timezone.utc).date() + timedelta(days=1))
+        statements = [
+            f'ALTER TABLE {TABLE} RENAME TO {LEGACY}',
+            f'ALTER TABLE {LEGACY} DROP CONSTRAINT {TABLE}_pkey',
+            f'ALTER TABLE {LEGACY} ADD PRIMARY KEY (message_id, "timestamp")',
+            f'CREATE TABLE {TABLE} (LIKE {LEGACY} INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")',
+            f'ALTER TABLE {TABLE} ADD PRIMARY KEY (message_id, "timestamp")',
+            f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_charge_point_fk FOREIGN KEY (charge_point_id) '
+            f'REFERENCES {Messages._meta.get_field("charge_point").related_model._meta.db_table} (id) '
+            f'DEFERRABLE INITIALLY DEFERRED',
+            f"ALTER TABLE {TABLE} ATTACH PARTITION {LEGACY} FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')",
+            # Catches rows outside every partition if 'maintain' stops running
+            f'CREATE TABLE {DEFAULT} PARTITION OF {TABLE} DEFAULT',
+        ]
+        # The model's indexes, on the new parent (the old ones stay with the legacy partition)
+        for index in Messages._meta.indexes:
+            columns = ", ".join(f'"{Messages._meta.get_field(field).column}"' for field in index.fields)
+            statements.append(f"CREATE INDEX {index.name}_part ON {TABLE} ({columns})")
+        with transaction.atomic():
+            for sql in statements:
+                self.execute_sql(sql)
+        self.stdout.write(self.style.SUCCESS(f"{TABLE} is now partitioned by day, existing rows are in {LEGACY}."))
+        self.maintain_partitions()
+
+    def maintain_partitions(self):
+        if not self.options["dry_run"] and not self.is_partitioned():
+            raise CommandError(f"{TABLE} is not partitioned yet, run 'messages_partitions setup' first.")
+        partitions = self.partitions()
+        today = datetime.now(timezone.utc).date()
+
+        # Upcoming partitions, starting after whatever is covered already. Days
+        # missed while 'maintain' did not run get theirs too, so that their
+        # rows leave DEFAULT and fall under the retention period.
+        covered_until = max((upper for _, _, upper in partitions if upper), default=_day(today))
+        day, last = min(covered_until, _day(today)), _day(today + timedelta(days=self.options["premake_days"]))
+        failed = []
+        while day <= last:
+            if day >= covered_until:
+                try:
+                    with transaction.atomic():
+                        self.create_partition(day)
+                    self.stdout.write(f"Created partition {_partition_name(day)}")
+                except DatabaseError as e:
+                    # Reported, the other days and the retention below still run
+                    failed.append(_partition_name(day))
+                    self.stderr.write(f"Could not create partition {_partition_name(day)}: {e}")
+            day += timedelta(days=1)
+
+        # Expired partitions: archive, then detach and drop in one go
+        cutoff = _day(today - timedelta(days=self.options["retention_days"]))
+        for name, lower, upper in partitions:
+            if upper is None or upper > cutoff:
+                continue
+            if self.options["archive"] and not self.options["dry_run"]:
+                self.archive(name, Messages.objects.filter(timestamp__lt=upper, **({"timestamp__gte": lower} if lower else {})))
+            with transaction.atomic():
+                self.execute_sql(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+                self.execute_sql(f"DROP TABLE {name}")
+            self.stdout.write(f"Dropped partition {name} (up to {upper:%Y-%m-%d})")
+        if failed:
+            raise CommandError(f"Could not create partitions {', '.join(failed)}")
+
+    def default_rows(self, lower, upper):
+        """Whether the DEFAULT partition exists and holds rows in [lower, upper)."""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [DEFAULT])
+            if cursor.fetchone()[0] is None:
+                return False
+            cursor.execute(
+                f'SELECT EXISTS (SELECT 1 FROM {DEFAULT} WHERE "timestamp" >= %s AND "timestamp" < %s)', [lower, upper]
+            )
+            return cursor.fetchone()[0]
+
+    def create_partition(self, day):
+        name, upper = _partition_name(day), day + timedelta(days=1)
+        bounds = f"FOR VALUES FROM ('{day.isoformat()}') TO ('{upper.isoformat()}')"
+        if not self.default_rows(day, upper):
+            self.execute_sql(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TABLE} {bounds}")
+            return
+        # Rows of the day already in DEFAULT would violate the new partition's
+        # bounds: create it with DEFAULT detached and move them over
+        self.execute_sql(f"ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT}")
+        self.execute_sql(f"CREATE TABLE {name} PARTITION OF {TABLE} {bounds}")
+        self.execute_sql(
+            f'INSERT INTO {name} SELECT * FROM {DEFAULT} WHERE "timestamp" >= %s AND "timestamp" < %s', [day, upper]
+        )
+        self.execute_sql(f'DELETE FROM {DEFAULT} WHERE "timestamp" >= %s AND "timestamp" < %s', [day, upper])
+        self.execute_sql(f"ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT} DEFAULT")
+        self.stdout.write(f"Moved the rows of {day:%Y-%m-%d} from {DEFAULT} to {name}")
+
+    # Other databases
+
+    def maintain_rows(self):
+        cutoff = _day(datetime.now(timezone.utc).date() - timedelta(days=self.options["retention_days"]))
+        oldest = Messages.objects.filter(timestamp__lt=cutoff).order_by("timestamp").values_list("timestamp", flat=True).first()
+        if oldest is None:
+            self.stdout.write("Nothing to purge.")
+            return
+        day = _day(oldest.date())
+        while day < cutoff:
+            rows = Messages.objects.filter(timestamp__gte=day, timestamp__lt=day + timedelta(days=1))
+            if self.options["dry_run"]:
+                self.stdout.write(f"[dry run] would purge {rows.count()} messages of {day:%Y-%m-%d}")
+            elif rows.exists():
+                if self.options["archive"]:
+                    self.archive(f"{TABLE}_p{day:%Y%m%d}", rows)
+                deleted, _ = rows.delete()  # A single DELETE, nothing cascades from Messages
+                self.stdout.write(f"Purged {deleted} messages of {day:%Y-%m-%d}")
+            day += timedelta(days=1)
+
+    def archive(self, name, rows):
+        """Export rows as gzipped JSON lines to <archive dir>/<name>.jsonl.gz."""
+        os.makedirs(self.options["archive_dir"], exist_ok=True)
+        path = os.path.join(self.options["archive_dir"], f"{name}.jsonl.gz")
+        count = 0
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            for message_id, charge_point_id, message_type, timestamp, payload in rows.order_by().values_list(
+                "message_id", "charge_point_id", "message_type", "timestamp", "payload"
+            ).iterator(chunk_size=5000):
+                f.write(json.dumps({
+                    "message_id": str(message_id),
+                    "charge_point_id": str(charge_point_id),
+                    "message_type": message_type,
+                    "timestamp": timestamp.isoformat(),
+                    "payload": _structured(payload),
+                }) + "\n")
+                count += 1
+        self.stdout.write(f"Archived {count} messages to {path}")
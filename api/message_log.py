@@ -0,0 +1,119 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from api.metrics import timed_database_sync_to_async
+from api.models import Messages
+from api.registry import charger_registry
+
+router = APIRouter()
+
+# Rows fetched per query while a page is streamed
+CHUNK_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+
+def encode_cursor(timestamp, message_id):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{message_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(timestamp, message_id) of a cursor returned by a previous page."""
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        parsed = parse_datetime(timestamp)
+        if parsed is None:
+            raise ValueError(timestamp)
+        return parsed, uuid.UUID(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def fetch_chunk(charge_point_id, after, limit, newest_first, action=None, direction=None, since=None, until=None):
+    """
+    Up to `limit` messages of a charger following the (timestamp, message_id)
+    keyset position `after`, served by the composite indexes on Messages:
+    the cost does not depend on how deep the position is.
+    """
+    messages = Messages.objects.filter(charge_point_id=charge_point_id)
+    if action:
+        messages = messages.filter(message_type=action)
+    if direction:
+        messages = messages.filter(direction=direction)
+    if since:
+        messages = messages.filter(timestamp__gte=since)
+    if until:
+        messages = messages.filter(timestamp__lt=until)
+    if after is not None:
+        timestamp, message_id = after
+        # The OR alone is not an index range; the redundant timestamp bound
+        # makes the (charge_point, timestamp, message_id) index range-scanned
+        if newest_first:
+            messages = messages.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, message_id__lt=message_id),
+                timestamp__lte=timestamp,
+            )
+        else:
+            messages = messages.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, message_id__gt=message_id),
+                timestamp__gte=timestamp,
+            )
+    order = ("-timestamp", "-message_id") if newest_first else ("timestamp", "message_id")
+    return list(
+        messages.order_by(*order).values_list("message_id", "timestamp", "message_type", "direction", "payload")[:limit]
+    )
+
+
+async def stream_page(charge_point_id, after, limit, newest_first, filters):
+    """Encode a page as it is read, one chunk query at a time."""
+    yield '{"messages": ['
+    sent, last = 0, None
+    while sent < limit:
+        rows = await timed_database_sync_to_async(fetch_chunk)(
+            charge_point_id, after, min(CHUNK_SIZE, limit - sent), newest_first, **filters
+        )
+        for message_id, timestamp, message_type, direction, payload in rows:
+            yield ("," if sent else "") + json.dumps({
+                "message_id": str(message_id),
+                "timestamp": timestamp.isoformat(),
+                "action": message_type,
+                "direction": direction,
+                "payload": payload,
+            })
+            sent += 1
+            last = (timestamp, message_id)
+        if len(rows) < CHUNK_SIZE or last is None:
+            break
+        after = last
+    # A full page may be followed by more, a short one is the end
+    next_cursor = encode_cursor(*last) if sent == limit and last else None
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
+
+@router.get("/messages/{charger_id}")
+async def charger_messages(
+    charger_id: str,
+    action: str = None,
+    direction: str = Query(None, pattern="^(in|out)$"),
+    since: datetime = None,
+    until: datetime = None,
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
+):
+    """
+    Page through the message log of a charger, newest first by default. Pass
+    the returned next_cursor to get the following page.
+    """
+    charger = await charger_registry.aget(charger_id)
+    if not charger:
+        raise HTTPException(status_code=404, detail="Charger not found")
+    after = decode_cursor(cursor) if cursor else None
+    filters = {"action": action, "direction": direction, "since": since, "until": until}
+    return StreamingResponse(
+        stream_page(charger.id, after, limit, order == "desc", filters), media_type="application/json"
+    )
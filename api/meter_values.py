@@ -0,0 +1,137 @@
+import logging
+from datetime import datetime, timezone
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from api.models import MeterRollup
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_RESOLUTIONS = [seconds for seconds, _ in MeterRollup.RESOLUTIONS]
+ROLLUP_FIELDS = ['count', 'min_value', 'max_value', 'sum_value', 'first_at', 'first_value', 'last_at', 'last_value']
+
+
+def flatten_meter_values(charge_point, connector_id, transaction_id, meter_value):
+    """
+    Turn the (snake_case) meter_value list of a MeterValues or StopTransaction
+    request into MeterSample field dicts, one per numeric sampledValue.
+    Signed or unparsable values are skipped.
+    """
+    rows = []
+    for entry in meter_value or ():
+        timestamp = parse_datetime(entry.get('timestamp') or '')
+        if timestamp is None:
+            continue
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        for sampled in entry.get('sampled_value') or ():
+            if sampled.get('format') == 'SignedData':
+                continue
+            try:
+                value = float(sampled['value'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            rows.append({
+                'charge_point': charge_point,
+                'connector_number': connector_id,
+                'transaction_id': transaction_id,
+                'timestamp': timestamp,
+                'measurand': sampled.get('measurand') or 'Energy.Active.Import.Register',
+                'phase': sampled.get('phase') or '',
+                'unit': sampled.get('unit') or 'Wh',
+                'context': sampled.get('context') or 'Sample.Periodic',
+                'location': sampled.get('location') or 'Outlet',
+                'value': value,
+            })
+    return rows
+
+
+def bucket_start(timestamp, resolution):
+    seconds = int(timestamp.timestamp())
+    return datetime.fromtimestamp(seconds - seconds % resolution, timezone.utc)
+
+
+def _merge(rollup, count, min_value, max_value, sum_value, first_at, first_value, last_at, last_value):
+    rollup.count += count
+    rollup.min_value = min(rollup.min_value, min_value)
+    rollup.max_value = max(rollup.max_value, max_value)
+    rollup.sum_value += sum_value
+    if first_at < rollup.first_at:
+        rollup.first_at, rollup.first_value = first_at, first_value
+    if last_at >= rollup.last_at:
+        rollup.last_at, rollup.last_value = last_at, last_value
+
+
+def update_rollups(samples):
+    """
+    Fold freshly written MeterSamples into the 1 minute, 15 minute and hourly
+    rollups. Runs in the database thread right after the batch insert, so each
+    batch costs one read and one upsert per resolution, however many samples
+    it holds.
+    """
+    if not samples:
+        return
+    for resolution in ROLLUP_RESOLUTIONS:
+        partial = {}
+        for sample in samples:
+            key = (sample.charge_point_id, sample.connector_number, sample.measurand, sample.phase,
+                   bucket_start(sample.timestamp, resolution))
+            rollup = partial.get(key)
+            if rollup is None:
+                partial[key] = MeterRollup(
+                    charge_point_id=key[0], connector_number=key[1], measurand=key[2], phase=key[3],
+                    unit=sample.unit, resolution=resolution, bucket=key[4], count=1,
+                    min_value=sample.value, max_value=sample.value, sum_value=sample.value,
+                    first_at=sample.timestamp, first_value=sample.value,
+                    last_at=sample.timestamp, last_value=sample.value,
+                )
+            else:
+                _merge(rollup, 1, sample.value, sample.value, sample.value,
+                       sample.timestamp, sample.value, sample.timestamp, sample.value)
+
+        # Merge with what is already stored for the touched buckets
+        existing = Q()
+        for key in partial:
+            existing |= Q(charge_point_id=key[0], connector_number=key[1], measurand=key[2],
+                          phase=key[3], bucket=key[4])
+        for stored in MeterRollup.objects.filter(existing, resolution=resolution):
+            key = (stored.charge_point_id, stored.connector_number, stored.measurand, stored.phase, stored.bucket)
+            new = partial[key]
+            _merge(stored, new.count, new.min_value, new.max_value, new.sum_value,
+                   new.first_at, new.first_value, new.last_at, new.last_value)
+            partial[key] = stored
+
+        MeterRollup.objects.bulk_create(
+            list(partial.values()),
+            update_conflicts=True,
+            unique_fields=['charge_point', 'connector_number', 'measurand', 'phase', 'resolution', 'bucket'],
+            update_fields=ROLLUP_FIELDS,
+        )
+
+
+def read_rollups(charge_point_id, resolution, since=None, until=None, measurand=None, connector_number=None):
+    """Rollup rows of a charger for dashboards, oldest bucket first."""
+    rollups = MeterRollup.objects.filter(charge_point_id=charge_point_id, resolution=resolution)
+    if since:
+        rollups = rollups.filter(bucket__gte=since)
+    if until:
+        rollups = rollups.filter(bucket__lt=until)
+    if measurand:
+        rollups = rollups.filter(measurand=measurand)
+    if connector_number is not None:
+        rollups = rollups.filter(connector_number=connector_number)
+    return [
+        {
+            'connector_id': rollup.connector_number,
+            'measurand': rollup.measurand,
+            'phase': rollup.phase,
+            'unit': rollup.unit,
+            'bucket': rollup.bucket.isoformat(),
+            'count': rollup.count,
+            'min': rollup.min_value,
+            'max': rollup.max_value,
+            'avg': rollup.avg_value,
+            'first': rollup.first_value,
+            'last': rollup.last_value,
+        }
+        for rollup in rollups.order_by('bucket')
+    ]
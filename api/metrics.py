@@ -0,0 +1,259 @@
+import asyncio
+import functools
+import json
+import logging
+import time
+from bisect import bisect_left
+from channels.db import database_sync_to_async
+from django.conf import settings
+from ocpp.v16.enums import Action
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond handler work up to call timeouts
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Actions come from frames the chargers send; anything outside OCPP 1.6 is
+# counted as "Unknown" so that a misbehaving charger cannot add label series
+OCPP_ACTIONS = frozenset(action.value for action in Action)
+
+
+def action_label(action):
+    return action if action in OCPP_ACTIONS else "Unknown"
+
+
+class Metric:
+    """
+    Base class for the in-process metrics. Values are kept per tuple of label
+    values in a plain dict; updates happen on the event loop and cost a dict
+    lookup, which is cheap enough to leave on in production.
+    """
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def samples(self):
+        """[(label values, value)] in a JSON friendly form."""
+        return [[list(labels), value] for labels, value in self._values.items()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            # Per-bucket counts (not cumulative) + the +Inf bucket, then sum
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def snapshot(self):
+        """JSON friendly copy of every metric, as published to Redis."""
+        return {
+            metric.name: {
+                "type": metric.type,
+                "help": metric.help,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "samples": metric.samples(),
+            }
+            for metric in self.metrics.values()
+        }
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def render(snapshots):
+    """
+    Render {node: snapshot} in the Prometheus text exposition format, with a
+    `node` label telling the processes apart.
+    """
+    lines = []
+    names = sorted({name for snapshot in snapshots.values() for name in snapshot})
+    for name in names:
+        header_written = False
+        for node, snapshot in sorted(snapshots.items()):
+            metric = snapshot.get(name)
+            if metric is None:
+                continue
+            if not header_written:
+                lines.append(f"# HELP {name} {metric['help']}")
+                lines.append(f"# TYPE {name} {metric['type']}")
+                header_written = True
+            labelnames = ["node"] + metric["labelnames"]
+            for labels, value in metric["samples"]:
+                labels = [node] + labels
+                if metric["type"] != "histogram":
+                    lines.append(f"{name}{_format_labels(labelnames, labels)} {value}")
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric["buckets"] + ["+Inf"], counts):
+                    cumulative += count
+                    bucket_labels = _format_labels(labelnames + ["le"], labels + [bound])
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labelnames, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+CONNECTED_CHARGERS = registry.gauge("ocpp_connected_chargers", "Chargers connected to this process")
+FRAMES_RECEIVED = registry.counter("ocpp_frames_received_total", "Inbound OCPP frames by action", ["action"])
+STAGE_SECONDS = registry.histogram(
+    "ocpp_stage_seconds", "Time spent per message processing stage", ["stage", "action"]
+)
+DB_WRITE_SECONDS = registry.histogram("ocpp_db_write_seconds", "Duration of batched database writes", ["table"])
+DB_ROWS_WRITTEN = registry.counter("ocpp_db_rows_written_total", "Rows written by the write-behind buffers", ["table"])
+DB_ROWS_DROPPED = registry.counter("ocpp_db_rows_dropped_total", "Rows dropped by full write-behind buffers", ["table"])
+DB_QUEUE_WAIT_SECONDS = registry.histogram(
+    "ocpp_db_queue_wait_seconds", "Time a database_sync_to_async call waited for the database thread"
+)
+DB_CALLS_IN_FLIGHT = registry.gauge("ocpp_db_calls_in_flight", "database_sync_to_async calls queued or running")
+CHANNEL_SEND_SECONDS = registry.histogram(
+    "ocpp_channel_layer_send_seconds", "Latency of channel layer sends", ["kind"]
+)
+RATE_LIMITED = registry.counter(
+    "ocpp_rate_limited_total", "Inbound calls delayed or rejected by the per-connection rate limits", ["action", "outcome"]
+)
+EVENT_LOOP_LAG_SECONDS = registry.gauge("ocpp_event_loop_lag_seconds", "Smoothed event loop scheduling delay")
+ADMISSIONS = registry.counter(
+    "ocpp_admissions_total", "Admission control decisions on connect and BootNotification", ["stage", "outcome"]
+)
+OUTBOX_DELIVERED = registry.counter(
+    "ocpp_outbox_commands_total", "Queued commands taken off the outbox, by outcome", ["action", "status"]
+)
+CALL_TIMEOUTS = registry.counter("ocpp_call_timeouts_total", "Outbound OCPP calls that got no answer in time", ["action"])
+
+
+def timed_database_sync_to_async(func):
+    """
+    database_sync_to_async that also records how long the call waited for the
+    (single, thread sensitive) database thread before it started running.
+    """
+    def run(submitted_at, *args, **kwargs):
+        return time.perf_counter() - submitted_at, func(*args, **kwargs)
+
+    run_in_thread = database_sync_to_async(run)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        DB_CALLS_IN_FLIGHT.inc()
+        try:
+            waited, result = await run_in_thread(time.perf_counter(), *args, **kwargs)
+        finally:
+            DB_CALLS_IN_FLIGHT.dec()
+        DB_QUEUE_WAIT_SECONDS.observe(waited)
+        return result
+
+    return wrapper
+
+
+class MetricsPublisher:
+    """
+    Periodically copies this process' metrics to Redis so that the FastAPI
+    /metrics endpoint can expose every Daphne and uvicorn process at once.
+    Snapshots expire on their own when a process goes away.
+    """
+    key_prefix = "ocpp:metrics:"
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._task = None
+
+    def ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        from api.redis_pool import get_redis
+        while True:
+            try:
+                await get_redis().set(
+                    self.key_prefix + settings.NODE_ID,
+                    json.dumps(registry.snapshot()),
+                    ex=int(self.interval * 3) + 1,
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Could not publish metrics: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def collect(self):
+        """{node: snapshot} for every live process, this one always fresh."""
+        from api.redis_pool import get_redis
+        snapshots = {}
+        try:
+            redis = get_redis()
+            keys = [key async for key in redis.scan_iter(match=self.key_prefix + "*")]
+            if keys:
+                for key, value in zip(keys, await redis.mget(keys)):
+                    if value is not None:
+                        key = key.decode() if isinstance(key, bytes) else key
+                        snapshots[key[len(self.key_prefix):]] = json.loads(value)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read metrics of other processes: {e}")
+        snapshots[settings.NODE_ID] = registry.snapshot()
+        return snapshots
+
+
+publisher = MetricsPublisher(settings.METRICS_PUBLISH_INTERVAL)
@@ -1,6 +1,27 @@
 from django.db import models
+from django.utils import timezone
 import uuid
 
+
+class EncodedJSON(str):
+    """JSON text that is already serialized, e.g. an OCPP frame as sent on the wire."""
+
+
+class PayloadField(models.JSONField):
+    """
+    JSONField that stores EncodedJSON as is instead of encoding it again, so a
+    frame is kept as structured JSON without a loads/dumps round trip.
+    """
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, EncodedJSON):
+            if connection.vendor == "postgresql":
+                from django.db.backends.postgresql.psycopg_any import Jsonb
+                return Jsonb(value, dumps=str)
+            return str(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+
 class ChargePoint(models.Model):
     """Represents an EV Charging Station."""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -22,10 +43,12 @@ class ChargePoint(models.Model):
     max_power_kw = models.FloatField()  # Maximum power output in kW
     firmware_version = models.CharField(max_length=100, null=True, blank=True)
     last_heartbeat = models.DateTimeField(null=True, blank=True)  # Last heartbeat received
+    last_seen = models.DateTimeField(null=True, blank=True)  # Last frame of any kind received
     updated_at = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
     charge_point_model = models.CharField(max_length=250 , null=True , blank=True)
     charge_point_vendor = models.CharField(max_length=250 , null=True , blank=True)
+    site = models.CharField(max_length=100, null=True, blank=True, db_index=True)  # Location group for analytics
 
     def __str__(self):
         return f"{self.name} ({self.status})"
@@ -34,6 +57,7 @@ class ChargePoint(models.Model):
 class Connector(models.Model):
     """Represents a charging connector within a ChargePoint."""
     charge_point = models.ForeignKey(ChargePoint, on_delete=models.CASCADE, related_name='connectors')
+    number = models.PositiveIntegerField(null=True, blank=True)  # OCPP connectorId (1, 2, ...)
     type = models.CharField(max_length=50, choices=[
         ('Type1', 'Type 1'),
         ('Type2', 'Type 2'),
@@ -64,13 +88,16 @@ class Connector(models.Model):
 class Transaction(models.Model):
     """Tracks charging sessions."""
     charge_point = models.ForeignKey(ChargePoint, on_delete=models.CASCADE)
-    connector = models.ForeignKey(Connector, on_delete=models.CASCADE)
+    connector = models.ForeignKey(Connector, on_delete=models.CASCADE, null=True, blank=True)  # None if not configured
+    connector_number = models.PositiveIntegerField(null=True, blank=True)  # OCPP connectorId
     transaction_id = models.IntegerField(unique=True, null=True, blank=True)  # OCPP Transaction ID
     id_tag = models.CharField(max_length=100)  # RFID tag of the user
     meter_start = models.IntegerField()  # Start energy (Wh)
     meter_stop = models.IntegerField(blank=True, null=True)  # Stop energy (Wh)
-    start_time = models.DateTimeField(auto_now_add=True)
+    start_time = models.DateTimeField(default=timezone.now)  # As reported by the charger
     stop_time = models.DateTimeField(blank=True, null=True)
+    stop_reason = models.CharField(max_length=50, blank=True, null=True)
+    closed_at = models.DateTimeField(blank=True, null=True)  # Server time of the StopTransaction, the rollups' watermark
     status = models.CharField(max_length=50, choices=[
         ('active', 'Active'),
         ('stopped', 'Stopped'),
@@ -79,12 +106,133 @@ class Transaction(models.Model):
         ('canceled', 'Canceled'),
     ], default="stopped")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['charge_point', 'status']),
+            models.Index(fields=['start_time']),  # Admin date hierarchy and ordering
+            models.Index(fields=['closed_at', 'id']),  # Usage rollups read closed sessions in this order
+        ]
+
     def __str__(self):
         return f"Transaction {self.transaction_id} - {self.status}"
 
 
+class TransactionIdBlock(models.Model):
+    """
+    High-water mark of the OCPP transaction ids handed out to the processes.
+    A single row; each process reserves a block of ids at a time (see api/transactions.py).
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField(default=1)  # First id not reserved by anyone yet
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: next {self.next_value}"
+
+
+class IdTag(models.Model):
+    """An id tag (RFID card, app token) on the local authorization list."""
+    id_tag = models.CharField(max_length=20, unique=True)  # OCPP IdToken, at most 20 characters
+    status = models.CharField(max_length=20, choices=[
+        ('Accepted', 'Accepted'),
+        ('Blocked', 'Blocked'),
+        ('Expired', 'Expired'),
+        ('Invalid', 'Invalid'),
+    ], default='Accepted')
+    expiry_date = models.DateTimeField(null=True, blank=True)  # Treated as Expired from then on
+    parent_id_tag = models.CharField(max_length=20, null=True, blank=True)  # Group, e.g. a fleet account
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at']),  # Cache preload and admin ordering
+        ]
+
+    def __str__(self):
+        return f"{self.id_tag} ({self.status})"
+
+
+class OutboxCommand(models.Model):
+    """An OCPP command kept until its charger connects (see api/outbox.py)."""
+    QUEUED = 'queued'
+    charge_point = models.ForeignKey(ChargePoint, on_delete=models.CASCADE, related_name='outbox')
+    action = models.CharField(max_length=50)  # OCPP action, e.g. ChangeConfiguration
+    payload = models.JSONField(default=dict)  # Call fields in snake_case
+    merge_key = models.CharField(max_length=200, null=True, blank=True)  # A newer command with the same key replaces this one
+    status = models.CharField(max_length=20, choices=[
+        (QUEUED, 'Queued'),
+        ('ok', 'Delivered'),
+        ('error', 'Error'),
+        ('timeout', 'Timed out'),
+        ('expired', 'Expired'),
+        ('superseded', 'Superseded'),
+    ], default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)  # The charger's CallResult
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The queue of a charger, oldest first
+            models.Index(fields=['charge_point', 'status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.action} for {self.charge_point_id} ({self.status})"
+
+
+class CommandJob(models.Model):
+    """An OCPP command sent to many chargers at once (see api/command_jobs.py)."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    action = models.CharField(max_length=50)  # OCPP action, e.g. ChangeConfiguration
+    payload = models.JSONField(default=dict)  # Call fields in snake_case
+    selector = models.JSONField(default=dict)  # Target chargers as requested
+    concurrency = models.PositiveIntegerField()  # Commands in flight at most
+    timeout = models.FloatField()  # Seconds each charger has to answer
+    status = models.CharField(max_length=20, choices=[
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('canceled', 'Canceled'),
+        ('failed', 'Failed'),
+        ('interrupted', 'Interrupted'),  # The process running it went away
+    ], default='running')
+    total = models.PositiveIntegerField(default=0)  # Targeted chargers
+    succeeded = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)  # Errors, timeouts and offline chargers
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(default=timezone.now)  # Last progress write of the running process
+
+    def __str__(self):
+        return f"{self.action} to {self.total} chargers ({self.status})"
+
+
+class CommandJobResult(models.Model):
+    """The outcome of a CommandJob for one charger."""
+    job = models.ForeignKey(CommandJob, on_delete=models.CASCADE, related_name='results')
+    charge_point = models.ForeignKey(ChargePoint, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20)  # rpc status (ok, error, timeout, ...) or offline
+    result = models.JSONField(null=True, blank=True)  # The charger's CallResult
+    error = models.TextField(null=True, blank=True)
+    finished_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'charge_point'], name='unique_command_job_result'),
+        ]
+
+    def __str__(self):
+        return f"{self.job_id} -> {self.charge_point_id}: {self.status}"
+
+
 class Messages(models.Model):
     """Logs OCPP messages for debugging and tracking."""
+    INBOUND = 'in'
+    OUTBOUND = 'out'
     message_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     charge_point = models.ForeignKey(ChargePoint, on_delete=models.CASCADE)
     message_type = models.CharField(max_length=50, choices=[
@@ -95,8 +243,123 @@ class Messages(models.Model):
         ('Authorize', 'Authorize'),
         ('MeterValues','MeterValues'),
     ])
-    payload = models.JSONField()  # Store full OCPP message as JSON
-    timestamp = models.DateTimeField(auto_now_add=True)
+    direction = models.CharField(max_length=3, choices=[
+        (INBOUND, 'From charger'),
+        (OUTBOUND, 'To charger'),
+    ], default=INBOUND)
+    payload = PayloadField()  # Full OCPP frame as structured JSON
+    timestamp = models.DateTimeField(default=timezone.now)  # Set when queued, not when the batch is written
+
+    class Meta:
+        # On PostgreSQL the table is range partitioned by day on timestamp, see
+        # the messages_partitions management command. The indexes end with the
+        # (timestamp, message_id) keyset the message log API pages on.
+        indexes = [
+            models.Index(fields=['charge_point', 'timestamp', 'message_id'], name='messages_charger_time_idx'),
+            models.Index(fields=['charge_point', 'message_type', 'timestamp', 'message_id'],
+                         name='messages_charger_action_idx'),
+            # Admin changelist across all chargers, newest first
+            models.Index(fields=['timestamp', 'message_id'], name='messages_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.charge_point.name} - {self.message_type} ({self.timestamp})"
+
+
+class MeterSample(models.Model):
+    """One numeric sampledValue reported by a charger in MeterValues."""
+    charge_point = models.ForeignKey(ChargePoint, on_delete=models.CASCADE, related_name='meter_samples')
+    connector_number = models.PositiveIntegerField()  # OCPP connectorId
+    transaction_id = models.IntegerField(null=True, blank=True)  # OCPP Transaction ID
+    timestamp = models.DateTimeField()
+    measurand = models.CharField(max_length=64, default='Energy.Active.Import.Register')
+    phase = models.CharField(max_length=10, blank=True, default='')
+    unit = models.CharField(max_length=16, default='Wh')
+    context = models.CharField(max_length=32, default='Sample.Periodic')
+    location = models.CharField(max_length=16, default='Outlet')
+    value = models.FloatField()
+
+    class Meta:
+        indexes = [
+            # Range scans per series and per charging session
+            models.Index(fields=['charge_point', 'connector_number', 'measurand', 'timestamp']),
+            models.Index(fields=['transaction_id', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return f"{self.measurand} {self.value} {self.unit} ({self.timestamp})"
+
+
+class MeterRollup(models.Model):
+    """Downsampled MeterSample series, kept up to date as samples are written."""
+    RESOLUTIONS = [
+        (60, '1 minute'),
+        (900, '15 minutes'),
+        (3600, '1 hour'),
+    ]
+    charge_point = models.ForeignKey(ChargePoint, on_delete=models.CASCADE, related_name='meter_rollups')
+    connector_number = models.PositiveIntegerField()  # OCPP connectorId
+    measurand = models.CharField(max_length=64)
+    phase = models.CharField(max_length=10, blank=True, default='')
+    unit = models.CharField(max_length=16)
+    resolution = models.PositiveIntegerField(choices=RESOLUTIONS)  # Bucket width in seconds
+    bucket = models.DateTimeField()  # Start of the bucket
+    count = models.PositiveIntegerField()
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    sum_value = models.FloatField()
+    first_at = models.DateTimeField()
+    first_value = models.FloatField()
+    last_at = models.DateTimeField()
+    last_value = models.FloatField()  # last_value - first_value is the energy of a register measurand
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['charge_point', 'connector_number', 'measurand', 'phase', 'resolution', 'bucket'],
+                name='unique_meter_rollup_bucket',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['charge_point', 'resolution', 'bucket']),
+        ]
+
+    @property
+    def avg_value(self):
+        return self.sum_value / self.count if self.count else None
+
+    def __str__(self):
+        return f"{self.measurand} {self.get_resolution_display()} @ {self.bucket}"
+
+
+class ChargerHourStats(models.Model):
+    """Usage of a charger in one hour, kept up to date by the usage rollups (api/usage.py)."""
+    charge_point = models.ForeignKey(ChargePoint, on_delete=models.CASCADE, related_name='hour_stats')
+    hour = models.DateTimeField()  # Start of the hour, UTC
+    energy_wh = models.FloatField(default=0)  # Energy of the sessions, spread over the hours they ran
+    charging_seconds = models.FloatField(default=0)  # Session time within the hour, summed over connectors
+    sessions_started = models.PositiveIntegerField(default=0)
+    sessions_completed = models.PositiveIntegerField(default=0)
+    messages = models.PositiveIntegerField(default=0)  # OCPP frames logged
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['charge_point', 'hour'], name='unique_charger_hour_stats'),
+        ]
+        indexes = [
+            models.Index(fields=['hour']),
+        ]
+
+    def __str__(self):
+        return f"{self.charge_point_id} @ {self.hour}: {self.energy_wh} Wh"
+
+
+class RollupWatermark(models.Model):
+    """How far a rollup has read its source table: a (timestamp, id) keyset position."""
+    name = models.CharField(max_length=50, primary_key=True)
+    position = models.DateTimeField(null=True, blank=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
@@ -0,0 +1,101 @@
+import logging
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from api.metrics import timed_database_sync_to_async
+from api.models import OutboxCommand
+from api.presence import presence
+
+logger = logging.getLogger(__name__)
+
+# Merge rules: commands of these actions with the same key replace each other
+# while queued, so a charger that comes back gets only the latest of each.
+MERGE_KEYS = {
+    "ChangeConfiguration": lambda payload: payload.get("key"),
+    "ChangeAvailability": lambda payload: payload.get("connector_id"),
+    "Reset": lambda payload: "",
+    "UpdateFirmware": lambda payload: "",
+    "SendLocalList": lambda payload: "",
+    "ClearCache": lambda payload: "",
+    "RemoteStopTransaction": lambda payload: payload.get("transaction_id"),
+    "TriggerMessage": lambda payload: f"{payload.get('requested_message')}:{payload.get('connector_id')}",
+    "SetChargingProfile": lambda payload: (
+        f"{payload.get('connector_id')}:{(payload.get('cs_charging_profiles') or {}).get('charging_profile_id')}"
+    ),
+}
+
+
+def merge_key(action, payload):
+    key = MERGE_KEYS.get(action)
+    return f"{action}:{key(payload)}" if key else None
+
+
+def enqueue(charge_point_id, action, payload, ttl):
+    """
+    Queue a command for a charger, valid for `ttl` seconds. Queued commands
+    with the same merge key are marked superseded.
+    """
+    key = merge_key(action, payload)
+    now = timezone.now()
+    with transaction.atomic():
+        if key:
+            OutboxCommand.objects.filter(
+                charge_point_id=charge_point_id, status=OutboxCommand.QUEUED, merge_key=key
+            ).update(status="superseded", finished_at=now)
+        return OutboxCommand.objects.create(
+            charge_point_id=charge_point_id,
+            action=action,
+            payload=payload,
+            merge_key=key,
+            expires_at=now + timedelta(seconds=ttl),
+        )
+
+
+def next_batch(charge_point_id, limit):
+    """Expire what is past its TTL, then the oldest `limit` queued commands of a charger."""
+    now = timezone.now()
+    queued = OutboxCommand.objects.filter(charge_point_id=charge_point_id, status=OutboxCommand.QUEUED)
+    expired = queued.filter(expires_at__lte=now).update(status="expired", finished_at=now)
+    if expired:
+        logger.info(f"⌛ {expired} queued commands for {charge_point_id} expired")
+    return list(queued.order_by("created_at", "id")[:limit])
+
+
+def record(commands):
+    """Store the outcome of a delivered batch in one UPDATE per batch."""
+    OutboxCommand.objects.bulk_update(commands, ["status", "attempts", "result", "error", "finished_at"])
+
+
+def commands_of(charge_point_id, status=None, limit=100):
+    commands = OutboxCommand.objects.filter(charge_point_id=charge_point_id)
+    if status:
+        commands = commands.filter(status=status)
+    return [
+        {
+            "id": command.id,
+            "action": command.action,
+            "payload": command.payload,
+            "status": command.status,
+            "attempts": command.attempts,
+            "result": command.result,
+            "error": command.error,
+            "created_at": command.created_at.isoformat(),
+            "expires_at": command.expires_at.isoformat(),
+            "finished_at": command.finished_at.isoformat() if command.finished_at else None,
+        }
+        for command in commands.order_by("-created_at", "-id")[:limit]
+    ]
+
+
+async def notify(channel_layer, charger_id):
+    """Have the consumer of a connected charger drain its outbox now; False if not connected."""
+    channel_name = await presence.channel_of(charger_id)
+    if channel_name is None:
+        return False
+    await channel_layer.send(channel_name, {"type": "outbox.drain"})
+    return True
+
+
+aenqueue = timed_database_sync_to_async(enqueue)
+anext_batch = timed_database_sync_to_async(next_batch)
+arecord = timed_database_sync_to_async(record)
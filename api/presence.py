@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+import uuid
+from django.conf import settings
+from api.metrics import timed_database_sync_to_async
+from api.models import ChargePoint
+
+logger = logging.getLogger(__name__)
+
+# Delete the presence hash only if it still belongs to the connection going away,
+# a charger that already reconnected elsewhere keeps its new entry.
+_RELEASE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'channel') == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    redis.call('SREM', KEYS[2], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class Presence:
+    """
+    Which chargers are connected, to which node and channel, and since when.
+
+    Every connected charger has a Redis hash (node, channel, connected_at, ip)
+    whose TTL the node holding the WebSocket keeps refreshing, so entries of a
+    node that dies expire on their own; a set indexes the charger ids. Each
+    process keeps a local mirror: the chargers connected to it, which it owns,
+    and a snapshot of the whole cluster refreshed in the background, which is
+    what the API reads. No request hits Postgres or waits on Redis.
+    """
+    key_prefix = "ocpp:presence:charger:"
+    index_key = "ocpp:presence:index"
+
+    def __init__(self, ttl=90, refresh_interval=30, mirror_interval=5):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.mirror_interval = mirror_interval
+        self.local = {}  # charger id -> entry, chargers connected to this process
+        self.cluster = {}  # charger id -> entry, every connected charger as of the last refresh
+        self._refresh_task = None
+        self._mirror_task = None
+
+    def _key(self, charger_id):
+        return self.key_prefix + str(charger_id).lower()
+
+    @staticmethod
+    def _running(task):
+        return task is not None and not task.done()
+
+    async def _publish(self, entries):
+        from api.redis_pool import get_redis
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for charger_id, entry in entries.items():
+                pipe.hset(self._key(charger_id), mapping=entry)
+                pipe.expire(self._key(charger_id), self.ttl)
+            pipe.sadd(self.index_key, *entries)
+            await pipe.execute()
+
+    async def connected(self, charger_id, channel_name, ip_address=None):
+        charger_id = str(charger_id).lower()
+        entry = {
+            "node": settings.NODE_ID,
+            "channel": channel_name,
+            "connected_at": time.time(),
+            "ip": ip_address or "",
+        }
+        self.local[charger_id] = entry
+        self.cluster[charger_id] = entry
+        if not self._running(self._refresh_task):
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh())
+        try:
+            await self._publish({charger_id: entry})
+        except Exception as e:
+            # The refresh loop publishes it once Redis is back
+            logger.warning(f"⚠️ Could not publish presence of {charger_id}: {e}")
+
+    async def disconnected(self, charger_id, channel_name):
+        from api.redis_pool import get_redis
+        charger_id = str(charger_id).lower()
+        entry = self.local.get(charger_id)
+        if entry is None or entry["channel"] != channel_name:
+            return
+        del self.local[charger_id]
+        self.cluster.pop(charger_id, None)
+        try:
+            await get_redis().eval(_RELEASE_SCRIPT, 2, self._key(charger_id), self.index_key, channel_name, charger_id)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not clear presence of {charger_id}: {e}")
+
+    async def _refresh(self):
+        # Rewriting the hashes (not only EXPIRE) also restores them after a Redis restart
+        while self.local:
+            await asyncio.sleep(self.refresh_interval)
+            if not self.local:
+                break
+            try:
+                await self._publish(dict(self.local))
+            except Exception as e:
+                logger.warning(f"⚠️ Could not refresh presence: {e}")
+
+    async def load(self):
+        """Read every presence entry from Redis, dropping ids whose hash expired."""
+        from api.redis_pool import get_redis
+        redis = get_redis()
+        charger_ids = sorted(_decode(charger_id) for charger_id in await redis.smembers(self.index_key))
+        if not charger_ids:
+            return {}
+        async with redis.pipeline(transaction=False) as pipe:
+            for charger_id in charger_ids:
+                pipe.hgetall(self._key(charger_id))
+            hashes = await pipe.execute()
+        entries, expired = {}, []
+        for charger_id, fields in zip(charger_ids, hashes):
+            if not fields:
+                expired.append(charger_id)
+                continue
+            entry = {_decode(name): _decode(value) for name, value in fields.items()}
+            entry["connected_at"] = float(entry["connected_at"])
+            entries[charger_id] = entry
+        if expired:
+            await redis.srem(self.index_key, *expired)
+        return entries
+
+    def ensure_mirror(self):
+        """Start keeping `cluster` in sync with Redis (API processes)."""
+        if not self._running(self._mirror_task):
+            self._mirror_task = asyncio.get_running_loop().create_task(self._mirror())
+
+    async def _mirror(self):
+        while True:
+            try:
+                entries = await self.load()
+                entries.update(self.local)
+                self.cluster = entries
+            except Exception as e:
+                logger.warning(f"⚠️ Could not read presence: {e}")
+            await asyncio.sleep(self.mirror_interval)
+
+    def get(self, charger_id):
+        charger_id = str(charger_id).lower()
+        return self.local.get(charger_id) or self.cluster.get(charger_id)
+
+    async def channel_of(self, charger_id):
+        """
+        Channel name of the consumer holding the charger's WebSocket, or None.
+        Read from Redis unless the charger is connected to this process, so a
+        charger that just reconnected elsewhere is not missed; the mirror is
+        the fallback while Redis is unreachable.
+        """
+        from api.redis_pool import get_redis
+        charger_id = str(charger_id).lower()
+        entry = self.local.get(charger_id)
+        if entry is not None:
+            return entry["channel"]
+        try:
+            return _decode(await get_redis().hget(self._key(charger_id), "channel"))
+        except Exception as e:
+            logger.warning(f"⚠️ Could not look up the channel of {charger_id}: {e}")
+            entry = self.cluster.get(charger_id)
+            return entry["channel"] if entry else None
+
+    def is_connected(self, charger_id):
+        return self.get(charger_id) is not None
+
+    def all(self):
+        return {**self.cluster, **self.local}
+
+
+class PresenceReconciler:
+    """
+    Periodically writes the presence data back to ChargePoint.is_online and
+    ip_address, instead of a write per connect/disconnect. The chargers the
+    database has online are diffed against presence in Python, and only the
+    differences are written, `batch_size` chargers per statement.
+    """
+
+    def __init__(self, presence, interval=60, batch_size=1000):
+        self.presence = presence
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task = None
+        self._reconcile_async = timed_database_sync_to_async(self.reconcile)
+
+    def ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                entries = await self.presence.load()
+                await self._reconcile_async(entries)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not reconcile presence: {e}")
+
+    def reconcile(self, entries):
+        """Make is_online and ip_address match `entries` ({charger id: presence entry})."""
+        online = dict(ChargePoint.objects.filter(is_online=True).values_list("id", "ip_address"))
+        connected = {uuid.UUID(charger_id): entry["ip"] or None for charger_id, entry in entries.items()}
+        went_offline = [charger_id for charger_id in online if charger_id not in connected]
+        for start in range(0, len(went_offline), self.batch_size):
+            ChargePoint.objects.filter(id__in=went_offline[start:start + self.batch_size]).update(is_online=False)
+        # Chargers that came online, or are still online at another address
+        changed = [
+            ChargePoint(id=charger_id, is_online=True, ip_address=ip)
+            for charger_id, ip in connected.items()
+            if charger_id not in online or online[charger_id] != ip
+        ]
+        ChargePoint.objects.bulk_update(changed, ["is_online", "ip_address"], batch_size=self.batch_size)
+        if went_offline or changed:
+            logger.info(f"📡 Presence reconciled: {len(changed)} online or moved, {len(went_offline)} offline")
+
+
+presence = Presence(
+    ttl=settings.PRESENCE_TTL,
+    refresh_interval=settings.PRESENCE_REFRESH_INTERVAL,
+    mirror_interval=settings.PRESENCE_MIRROR_INTERVAL,
+)
+reconciler = PresenceReconciler(presence, interval=settings.PRESENCE_RECONCILE_INTERVAL)
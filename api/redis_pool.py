@@ -0,0 +1,12 @@
+from django.conf import settings
+from redis import asyncio as aioredis
+
+_client = None
+
+
+def get_redis():
+    """Shared asyncio Redis client of this process (metrics, presence, ...)."""
+    global _client
+    if _client is None:
+        _client = aioredis.from_url(settings.REDIS_URL)
+    return _client
@@ -0,0 +1,103 @@
+import logging
+import random
+import time
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from api.metrics import timed_database_sync_to_async
+from api.models import ChargePoint, Connector
+
+logger = logging.getLogger(__name__)
+
+
+class ChargerRegistry:
+    """
+    Process-wide cache of chargers and their connectors.
+
+    The whole table is loaded with one query (connectors prefetched) at startup
+    or on first use. Entries are dropped when a ChargePoint or Connector is saved
+    or deleted in this process; the TTL bounds how long changes made by another
+    process can go unnoticed. Unknown ids are cached for a short time as well so
+    that a misconfigured charger retrying in a loop does not hit the database.
+    Each entry lives up to `jitter` (a fraction) less than its TTL, so that the
+    entries loaded together by preload() do not all expire at the same moment.
+    """
+
+    def __init__(self, ttl=300, missing_ttl=10, jitter=0.2):
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.jitter = jitter
+        self._entries = {}  # charger id -> (ChargePoint or None, expires at)
+        self._loaded = False
+        self._get_async = timed_database_sync_to_async(self.get)
+
+    @staticmethod
+    def _key(charger_id):
+        return str(charger_id).lower()
+
+    def _queryset(self):
+        return ChargePoint.objects.prefetch_related("connectors")
+
+    def _expires_at(self, ttl):
+        return time.monotonic() + ttl * random.uniform(1 - self.jitter, 1)
+
+    def preload(self):
+        """Load every charger and its connectors in one go."""
+        self._entries = {
+            self._key(charger.id): (charger, self._expires_at(self.ttl)) for charger in self._queryset()
+        }
+        self._loaded = True
+        logger.info(f"📇 Charger registry loaded {len(self._entries)} chargers")
+
+    def _cached(self, charger_id):
+        entry = self._entries.get(self._key(charger_id))
+        if entry is not None and entry[1] > time.monotonic():
+            return entry
+        return None
+
+    def get(self, charger_id):
+        """Return the charger with this id, or None. Sync version."""
+        if not self._loaded:
+            self.preload()
+        entry = self._cached(charger_id)
+        if entry is not None:
+            return entry[0]
+        try:
+            charger = self._queryset().filter(id=charger_id).first()
+        except ValidationError:
+            charger = None  # Not a valid UUID
+        ttl = self.ttl if charger else self.missing_ttl
+        self._entries[self._key(charger_id)] = (charger, self._expires_at(ttl))
+        return charger
+
+    async def aget(self, charger_id):
+        """Return the charger with this id, or None, without a thread hop on a hit."""
+        entry = self._cached(charger_id) if self._loaded else None
+        if entry is not None:
+            return entry[0]
+        return await self._get_async(charger_id)
+
+    def connectors(self, charger):
+        """Connectors of a charger returned by this registry (already prefetched)."""
+        return list(charger.connectors.all())
+
+    def invalidate(self, charger_id):
+        self._entries.pop(self._key(charger_id), None)
+
+    def clear(self):
+        self._entries = {}
+        self._loaded = False
+
+
+charger_registry = ChargerRegistry(ttl=settings.CHARGER_REGISTRY_TTL)
+
+
+@receiver([post_save, post_delete], sender=ChargePoint)
+def invalidate_charger(sender, instance, **kwargs):
+    charger_registry.invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Connector)
+def invalidate_connector(sender, instance, **kwargs):
+    charger_registry.invalidate(instance.charge_point_id)
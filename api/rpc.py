@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+import uuid
+from django.conf import settings
+from ocpp.v16 import call
+from api.metrics import CHANNEL_SEND_SECONDS
+from api.presence import presence
+
+logger = logging.getLogger(__name__)
+
+# Outcome of a command, as reported back on the reply channel.
+STATUS_OK = "ok"                    # The charger answered with a CallResult
+STATUS_ERROR = "error"              # The charger answered with a CallError, or the call failed
+STATUS_TIMEOUT = "timeout"          # No answer before the deadline
+STATUS_EXPIRED = "expired"          # The deadline passed before the consumer picked the command up
+STATUS_DISCONNECTED = "disconnected"  # The charger went away while the command was outstanding
+
+
+def build_call(action, payload):
+    """The ocpp Call for an action and its snake_case fields; ValueError if either is wrong."""
+    command_class = getattr(call, action, None)
+    if not isinstance(command_class, type):
+        raise ValueError(f"Unknown OCPP action {action}")
+    try:
+        return command_class(**payload)
+    except TypeError as e:
+        raise ValueError(f"Invalid {action} payload: {e}")
+
+
+async def send_command(channel_layer, charger_id, action, payload, timeout=None):
+    """
+    Send an OCPP command to the consumer of `charger_id` and wait for the reply.
+
+    The request goes straight to the consumer's channel, as recorded by the
+    presence registry, and carries a fresh reply channel, a request id and an
+    absolute deadline. The consumer runs the call in the background and
+    answers on the reply channel, so the returned dict holds the charger's
+    actual result:
+    {"status": ..., "result": {...}} or {"status": ..., "error": "..."}.
+    """
+    timeout = timeout if timeout is not None else settings.OCPP_COMMAND_TIMEOUT
+    request_id = uuid.uuid4().hex
+    reply_channel = await channel_layer.new_channel()
+    deadline = time.time() + timeout
+
+    # Straight to the consumer's own channel, no group membership to look up
+    channel_name = await presence.channel_of(charger_id)
+    if channel_name is None:
+        return {"status": STATUS_DISCONNECTED, "error": f"Charger {charger_id} is not connected"}
+
+    started = time.perf_counter()
+    await channel_layer.send(
+        channel_name,
+        {
+            "type": "ocpp.command",
+            "action": action,
+            "payload": payload,
+            "request_id": request_id,
+            "reply_channel": reply_channel,
+            "deadline": deadline,
+        },
+    )
+    CHANNEL_SEND_SECONDS.observe(time.perf_counter() - started, "command")
+
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return {"status": STATUS_TIMEOUT, "error": f"No reply from charger {charger_id} within {timeout}s"}
+        try:
+            reply = await asyncio.wait_for(channel_layer.receive(reply_channel), remaining)
+        except asyncio.TimeoutError:
+            continue
+        if reply.get("request_id") == request_id:
+            return {key: value for key, value in reply.items() if key not in ("type", "request_id")}
+        logger.warning(f"⚠️ Ignoring reply for unknown request {reply.get('request_id')}")
+
+
+async def send_reply(channel_layer, event, status, result=None, error=None):
+    """Answer a command received through `send_command`."""
+    reply_channel = event.get("reply_channel")
+    if not reply_channel:
+        return
+    message = {"type": "ocpp.reply", "request_id": event.get("request_id"), "status": status}
+    if result is not None:
+        message["result"] = result
+    if error is not None:
+        message["error"] = error
+    started = time.perf_counter()
+    await channel_layer.send(reply_channel, message)
+    CHANNEL_SEND_SECONDS.observe(time.perf_counter() - started, "send")
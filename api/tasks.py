@@ -0,0 +1,9 @@
+from celery import shared_task
+from django.conf import settings
+from api.usage import update_usage_rollups
+
+
+@shared_task(ignore_result=True)
+def update_usage_rollups_task():
+    """Periodic (celery beat) update of the hourly usage stats."""
+    return update_usage_rollups(safety_lag=settings.ROLLUP_SAFETY_LAG)
@@ -1,3 +1,522 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from fastapi import HTTPException
+from pydantic import ValidationError
+from api import command_jobs, outbox, rpc
+from api.channel_layers import ShardedRedisChannelLayer
+from api.models import (
+    ChargePoint, CommandJob, CommandJobResult, Messages, OutboxCommand, Transaction, TransactionIdBlock,
+)
+from api.presence import PresenceReconciler
+from api.message_log import decode_cursor, encode_cursor, fetch_chunk
+from ElectricalVehicleCharges import admission
+from ElectricalVehicleCharges.admission import AdmissionController
+from ElectricalVehicleCharges.consumers import OCPPConsumer
+from ElectricalVehicleCharges.rate_limit import ALL_CALLS, RateLimiter, TokenBucket, limits_for
+from api.tracing import Tracer, current_trace, record_span, untraced
+from api.transactions import ActiveTransactionIndex, TransactionIdAllocator, close_transaction, open_transaction
 
-# Create your tests here.
+
+def make_charger(name):
+    return ChargePoint.objects.create(name=name, max_power_kw=22)
+
+
+class TransactionIdAllocatorTests(TestCase):
+    async def test_ids_are_handed_out_from_reserved_blocks(self):
+        allocator = TransactionIdAllocator(block_size=3)
+        ids = [await allocator.allocate() for _ in range(7)]
+        self.assertEqual(ids, [1, 2, 3, 4, 5, 6, 7])
+        block = await TransactionIdBlock.objects.aget(name="transaction")
+        self.assertEqual(block.next_value, 10)  # Third block reserved, two of its ids unused
+
+    async def test_allocators_never_share_ids(self):
+        first, second = TransactionIdAllocator(block_size=2), TransactionIdAllocator(block_size=2)
+        ids = [await allocator.allocate() for allocator in (first, second, first, second, first)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, [1, 3, 2, 4, 5])
+
+    def test_first_block_starts_above_existing_ids(self):
+        Transaction.objects.create(charge_point=make_charger("a"), id_tag="x", meter_start=0, transaction_id=41)
+        self.assertEqual(TransactionIdAllocator(block_size=10).reserve(), (42, 52))
+
+
+class CloseTransactionTests(TestCase):
+    def setUp(self):
+        self.charger = make_charger("a")
+        open_transaction(self.charger, None, 1, 7, "tag", 100, "2025-01-01T10:00:00Z")
+
+    def test_closes_the_chargers_active_transaction(self):
+        self.assertTrue(close_transaction(self.charger, 7, 1500, "2025-01-01T11:00:00Z", "Local"))
+        session = Transaction.objects.get(transaction_id=7)
+        self.assertEqual((session.status, session.meter_stop, session.stop_reason), ("completed", 1500, "Local"))
+        self.assertIsNotNone(session.closed_at)
+
+    def test_other_chargers_cannot_close_it(self):
+        self.assertFalse(close_transaction(make_charger("b"), 7, 1500, "2025-01-01T11:00:00Z"))
+        session = Transaction.objects.get(transaction_id=7)
+        self.assertEqual((session.status, session.meter_stop), ("active", None))
+
+    def test_completed_transaction_counts_as_unknown(self):
+        close_transaction(self.charger, 7, 1500, "2025-01-01T11:00:00Z")
+        self.assertFalse(close_transaction(self.charger, 7, 9999, "2025-01-01T12:00:00Z"))
+        self.assertEqual(Transaction.objects.get(transaction_id=7).meter_stop, 1500)
+
+    def test_unknown_transaction(self):
+        self.assertFalse(close_transaction(self.charger, 8, 1500, "2025-01-01T11:00:00Z"))
+
+    def test_new_transaction_supersedes_one_left_active_on_the_connector(self):
+        open_transaction(self.charger, None, 2, 8, "tag", 0, "2025-01-01T10:30:00Z")
+        open_transaction(self.charger, None, 1, 9, "tag", 200, "2025-01-01T12:00:00Z")
+        sessions = dict(Transaction.objects.values_list("transaction_id", "status"))
+        self.assertEqual(sessions, {7: "stopped", 8: "active", 9: "active"})
+        superseded = Transaction.objects.get(transaction_id=7)
+        self.assertEqual(superseded.stop_reason, "Superseded")
+        self.assertEqual(superseded.stop_time, datetime(2025, 1, 1, 12, tzinfo=timezone.utc))
+
+
+class ActiveTransactionIndexTests(TestCase):
+    def test_start_replaces_the_connectors_previous_transaction(self):
+        index = ActiveTransactionIndex()
+        self.assertIsNone(index.start("a", 1, 7))
+        self.assertEqual(index.start("a", 1, 8), 7)
+        self.assertEqual(index.get("a", 1), 8)
+        self.assertIsNone(index.stop("a", 7))
+
+    def test_stop_is_scoped_to_the_charger(self):
+        index = ActiveTransactionIndex()
+        index.start("a", 1, 7)
+        self.assertIsNone(index.stop("b", 7))
+        self.assertEqual(index.stop("a", 7), ("a", 1))
+        self.assertIsNone(index.get("a", 1))
+
+    def test_load_replaces_a_chargers_entries(self):
+        index = ActiveTransactionIndex()
+        index.start("a", 1, 7)
+        index.start("b", 1, 9)
+        index.load("a", [(2, 8)])
+        self.assertEqual((index.get("a", 1), index.get("a", 2), index.get("b", 1)), (None, 8, 9))
+
+
+class MessagesRetentionTests(TestCase):
+    """messages_partitions maintain on a database without partitioning (SQLite)."""
+
+    def setUp(self):
+        self.charger = make_charger("a")
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        self.today = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+
+    def log(self, days_ago, payload):
+        return Messages.objects.create(
+            charge_point=self.charger, message_type="Heartbeat", payload=payload,
+            timestamp=self.today - timedelta(days=days_ago),
+        )
+
+    def maintain(self, *args):
+        call_command("messages_partitions", "maintain", "--retention-days", "7",
+                     "--archive-dir", self.archive_dir, *args, stdout=StringIO())
+
+    def test_old_days_are_archived_then_purged(self):
+        old = self.log(10, [2, "1", "Heartbeat", {}])
+        self.log(10, '[2, "2", "Heartbeat", {}]')  # Stored as a JSON string before payloads were structured
+        kept = self.log(1, [2, "3", "Heartbeat", {}])
+        self.maintain()
+        self.assertEqual(list(Messages.objects.values_list("message_id", flat=True)), [kept.message_id])
+
+        day = (self.today - timedelta(days=10)).strftime("%Y%m%d")
+        with gzip.open(os.path.join(self.archive_dir, f"api_messages_p{day}.jsonl.gz"), "rt") as f:
+            archived = [json.loads(line) for line in f]
+        self.assertEqual(len(archived), 2)
+        self.assertIn(str(old.message_id), {row["message_id"] for row in archived})
+        self.assertEqual(sorted(row["payload"][1] for row in archived), ["1", "2"])
+
+    def test_dry_run_and_no_archive(self):
+        self.log(10, [2, "1", "Heartbeat", {}])
+        self.maintain("--dry-run")
+        self.assertEqual(Messages.objects.count(), 1)
+        self.maintain("--no-archive")
+        self.assertEqual(Messages.objects.count(), 0)
+        self.assertEqual(os.listdir(self.archive_dir), [])
+
+
+class MessageLogCursorTests(TestCase):
+    def setUp(self):
+        self.charger = make_charger("a")
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        # Pairs of messages share a timestamp, so pages must break ties on message_id
+        for i in range(10):
+            Messages.objects.create(
+                charge_point=self.charger, message_type="Heartbeat" if i % 3 else "MeterValues",
+                payload={}, timestamp=start + timedelta(seconds=i // 2),
+            )
+
+    def walk(self, newest_first, page_size=3, **filters):
+        keys, after = [], None
+        while True:
+            rows = fetch_chunk(self.charger.id, after, page_size, newest_first, **filters)
+            keys += [(timestamp, message_id) for message_id, timestamp, *_ in rows]
+            if len(rows) < page_size:
+                return keys
+            after = decode_cursor(encode_cursor(rows[-1][1], rows[-1][0]))
+
+    def test_cursor_round_trip(self):
+        timestamp = datetime(2025, 1, 1, 10, 30, 15, 123456, tzinfo=timezone.utc)
+        message_id = Messages.objects.first().message_id
+        self.assertEqual(decode_cursor(encode_cursor(timestamp, message_id)), (timestamp, message_id))
+
+    def test_invalid_cursor(self):
+        for cursor in ("", "not-base64!", encode_cursor(datetime.now(timezone.utc), "x")):
+            with self.assertRaises(HTTPException) as raised:
+                decode_cursor(cursor)
+            self.assertEqual(raised.exception.status_code, 400)
+
+    def test_pages_cover_every_message_once_in_order(self):
+        for newest_first in (True, False):
+            keys = self.walk(newest_first)
+            self.assertEqual(keys, sorted(keys, reverse=newest_first))
+            self.assertEqual(len(set(keys)), 10)
+
+    def test_filters_apply_across_pages(self):
+        keys = self.walk(True, page_size=2, action="MeterValues")
+        self.assertEqual(len(keys), Messages.objects.filter(message_type="MeterValues").count())
+
+
+class CommandJobTests(TestCase):
+    def setUp(self):
+        self.chargers = [str(make_charger(f"c{i}").id) for i in range(4)]
+        self.offline = self.chargers[0]
+        self.sent = []
+
+    def command(self, **fields):
+        return command_jobs.BulkCommand(
+            action="Reset", payload={"type": "Soft"}, targets=command_jobs.CommandTargets(all=True), **fields
+        )
+
+    async def send_command(self, channel_layer, charger_id, action, payload, timeout=None):
+        self.sent.append(charger_id)
+        await asyncio.sleep(0.05)
+        if charger_id == self.chargers[1]:
+            return {"status": rpc.STATUS_TIMEOUT, "error": "No reply"}
+        return {"status": rpc.STATUS_OK, "result": {"status": "Accepted"}}
+
+    async def run_job(self, flush_interval=0.01, during=None, **fields):
+        job, charger_ids = await command_jobs.timed_database_sync_to_async(command_jobs.create_job)(
+            self.command(**fields), {"all": True}
+        )
+        runner = command_jobs.CommandJobRunner(job, charger_ids, None, flush_interval=flush_interval)
+        with mock.patch.object(command_jobs.presence, "is_connected", lambda charger_id: charger_id != self.offline), \
+                mock.patch.object(command_jobs.rpc, "send_command", self.send_command):
+            task = asyncio.ensure_future(runner.run())
+            if during:
+                await during(job)
+            await task
+        return await CommandJob.objects.aget(id=job.id)
+
+    async def cancel_after(self, job, seconds):
+        await asyncio.sleep(seconds)
+        await CommandJob.objects.filter(id=job.id).aupdate(status="canceled")
+
+    async def test_outcomes_are_counted_and_recorded(self):
+        job = await self.run_job(concurrency=2)
+        self.assertEqual((job.status, job.total, job.succeeded, job.failed), ("completed", 4, 2, 2))
+        statuses = {
+            str(row.charge_point_id): row.status async for row in CommandJobResult.objects.filter(job_id=job.id)
+        }
+        self.assertEqual(statuses[self.offline], command_jobs.STATUS_OFFLINE)
+        self.assertEqual(statuses[self.chargers[1]], rpc.STATUS_TIMEOUT)
+        self.assertNotIn(self.offline, self.sent)
+
+    async def test_cancel_stops_new_sends_and_records_those_in_flight(self):
+        job = await self.run_job(concurrency=1, during=lambda job: self.cancel_after(job, 0.02))
+        self.assertEqual(job.status, "canceled")
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(await CommandJobResult.objects.filter(job_id=job.id).acount(), job.succeeded + job.failed)
+        # The command in flight when the job was canceled still has its result
+        self.assertTrue(await CommandJobResult.objects.filter(job_id=job.id, charge_point_id=self.sent[0]).aexists())
+
+    async def test_cancel_after_the_last_periodic_flush_is_kept(self):
+        job = await self.run_job(concurrency=4, flush_interval=60, during=lambda job: self.cancel_after(job, 0.02))
+        self.assertEqual(job.status, "canceled")
+        self.assertEqual(job.succeeded + job.failed, 4)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_jobs_without_progress_writes_are_interrupted(self):
+        orphaned, _ = command_jobs.create_job(self.command(), {"all": True})
+        live, _ = command_jobs.create_job(self.command(), {"all": True})
+        CommandJob.objects.filter(id=orphaned.id).update(heartbeat_at=orphaned.created_at - timedelta(minutes=5))
+        self.assertEqual(command_jobs.interrupt_orphaned_jobs(60), 1)
+        orphaned.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual(orphaned.status, "interrupted")
+        self.assertIsNotNone(orphaned.finished_at)
+        self.assertEqual(live.status, "running")
+
+    def test_limits_are_validated(self):
+        for fields in ({"concurrency": 0}, {"concurrency": -5}, {"timeout": 0}, {"timeout": -1}):
+            with self.assertRaises(ValidationError):
+                self.command(**fields)
+
+    def test_targets(self):
+        self.assertEqual(command_jobs.target_ids({"charger_ids": self.chargers[:2]}), sorted(self.chargers[:2]))
+        self.assertEqual(len(command_jobs.target_ids({"filter": {"name__startswith": "c"}})), 4)
+        for selector in ({}, {"filter": {"password": "x"}}, {"charger_ids": ["nope"]}):
+            with self.assertRaises(ValueError):
+                command_jobs.target_ids(selector)
+
+
+class RateLimitTests(TestCase):
+    def test_bucket_allows_a_burst_then_refills_at_its_rate(self):
+        bucket = TokenBucket(rate=2, burst=3)
+        now = bucket.updated
+        self.assertEqual([bucket.take(now) for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(bucket.take(now), 0.5)
+        self.assertEqual(bucket.take(now + 0.5), 0.0)
+        self.assertEqual(bucket.take(now + 100), 0.0)  # Refills up to the burst only
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_zero_rate_never_refills(self):
+        bucket = TokenBucket(rate=0, burst=1)
+        self.assertEqual(bucket.take(), 0.0)
+        self.assertEqual(bucket.take(), float("inf"))
+
+    def test_limiter_takes_nothing_from_a_call_it_holds_back(self):
+        limiter = RateLimiter({ALL_CALLS: (1, 2), "Heartbeat": (0.001, 1)})
+        self.assertEqual(limiter.check("Heartbeat"), 0.0)
+        self.assertGreater(limiter.check("Heartbeat"), 0)
+        # The held back Heartbeat gave its connection-wide token back
+        self.assertEqual(limiter.check("MeterValues"), 0.0)
+        self.assertGreater(limiter.check("MeterValues"), 0)
+
+    def test_model_limits_override_and_remove_defaults(self):
+        limits = {ALL_CALLS: [20, 40], "Heartbeat": [1, 2]}
+        by_model = {"EVSE-1": {"Heartbeat": None, "MeterValues": [5, 10]}}
+        self.assertEqual(limits_for("EVSE-1", limits, by_model), {ALL_CALLS: (20, 40), "MeterValues": (5, 10)})
+        self.assertEqual(limits_for(None, limits, by_model), {ALL_CALLS: (20, 40), "Heartbeat": (1, 2)})
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.charger = make_charger("a")
+
+    def queue(self, action, payload, ttl=3600, charger=None):
+        return outbox.enqueue((charger or self.charger).id, action, payload, ttl)
+
+    def statuses(self):
+        return list(OutboxCommand.objects.order_by("id").values_list("status", flat=True))
+
+    def test_merge_keys(self):
+        self.assertEqual(outbox.merge_key("ChangeConfiguration", {"key": "HeartbeatInterval", "value": "60"}),
+                         "ChangeConfiguration:HeartbeatInterval")
+        self.assertEqual(outbox.merge_key("Reset", {"type": "Hard"}), outbox.merge_key("Reset", {"type": "Soft"}))
+        self.assertNotEqual(outbox.merge_key("TriggerMessage", {"requested_message": "Heartbeat", "connector_id": 1}),
+                            outbox.merge_key("TriggerMessage", {"requested_message": "Heartbeat", "connector_id": 2}))
+        self.assertIsNone(outbox.merge_key("UnlockConnector", {"connector_id": 1}))
+
+    def test_newer_command_with_the_same_key_supersedes(self):
+        self.queue("ChangeConfiguration", {"key": "HeartbeatInterval", "value": "60"})
+        self.queue("ChangeConfiguration", {"key": "MeterValueSampleInterval", "value": "30"})
+        latest = self.queue("ChangeConfiguration", {"key": "HeartbeatInterval", "value": "300"})
+        self.assertEqual(self.statuses(), ["superseded", "queued", "queued"])
+        self.assertEqual(outbox.next_batch(self.charger.id, 10)[-1].id, latest.id)
+
+    def test_commands_without_a_key_or_for_other_chargers_are_kept(self):
+        self.queue("UnlockConnector", {"connector_id": 1})
+        self.queue("UnlockConnector", {"connector_id": 1})
+        self.queue("Reset", {"type": "Soft"}, charger=make_charger("b"))
+        self.queue("Reset", {"type": "Soft"})
+        self.assertEqual(self.statuses(), ["queued"] * 4)
+
+    def test_next_batch_expires_and_keeps_queue_order(self):
+        expired = self.queue("Reset", {"type": "Soft"}, ttl=-1)
+        first = self.queue("UnlockConnector", {"connector_id": 1})
+        second = self.queue("UnlockConnector", {"connector_id": 2})
+        self.queue("UnlockConnector", {"connector_id": 3})
+        self.assertEqual([command.id for command in outbox.next_batch(self.charger.id, 2)], [first.id, second.id])
+        expired.refresh_from_db()
+        self.assertEqual(expired.status, "expired")
+        self.assertIsNotNone(expired.finished_at)
+
+    def test_record_stores_outcomes(self):
+        command = self.queue("Reset", {"type": "Soft"})
+        command.status, command.attempts, command.result = rpc.STATUS_OK, 1, {"status": "Accepted"}
+        outbox.record([command])
+        self.assertEqual(outbox.next_batch(self.charger.id, 10), [])
+        self.assertEqual(outbox.commands_of(self.charger.id, status=rpc.STATUS_OK)[0]["result"], {"status": "Accepted"})
+
+
+@override_settings(OUTBOX_BATCH_SIZE=10)
+class OutboxDrainTests(TestCase):
+    async def test_command_queued_during_a_drain_is_delivered(self):
+        charger = await ChargePoint.objects.acreate(name="a", max_power_kw=22)
+        consumer = OCPPConsumer()
+        consumer.charger_id, consumer.charge_point = str(charger.id), charger
+        delivered = []
+
+        async def deliver(command):
+            delivered.append(command.action)
+            if len(delivered) == 1:
+                # Queued while the first batch is being delivered, as by outbox.notify()
+                await outbox.aenqueue(charger.id, "ClearCache", {}, 60)
+                await consumer.outbox_drain({"type": "outbox.drain"})
+            command.status = rpc.STATUS_OK
+            return True
+
+        await outbox.aenqueue(charger.id, "Reset", {"type": "Soft"}, 60)
+        with mock.patch.object(consumer, "deliver_queued", deliver):
+            consumer.drain_outbox()
+            await consumer.outbox_task
+        self.assertEqual(delivered, ["Reset", "ClearCache"])
+        self.assertFalse(await OutboxCommand.objects.filter(status=OutboxCommand.QUEUED).aexists())
+
+
+class PresenceReconcilerTests(TestCase):
+    def test_database_follows_presence(self):
+        stale = ChargePoint.objects.create(name="stale", max_power_kw=22, is_online=True, ip_address="10.0.0.1")
+        arrived = make_charger("arrived")
+        moved = ChargePoint.objects.create(name="moved", max_power_kw=22, is_online=True, ip_address="10.0.0.2")
+        steady = ChargePoint.objects.create(name="steady", max_power_kw=22, is_online=True, ip_address="10.0.0.3")
+        entries = {
+            str(arrived.id): {"ip": "10.0.1.1"},
+            str(moved.id): {"ip": "10.0.1.2"},
+            str(steady.id): {"ip": "10.0.0.3"},
+        }
+        reconciler = PresenceReconciler(presence=None, batch_size=1)
+        reconciler.reconcile(entries)
+        self.assertEqual(
+            {name: (online, ip) for name, online, ip in ChargePoint.objects.values_list("name", "is_online", "ip_address")},
+            {
+                "stale": (False, "10.0.0.1"),
+                "arrived": (True, "10.0.1.1"),
+                "moved": (True, "10.0.1.2"),
+                "steady": (True, "10.0.0.3"),
+            },
+        )
+        # Nothing changed: one read, no writes
+        with self.assertNumQueries(1):
+            reconciler.reconcile(entries)
+
+
+class TracingTests(TestCase):
+    def setUp(self):
+        self.tracer = Tracer(sample_rate=0, slow_threshold=60, buffer_size=10)
+
+    async def test_tasks_started_during_a_frame_stay_out_of_its_trace(self):
+        trace = self.tracer.start("a")
+
+        async def background():
+            await asyncio.sleep(0)
+            record_span("background", time.perf_counter())
+            return current_trace.get()
+
+        task = untraced(background())
+        record_span("handler", time.perf_counter())
+        self.tracer.finish(trace)
+        self.assertIsNone(await task)
+        self.assertEqual([span[0] for span in trace.spans], ["handler"])
+        self.assertIsNone(current_trace.get())
+
+    def test_finish_restores_the_enclosing_trace(self):
+        outer = self.tracer.start("a")
+        inner = self.tracer.start("b")
+        self.assertIs(current_trace.get(), inner)
+        self.tracer.finish(inner)
+        self.assertIs(current_trace.get(), outer)
+        self.tracer.finish(outer)
+        self.assertIsNone(current_trace.get())
+
+
+class ShardedChannelLayerTests(TestCase):
+    def layer(self, hosts):
+        return ShardedRedisChannelLayer(hosts=[f"redis://redis-{i}:6379" for i in range(hosts)])
+
+    async def host_used(self, layer, call):
+        """Index of the host `call` connects to first; nothing is sent."""
+        used = []
+
+        def connection(index):
+            used.append(index)
+            raise ConnectionAbortedError
+
+        with mock.patch.object(layer, "connection", connection), self.assertRaises(ConnectionAbortedError):
+            await call(layer)
+        return used[0]
+
+    async def test_specific_channel_is_sent_to_where_it_is_received(self):
+        layer = self.layer(4)
+        for client in ("x", "client.a1b2c3", "client.9f8e7d"):
+            receive_host = await self.host_used(layer, lambda layer: layer.receive_single(f"specific.{client}!"))
+            for local in ("abc", "def", "0123456789"):
+                send_host = await self.host_used(
+                    layer, lambda layer: layer.send(f"specific.{client}!{local}", {"type": "test"})
+                )
+                self.assertEqual(send_host, receive_host)
+
+    def test_adding_a_host_moves_about_a_share_of_the_channels(self):
+        channels = [f"specific.{i:08x}!" for i in range(10000)]
+        four, five = self.layer(4), self.layer(5)
+        before = [four.consistent_hash(channel) for channel in channels]
+        after = [five.consistent_hash(channel) for channel in channels]
+        for host in range(4):
+            self.assertAlmostEqual(before.count(host) / len(channels), 1 / 4, delta=0.05)
+        moved = [new for old, new in zip(before, after) if old != new]
+        self.assertAlmostEqual(len(moved) / len(channels), 1 / 5, delta=0.05)
+        self.assertEqual(set(moved), {4})  # Only onto the new host
+
+
+class AdmissionControllerTests(TestCase):
+    def controller(self, **options):
+        options = {"max_connect_rate": 2, "window": 5, "pending_interval": 30, "heartbeat_interval": 60,
+                   "heartbeat_max_interval": 900, "heartbeat_target_rate": 100, **options}
+        controller = AdmissionController(**options)
+        self.addCleanup(lambda: controller._probe_task and controller._probe_task.cancel())
+        return controller
+
+    def connects(self, controller, count):
+        controller._connects.extend([time.monotonic()] * count)
+
+    async def decisions(self, controller, fleet_size=0):
+        """boot_decision at both ends of the jitter."""
+        decisions = []
+        for jitter in (min, max):
+            with mock.patch.object(admission.random, "uniform", lambda low, high: jitter(low, high)):
+                decisions.append(controller.boot_decision(fleet_size))
+        return decisions
+
+    async def test_boot_is_accepted_below_the_connect_rate(self):
+        controller = self.controller()
+        self.connects(controller, 10)  # 2/s
+        self.assertEqual(await self.decisions(controller, 1000), [(True, 54), (True, 66)])
+
+    async def test_boot_is_pending_above_the_connect_rate_further_out_with_load(self):
+        controller = self.controller()
+        self.connects(controller, 20)  # 4/s, twice the limit
+        self.assertEqual(await self.decisions(controller), [(False, 30), (False, 90)])
+        self.connects(controller, 20)
+        self.assertEqual(await self.decisions(controller), [(False, 60), (False, 180)])
+
+    async def test_boot_is_pending_while_saturated(self):
+        controller = self.controller(max_loop_lag=0.25, max_db_queue=200)
+        controller.loop_lag = 1.0
+        self.assertEqual(await self.decisions(controller), [(False, 15), (False, 45)])
+        controller.loop_lag = 0.0
+        with mock.patch.object(admission.metrics.DB_CALLS_IN_FLIGHT, "value", return_value=500):
+            self.assertEqual(await self.decisions(controller), [(False, 15), (False, 45)])
+        self.assertTrue((await self.decisions(controller))[0][0])
+
+    def test_heartbeat_interval_is_clamped(self):
+        controller = self.controller()
+        for jitter, expected in ((min, [54, 270, 810]), (max, [66, 330, 990])):
+            with mock.patch.object(admission.random, "uniform", lambda low, high: jitter(low, high)):
+                # Base interval for small fleets, fleet / target rate, then the maximum
+                self.assertEqual([controller.heartbeat_interval_for(size) for size in (100, 30000, 10 ** 6)], expected)
+        self.assertEqual(self.controller(heartbeat_interval=0).heartbeat_interval_for(0), 1)
@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Trace of the frame being processed by the current task, if any
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Timings of the stages one inbound frame went through."""
+    __slots__ = ("charger_id", "unique_id", "action", "started_at", "t0", "spans", "token")
+
+    def __init__(self, charger_id):
+        self.charger_id = charger_id
+        self.unique_id = None
+        self.action = None
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.token = None  # Restores current_trace when the frame is done
+
+    def span(self, name, started, seconds):
+        """Record a stage that started at perf_counter() value `started`."""
+        self.spans.append((name, started - self.t0, seconds))
+
+    def as_dict(self, duration):
+        return {
+            "node": settings.NODE_ID,
+            "charger_id": self.charger_id,
+            "unique_id": self.unique_id,
+            "action": self.action,
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "spans": [
+                {"name": name, "start_ms": round(start * 1000, 3), "duration_ms": round(seconds * 1000, 3)}
+                for name, start, seconds in self.spans
+            ],
+        }
+
+
+def record_span(name, started, seconds=None):
+    """Add a span to the trace of the current frame, if one is being traced."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.span(name, started, time.perf_counter() - started if seconds is None else seconds)
+
+
+def untraced(coroutine):
+    """
+    Schedule a coroutine as a task outside the current frame's trace. Tasks
+    copy the context they are created in, so a task started while a frame is
+    processed would keep adding spans to that trace after it is finished.
+    """
+    context = contextvars.copy_context()
+    context.run(current_trace.set, None)
+    return context.run(asyncio.ensure_future, coroutine)
+
+
+class Tracer:
+    """
+    Per-message tracing with sampling.
+
+    Every frame gets a Trace (a handful of tuples), because whether it is kept
+    is only known at the end: a sampled fraction of frames is kept, and so is
+    every frame slower than the threshold, which is also logged. Kept traces go
+    to a local ring buffer and are pushed to a capped Redis list so that the
+    FastAPI /traces endpoint sees the traces of every Daphne process.
+    """
+    redis_key = "ocpp:traces"
+
+    def __init__(self, sample_rate, slow_threshold, buffer_size, publish_interval=1.0):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.buffer_size = buffer_size
+        self.publish_interval = publish_interval
+        self.recent = deque(maxlen=buffer_size)
+        self._unpublished = deque(maxlen=buffer_size)
+        self._task = None
+
+    def start(self, charger_id):
+        trace = Trace(charger_id)
+        trace.token = current_trace.set(trace)
+        return trace
+
+    def finish(self, trace):
+        current_trace.reset(trace.token)
+        duration = time.perf_counter() - trace.t0
+        slow = duration >= self.slow_threshold
+        if not slow and random.random() >= self.sample_rate:
+            return
+        record = trace.as_dict(duration)
+        record["slow"] = slow
+        if slow:
+            logger.warning(f"🐢 Slow frame from {trace.charger_id}: {json.dumps(record)}")
+        self.recent.append(record)
+        self._unpublished.append(record)
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        from api.redis_pool import get_redis
+        while True:
+            await asyncio.sleep(self.publish_interval)
+            if not self._unpublished:
+                continue
+            records = [json.dumps(self._unpublished.popleft()) for _ in range(len(self._unpublished))]
+            try:
+                async with get_redis().pipeline(transaction=False) as pipe:
+                    pipe.lpush(self.redis_key, *records)
+                    pipe.ltrim(self.redis_key, 0, self.buffer_size - 1)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning(f"⚠️ Could not publish traces: {e}")
+
+    async def query(self, charger_id=None, action=None, slow_only=False, limit=100):
+        """Most recent traces first, from every process (this one if Redis is down)."""
+        from api.redis_pool import get_redis
+        try:
+            records = [json.loads(raw) for raw in await get_redis().lrange(self.redis_key, 0, -1)]
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read traces: {e}")
+            records = list(reversed(self.recent))
+        matches = []
+        for record in records:
+            if charger_id and record["charger_id"] != charger_id:
+                continue
+            if action and record["action"] != action:
+                continue
+            if slow_only and not record["slow"]:
+                continue
+            matches.append(record)
+            if len(matches) >= limit:
+                break
+        return matches
+
+
+tracer = Tracer(
+    sample_rate=settings.TRACE_SAMPLE_RATE,
+    slow_threshold=settings.TRACE_SLOW_THRESHOLD_MS / 1000,
+    buffer_size=settings.TRACE_BUFFER_SIZE,
+)
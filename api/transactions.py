@@ -0,0 +1,180 @@
+import asyncio
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from api.metrics import timed_database_sync_to_async
+from api.models import Transaction, TransactionIdBlock
+
+logger = logging.getLogger(__name__)
+
+# OCPP 1.6 transactionId is a JSON integer, chargers store it as a signed 32 bit value
+MAX_TRANSACTION_ID = 2 ** 31 - 1
+
+
+class TransactionIdAllocator:
+    """
+    Hands out cluster-wide unique OCPP transaction ids.
+
+    Ids are reserved from the TransactionIdBlock row `block_size` at a time,
+    under a row lock, so issuing an id is an in-memory increment and only one
+    StartTransaction in `block_size` waits for the database. Ids left over in
+    a block when the process exits are never used: ids are unique, but not
+    gapless.
+    """
+
+    def __init__(self, block_size=100, name="transaction"):
+        self.block_size = block_size
+        self.name = name
+        self._next = 0
+        self._end = 0  # Current block is [_next, _end)
+        self._lock = asyncio.Lock()
+        self._reserve_async = timed_database_sync_to_async(self.reserve)
+
+    @staticmethod
+    def _first_unused():
+        # Start above any id already in the table, e.g. when the allocator is introduced
+        return (Transaction.objects.aggregate(last=Max("transaction_id"))["last"] or 0) + 1
+
+    def reserve(self):
+        """Reserve the next block of ids in the database, returns (first, end)."""
+        with transaction.atomic():
+            block, _ = TransactionIdBlock.objects.select_for_update().get_or_create(
+                name=self.name, defaults={"next_value": self._first_unused}
+            )
+            first = block.next_value
+            end = min(first + self.block_size, MAX_TRANSACTION_ID + 1)
+            if first >= end:
+                raise RuntimeError("OCPP transaction ids exhausted")
+            block.next_value = end
+            block.save(update_fields=["next_value", "updated_at"])
+        logger.info(f"🔢 Reserved transaction ids {first}-{end - 1}")
+        return first, end
+
+    async def allocate(self):
+        """Next transaction id, only awaits the database when a block runs out."""
+        if self._next >= self._end:
+            async with self._lock:
+                if self._next >= self._end:
+                    self._next, self._end = await self._reserve_async()
+        transaction_id = self._next
+        self._next += 1
+        return transaction_id
+
+
+class ActiveTransactionIndex:
+    """
+    (charger, connector number) -> id of the transaction running on it, for the
+    chargers connected to this process. A charger is connected to one process
+    at a time, so the entries of a charger are loaded from the database when it
+    connects and kept current by its Start/StopTransaction from then on.
+    Entries are kept per charger, so loading or forgetting one costs as much as
+    the charger has connectors, however many chargers are connected.
+    """
+
+    def __init__(self):
+        self._by_charger = {}  # charger id -> {connector number: transaction id}
+        self._by_id = {}  # transaction id -> (charger id, connector number)
+
+    def start(self, charger_id, connector_number, transaction_id):
+        """Record a transaction, returns the id of the one it replaced on the connector, or None."""
+        connectors = self._by_charger.setdefault(charger_id, {})
+        previous = connectors.get(connector_number)
+        if previous is not None:
+            self._by_id.pop(previous, None)
+        connectors[connector_number] = transaction_id
+        self._by_id[transaction_id] = (charger_id, connector_number)
+        return previous
+
+    def stop(self, charger_id, transaction_id):
+        """Remove a transaction of a charger, returns its (charger id, connector number) or None."""
+        key = self._by_id.get(transaction_id)
+        if key is None or key[0] != charger_id:
+            return None
+        del self._by_id[transaction_id]
+        connectors = self._by_charger.get(charger_id, {})
+        if connectors.get(key[1]) == transaction_id:
+            del connectors[key[1]]
+            if not connectors:
+                del self._by_charger[charger_id]
+        return key
+
+    def get(self, charger_id, connector_number):
+        return self._by_charger.get(charger_id, {}).get(connector_number)
+
+    def load(self, charger_id, active):
+        """Replace the entries of a charger with [(connector number, transaction id)]."""
+        self.forget(charger_id)
+        for connector_number, transaction_id in active:
+            self.start(charger_id, connector_number, transaction_id)
+
+    def forget(self, charger_id):
+        for transaction_id in self._by_charger.pop(charger_id, {}).values():
+            self._by_id.pop(transaction_id, None)
+
+
+def _parse_timestamp(timestamp):
+    parsed = parse_datetime(timestamp or "")
+    return parsed or timezone.now()
+
+
+def active_transactions_of(charge_point):
+    """[(connector number, transaction id)] of the transactions running on a charger."""
+    return list(
+        Transaction.objects.filter(charge_point=charge_point, status="active")
+        .values_list("connector_number", "transaction_id")
+    )
+
+
+def open_transaction(charge_point, connector, connector_number, transaction_id, id_tag, meter_start, timestamp):
+    """
+    Store a new active transaction. A transaction still active on the same
+    connector was never stopped (its StopTransaction was lost), so it is
+    closed as superseded in the same step.
+    """
+    start_time = _parse_timestamp(timestamp)
+    with transaction.atomic():
+        superseded = Transaction.objects.filter(
+            charge_point=charge_point, connector_number=connector_number, status="active"
+        ).update(status="stopped", stop_time=start_time, stop_reason="Superseded", closed_at=timezone.now())
+        if superseded:
+            logger.warning(
+                f"⚠️ Charger {charge_point.id} started a transaction on connector {connector_number} "
+                f"with {superseded} still active, closed them as superseded"
+            )
+        return Transaction.objects.create(
+            charge_point=charge_point,
+            connector=connector,
+            connector_number=connector_number,
+            transaction_id=transaction_id,
+            id_tag=id_tag,
+            meter_start=meter_start,
+            start_time=start_time,
+            status="active",
+        )
+
+
+def close_transaction(charge_point, transaction_id, meter_stop, timestamp, reason=None):
+    """
+    Mark an active transaction of the charger completed with a single UPDATE,
+    returns whether it existed.
+    """
+    return Transaction.objects.filter(
+        charge_point=charge_point, transaction_id=transaction_id, status="active"
+    ).update(
+        meter_stop=meter_stop,
+        stop_time=_parse_timestamp(timestamp),
+        stop_reason=reason,
+        status="completed",
+        closed_at=timezone.now(),
+    ) > 0
+
+
+aactive_transactions_of = timed_database_sync_to_async(active_transactions_of)
+aopen_transaction = timed_database_sync_to_async(open_transaction)
+aclose_transaction = timed_database_sync_to_async(close_transaction)
+
+transaction_ids = TransactionIdAllocator(block_size=settings.TRANSACTION_ID_BLOCK_SIZE)
+active_transactions = ActiveTransactionIndex()
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncHour
+from api.metrics import timed_database_sync_to_async
+from api.models import ChargePoint, ChargerHourStats, Messages, RollupWatermark, Transaction
+
+logger = logging.getLogger(__name__)
+
+STAT_FIELDS = ['energy_wh', 'charging_seconds', 'sessions_started', 'sessions_completed', 'messages']
+HOUR = timedelta(hours=1)
+
+
+def hour_start(moment):
+    return moment.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def session_contributions(charge_point_id, start, stop, energy_wh):
+    """
+    {(charge_point_id, hour): {field: amount}} of one closed session: started
+    and completed counts in their hours, time and energy spread over every
+    hour the session ran, in proportion to the time spent in it.
+    """
+    contributions = {
+        (charge_point_id, hour_start(start)): {'sessions_started': 1},
+    }
+    contributions.setdefault((charge_point_id, hour_start(stop)), {})['sessions_completed'] = 1
+    duration = (stop - start).total_seconds()
+    hour = hour_start(start)
+    while hour < stop:
+        seconds = (min(stop, hour + HOUR) - max(start, hour)).total_seconds()
+        if seconds > 0:
+            amounts = contributions.setdefault((charge_point_id, hour), {})
+            amounts['charging_seconds'] = seconds
+            amounts['energy_wh'] = energy_wh * seconds / duration
+        hour += HOUR
+    if duration <= 0:
+        contributions[(charge_point_id, hour_start(stop))]['energy_wh'] = energy_wh
+    return contributions
+
+
+def apply(partial):
+    """Add {(charge_point_id, hour): {field: amount}} to the stored stats, one read and one upsert."""
+    if not partial:
+        return
+    charge_point_ids = {key[0] for key in partial}
+    hours = {key[1] for key in partial}
+    rows = {}
+    for stored in ChargerHourStats.objects.filter(charge_point_id__in=charge_point_ids, hour__in=hours):
+        key = (stored.charge_point_id, stored.hour)
+        if key in partial:
+            rows[key] = stored
+    for key, amounts in partial.items():
+        row = rows.get(key) or ChargerHourStats(charge_point_id=key[0], hour=key[1])
+        for field, amount in amounts.items():
+            setattr(row, field, getattr(row, field) + amount)
+        rows[key] = row
+    ChargerHourStats.objects.bulk_create(
+        list(rows.values()),
+        update_conflicts=True,
+        unique_fields=['charge_point', 'hour'],
+        update_fields=STAT_FIELDS,
+    )
+
+
+def _merge(partial, contributions):
+    for key, amounts in contributions.items():
+        total = partial.setdefault(key, {})
+        for field, amount in amounts.items():
+            total[field] = total.get(field, 0) + amount
+
+
+def _watermark(name):
+    """The rollup's watermark row, locked so that concurrent runs take turns."""
+    RollupWatermark.objects.get_or_create(name=name)
+    return RollupWatermark.objects.select_for_update().get(name=name)
+
+
+def rollup_sessions(until, batch_size=5000):
+    """Fold sessions closed since the watermark (and before `until`) into the hourly stats."""
+    processed = 0
+    while True:
+        with transaction.atomic():
+            watermark = _watermark('transactions')
+            sessions = Transaction.objects.filter(closed_at__isnull=False, closed_at__lte=until)
+            if watermark.position:
+                sessions = sessions.filter(
+                    Q(closed_at__gt=watermark.position) | Q(closed_at=watermark.position, id__gt=watermark.last_id)
+                )
+            batch = list(
+                sessions.order_by('closed_at', 'id').values_list(
+                    'id', 'charge_point_id', 'start_time', 'stop_time', 'closed_at', 'meter_start', 'meter_stop'
+                )[:batch_size]
+            )
+            if not batch:
+                return processed
+            partial = {}
+            for _, charge_point_id, start, stop, closed_at, meter_start, meter_stop in batch:
+                stop = stop or closed_at
+                start = min(start or stop, stop)
+                energy_wh = max(0, (meter_stop or 0) - (meter_start or 0)) if meter_stop is not None else 0
+                _merge(partial, session_contributions(charge_point_id, start, stop, energy_wh))
+            apply(partial)
+            watermark.last_id, watermark.position = batch[-1][0], batch[-1][4]
+            watermark.save()
+        processed += len(batch)
+        if len(batch) < batch_size:
+            return processed
+
+
+def rollup_messages(until, max_window=timedelta(days=1)):
+    """Count logged frames per charger and hour since the watermark, a day of log per query at most."""
+    counted = 0
+    while True:
+        with transaction.atomic():
+            watermark = _watermark('messages')
+            if watermark.position is None:
+                oldest = Messages.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+                watermark.position = hour_start(oldest) - timedelta(seconds=1) if oldest else until
+            upper = min(until, watermark.position + max_window)
+            if upper <= watermark.position:
+                watermark.save()
+                return counted
+            counts = (
+                Messages.objects.filter(timestamp__gt=watermark.position, timestamp__lte=upper)
+                .annotate(hour=TruncHour('timestamp', tzinfo=timezone.utc))
+                .values('charge_point_id', 'hour')
+                .annotate(count=Count('message_id'))
+                .order_by()
+            )
+            partial = {
+                (row['charge_point_id'], row['hour']): {'messages': row['count']}
+                for row in counts
+            }
+            apply(partial)
+            watermark.position = upper
+            watermark.save()
+        counted += sum(amounts['messages'] for amounts in partial.values())
+
+
+def update_usage_rollups(safety_lag=60):
+    """
+    Bring the hourly usage stats up to date. Only rows older than
+    `safety_lag` seconds are read, so writes still in flight are not skipped.
+    """
+    until = datetime.now(timezone.utc) - timedelta(seconds=safety_lag)
+    sessions = rollup_sessions(until)
+    messages = rollup_messages(until)
+    if sessions or messages:
+        logger.info(f"📊 Usage rollups: {sessions} sessions, {messages} messages up to {until:%H:%M:%S}")
+    return {'sessions': sessions, 'messages': messages}
+
+
+async def run_in_process(interval, safety_lag):
+    """Run the rollups on this event loop instead of in Celery (ROLLUP_RUNNER=inprocess)."""
+    update = timed_database_sync_to_async(update_usage_rollups)
+    while True:
+        try:
+            await update(safety_lag)
+        except Exception as e:
+            logger.error(f"❌ Usage rollups failed: {e}")
+        await asyncio.sleep(interval)
+
+
+# Reads for the dashboards
+
+def _totals(rows, hours, chargers):
+    energy = sum(row['energy_wh'] or 0 for row in rows)
+    charging = sum(row['charging_seconds'] or 0 for row in rows)
+    return {
+        'energy_kwh': round(energy / 1000, 3),
+        'sessions': sum(row['sessions_started'] or 0 for row in rows),
+        'charging_hours': round(charging / 3600, 2),
+        # Share of the charger hours spent charging
+        'utilisation': round(charging / (hours * chargers * 3600), 4) if hours and chargers else None,
+        'messages': sum(row['messages'] or 0 for row in rows),
+    }
+
+
+def _series(rows, chargers=1):
+    return [
+        {
+            'hour': row['hour'].isoformat(),
+            'energy_kwh': round((row['energy_wh'] or 0) / 1000, 3),
+            'sessions_started': row['sessions_started'] or 0,
+            'sessions_completed': row['sessions_completed'] or 0,
+            'utilisation': round((row['charging_seconds'] or 0) / (chargers * 3600), 4) if chargers else None,
+            'messages': row['messages'] or 0,
+        }
+        for row in rows
+    ]
+
+
+def _range(since, until):
+    until = hour_start(until) + HOUR if until else hour_start(datetime.now(timezone.utc)) + HOUR
+    since = hour_start(since) if since else until - timedelta(days=1)
+    return since, until, (until - since) / HOUR
+
+
+def charger_usage(charge_point_id, since=None, until=None):
+    since, until, hours = _range(since, until)
+    rows = list(
+        ChargerHourStats.objects.filter(charge_point_id=charge_point_id, hour__gte=since, hour__lt=until)
+        .order_by('hour').values('hour', *STAT_FIELDS)
+    )
+    return {'since': since.isoformat(), 'until': until.isoformat(), 'totals': _totals(rows, hours, 1),
+            'hours': _series(rows)}
+
+
+def site_usage(site, since=None, until=None):
+    since, until, hours = _range(since, until)
+    chargers = ChargePoint.objects.filter(site=site).count()
+    rows = list(
+        ChargerHourStats.objects.filter(charge_point__site=site, hour__gte=since, hour__lt=until)
+        .values('hour').annotate(**{field: Sum(field) for field in STAT_FIELDS}).order_by('hour')
+    )
+    return {'site': site, 'chargers': chargers, 'since': since.isoformat(), 'until': until.isoformat(),
+            'totals': _totals(rows, hours, chargers), 'hours': _series(rows, chargers)}
+
+
+def fleet_usage(since=None, until=None, group_by='site', limit=100):
+    """
+    Totals per site or per charger over a time range, most energy first.
+    Utilisation counts the chargers that have stats in the range.
+    """
+    since, until, hours = _range(since, until)
+    key = 'charge_point__site' if group_by == 'site' else 'charge_point_id'
+    rows = (
+        ChargerHourStats.objects.filter(hour__gte=since, hour__lt=until)
+        .values(key).annotate(chargers=Count('charge_point', distinct=True),
+                              **{field: Sum(field) for field in STAT_FIELDS})
+        .order_by('-energy_wh')[:limit]
+    )
+    return {
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'groups': [
+            {group_by: str(row[key]) if row[key] is not None else None, **_totals([row], hours, row['chargers'])}
+            for row in rows
+        ],
+    }
@@ -1,70 +1,227 @@
-import json
+import asyncio
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 import api.django_setup  # Load Django settings before importing models
+from django.conf import settings
 from api.models import ChargePoint  # Import Django models
+from api import command_jobs, message_log, metrics, outbox, rpc, usage
+from api.tracing import tracer
+from api.meter_values import ROLLUP_RESOLUTIONS, read_rollups
+from api.presence import presence, reconciler
+from api.registry import charger_registry
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from ocpp.v16 import call
+from pydantic import BaseModel
 from channels.layers import get_channel_layer
 from channels.db import database_sync_to_async
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app):
+    # Warm the charger registry with a single query before serving requests
+    await database_sync_to_async(charger_registry.preload)()
+    metrics.publisher.ensure_started()
+    # Connected chargers are mirrored from Redis and written back to is_online in bulk
+    presence.ensure_mirror()
+    reconciler.ensure_started()
+    # Without a Celery worker and beat, the usage rollups run on this event loop
+    rollups = None
+    if settings.ROLLUP_RUNNER == "inprocess":
+        rollups = asyncio.create_task(usage.run_in_process(settings.ROLLUP_INTERVAL, settings.ROLLUP_SAFETY_LAG))
+    # Command jobs left running by a process that went away would never finish
+    reaper = asyncio.create_task(
+        command_jobs.reap_orphaned_jobs(settings.BULK_COMMAND_STALE_AFTER, settings.BULK_COMMAND_STALE_AFTER)
+    )
+    yield
+    reaper.cancel()
+    if rollups:
+        rollups.cancel()
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(message_log.router)
+app.include_router(command_jobs.router)
 channel_layer = get_channel_layer()
 
 
-# Use async wrapper for database operations
-@database_sync_to_async
-def get_charger(charger_id):
-    return ChargePoint.objects.filter(id=charger_id).first()
+# Chargers are read from the in-process registry, not from Postgres
+async def get_charger(charger_id):
+    return await charger_registry.aget(charger_id)
 
-@database_sync_to_async
-def is_charger_connected(charger_id):
-    charger = ChargePoint.objects.filter(id=charger_id).first()
-    return charger and charger.status=='available'
+# Connectivity comes from the presence mirror, not from the charger's status
+async def is_charger_connected(charger_id):
+    return presence.is_connected(charger_id)
+
+def command_response(reply):
+    """
+    Turn the consumer's reply to a remote command into the HTTP response.
+    """
+    if reply["status"] == rpc.STATUS_OK:
+        return {"status": reply["status"], "response": reply["result"]}
+    if reply["status"] in (rpc.STATUS_TIMEOUT, rpc.STATUS_EXPIRED):
+        raise HTTPException(status_code=504, detail=reply.get("error"))
+    raise HTTPException(status_code=502, detail=reply.get("error"))
+
+async def queue_command(charger, action, payload, ttl=None):
+    """
+    Keep a command in the charger's outbox until it connects (or right away
+    if it is connected after all).
+    """
+    ttl = min(ttl or settings.OUTBOX_DEFAULT_TTL, settings.OUTBOX_MAX_TTL)
+    command = await outbox.aenqueue(charger.id, action, payload, ttl)
+    await outbox.notify(channel_layer, charger.id)
+    return {"status": "queued", "command_id": command.id, "expires_at": command.expires_at.isoformat()}
+
+@app.get("/chargers")
+async def connected_chargers():
+    """
+    List the chargers connected to any node, served from the presence mirror.
+    """
+    chargers = []
+    for charger_id, entry in sorted(presence.all().items()):
+        charger = await get_charger(charger_id)
+        chargers.append({
+            "charger_id": charger_id,
+            "name": charger.name if charger else None,
+            "node": entry["node"],
+            "ip_address": entry["ip"] or None,
+            "connected_at": datetime.fromtimestamp(entry["connected_at"], timezone.utc).isoformat(),
+        })
+    return chargers
 
 @app.post("/remote_start/{charger_id}")
-async def remote_start_transaction(charger_id: str, id_tag: str = "default_tag" , connector_id: int = None):
+async def remote_start_transaction(charger_id: str, id_tag: str = "default_tag" , connector_id: int = None,
+                                   queue: bool = False, ttl: int = None):
     """
     Send a RemoteStartTransaction request to a specific charger.
+    With queue=true a charger that is not connected gets it when it comes back.
     """
     charger = await get_charger(charger_id)  # ✅ Async-safe database call
 
     if not charger:
         raise HTTPException(status_code=404, detail="Charger not found")
 
+    # Create RemoteStartTransaction OCPP message
+    request = call.RemoteStartTransaction(id_tag=id_tag, connector_id=connector_id)
     is_connected = await is_charger_connected(charger_id)
     if not is_connected:
+        if queue:
+            return await queue_command(charger, "RemoteStartTransaction", request.__dict__, ttl)
         raise HTTPException(status_code=400, detail="Charger is not connected")
     
     try:
-        # Create RemoteStartTransaction OCPP message
-        request = call.RemoteStartTransaction(id_tag=id_tag)
-
-        # Convert request to JSON properly
-        request_json = json.dumps(request.__dict__)
-        # Send request to Django Channels WebSocket Consumer
-        await channel_layer.group_send(
-            f"charger_{charger_id}",
-            {"type": "remote.start","request": request_json,}
-        )
-        return {"status": "Remote Start Transaction Sent"}
-    
+        # Send request to the charger's consumer and wait for its answer
+        reply = await rpc.send_command(channel_layer, charger_id, "RemoteStartTransaction", request.__dict__)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if queue and reply["status"] == rpc.STATUS_DISCONNECTED:
+        return await queue_command(charger, "RemoteStartTransaction", request.__dict__, ttl)
+    return command_response(reply)
 
 @app.post('/remote_stop/{charger_id}')
-async def remote_stop_transaction(charger_id: str ,transaction_id: int =121):
+async def remote_stop_transaction(charger_id: str ,transaction_id: int =121, queue: bool = False, ttl: int = None):
     """
     Send a RemoteStopTransaction request to a specific charger.
+    With queue=true a charger that is not connected gets it when it comes back.
     """
+    charger = await get_charger(charger_id)
+    if not charger:
+        raise HTTPException(status_code=404, detail="Charger not found")
+
+    # Create RemoteStopTransaction OCPP message
+    request = call.RemoteStopTransaction(transaction_id=transaction_id)
     try:
-        # Create RemoteStopTransaction OCPP message
-        request = call.RemoteStopTransaction(transaction_id=transaction_id)
-        # Convert request to JSON properly
-        request_json = json.dumps(request.__dict__)
-        # Send request to Django Channels WebSocket Consumer
-        await channel_layer.group_send(
-            f"charger_{charger_id}",
-            {"type": "remote.stop","request": request_json,}
-        )
-        return {"status": "Remote Stop Transaction Sent"}
+        # Send request to the charger's consumer and wait for its answer
+        reply = await rpc.send_command(channel_layer, charger_id, "RemoteStopTransaction", request.__dict__)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+    if reply["status"] == rpc.STATUS_DISCONNECTED:
+        if queue:
+            return await queue_command(charger, "RemoteStopTransaction", request.__dict__, ttl)
+        raise HTTPException(status_code=400, detail="Charger is not connected")
+    return command_response(reply)
+
+class OutboxRequest(BaseModel):
+    action: str  # OCPP action, e.g. ChangeConfiguration
+    payload: dict = {}  # Call fields in snake_case
+    ttl: int = None  # Seconds the command stays valid, OUTBOX_DEFAULT_TTL if not given
+
+@app.post("/outbox/{charger_id}")
+async def queue_outbox_command(charger_id: str, command: OutboxRequest):
+    """
+    Queue an OCPP command for a charger. It is delivered when the charger
+    connects (right away if it is connected) and replaces a queued command it
+    supersedes, e.g. an older ChangeConfiguration of the same key.
+    """
+    charger = await get_charger(charger_id)
+    if not charger:
+        raise HTTPException(status_code=404, detail="Charger not found")
+    try:
+        request = rpc.build_call(command.action, command.payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await queue_command(charger, command.action, request.__dict__, command.ttl)
+
+@app.get("/outbox/{charger_id}")
+async def outbox_commands(charger_id: str, status: str = None, limit: int = 100):
+    """
+    Queued and delivered commands of a charger with their results, newest first.
+    """
+    charger = await get_charger(charger_id)
+    if not charger:
+        raise HTTPException(status_code=404, detail="Charger not found")
+    return await database_sync_to_async(outbox.commands_of)(charger.id, status, min(limit, 1000))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Metrics of every Daphne and FastAPI process in the Prometheus text format.
+    """
+    snapshots = await metrics.publisher.collect()
+    return PlainTextResponse(metrics.render(snapshots), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces")
+async def message_traces(charger_id: str = None, action: str = None, slow_only: bool = False, limit: int = 100):
+    """
+    Most recent sampled and slow message traces, newest first.
+    """
+    return await tracer.query(charger_id=charger_id, action=action, slow_only=slow_only, limit=min(limit, 1000))
+
+@app.get("/meter_values/{charger_id}")
+async def meter_value_rollups(charger_id: str, resolution: int = 900, since: datetime = None, until: datetime = None,
+                              measurand: str = None, connector_id: int = None):
+    """
+    Downsampled meter values of a charger (1 minute, 15 minute or hourly buckets).
+    """
+    if resolution not in ROLLUP_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {ROLLUP_RESOLUTIONS}")
+    charger = await get_charger(charger_id)
+    if not charger:
+        raise HTTPException(status_code=404, detail="Charger not found")
+    return await database_sync_to_async(read_rollups)(charger.id, resolution, since, until, measurand, connector_id)
+
+@app.get("/analytics/chargers/{charger_id}")
+async def charger_analytics(charger_id: str, since: datetime = None, until: datetime = None):
+    """
+    Hourly energy, sessions, utilisation and message counts of a charger (default: the last day).
+    """
+    charger = await get_charger(charger_id)
+    if not charger:
+        raise HTTPException(status_code=404, detail="Charger not found")
+    return await database_sync_to_async(usage.charger_usage)(charger.id, since, until)
+
+@app.get("/analytics/sites/{site}")
+async def site_analytics(site: str, since: datetime = None, until: datetime = None):
+    """
+    Hourly usage of the chargers of a site, summed.
+    """
+    return await database_sync_to_async(usage.site_usage)(site, since, until)
+
+@app.get("/analytics/fleet")
+async def fleet_analytics(since: datetime = None, until: datetime = None, group_by: str = "site", limit: int = 100):
+    """
+    Usage totals per site or per charger, most energy first.
+    """
+    if group_by not in ("site", "charger"):
+        raise HTTPException(status_code=400, detail="group_by must be site or charger")
+    return await database_sync_to_async(usage.fleet_usage)(since, until, group_by, min(limit, 1000))
@@ -0,0 +1,10 @@
+"""
+Microbenchmarks of the OCPP message pipeline.
+
+Runs offline: SQLite in a temporary directory and the in-memory channel
+layer. Usage:
+
+    python -m benchmarks --json results.json
+    python -m benchmarks --baseline benchmarks/baseline.json   # exit code 1 on regressions
+    python -m benchmarks -k route_message --save-baseline benchmarks/baseline.json
+"""
@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+# Offline environment, set before Django loads its settings
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="ocpp-bench-"), "bench.sqlite3")
+os.environ["CHANNEL_LAYER"] = "memory"
+os.environ.setdefault("REDIS_URL", "redis://127.0.0.1:1/0")  # Nothing listens there, publishers give up quietly
+os.environ.setdefault("TRACE_SAMPLE_RATE", "0")
+os.environ.setdefault("TRACE_SLOW_THRESHOLD_MS", "1000000")
+os.environ.setdefault("METRICS_PUBLISH_INTERVAL", "3600")
+os.environ.setdefault("OCPP_RATE_LIMITS", "{}")  # Frames are sent back to back
+
+import api.django_setup  # noqa: E402  Load Django settings before importing models
+from channels.db import database_sync_to_async  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from .harness import compare  # noqa: E402
+from . import suites  # noqa: E402
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="OCPP pipeline microbenchmarks")
+    parser.add_argument("-k", dest="filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--number", type=int, default=2000, help="calls per round for the fast benchmarks")
+    parser.add_argument("--repeat", type=int, default=5, help="timed rounds per benchmark")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against the results stored in this file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown counted as a regression")
+    parser.add_argument("--save-baseline", help="write the results as the new baseline to this file")
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    charge_point = await database_sync_to_async(suites.provision)()
+    results = []
+
+    async def run_all(benchmarks):
+        for benchmark in benchmarks:
+            if args.filter and args.filter not in benchmark.name:
+                continue
+            benchmark.repeat = args.repeat
+            result = await benchmark.run()
+            print(f"{result['name']:<52}{result['best_us']:>12.3f} us{result['median_us']:>12.3f} us (median)")
+            results.append(result)
+
+    await run_all(suites.conversion_benchmarks(args.number * 10))
+    await run_all(suites.dispatch_benchmarks(charge_point, args.number))
+    async with suites.ReceiveBenchmarks(charge_point, args.number // 4) as receive:
+        await run_all(receive.benchmarks())
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.ERROR)
+    logging.disable(logging.WARNING)  # Handlers log every frame
+    call_command("migrate", run_syncdb=True, verbosity=0)
+
+    results = asyncio.run(run(args))
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(results, baseline, args.threshold)
+    print(f"\n{'benchmark':<52}{'baseline us':>14}{'current us':>14}{'ratio':>8}")
+    for name, before, after, ratio, verdict in rows:
+        print(f"{name:<52}{before:>14.3f}{after:>14.3f}{ratio:>8.2f}  {verdict}")
+    regressions = [row for row in rows if row[4] == "slower"]
+    if regressions:
+        print(f"\n❌ {len(regressions)} benchmarks are more than {args.threshold:.0%} slower than the baseline")
+        return 1
+    print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
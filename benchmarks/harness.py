@@ -0,0 +1,58 @@
+import asyncio
+import statistics
+import time
+
+
+class Benchmark:
+    """A named function (sync or async) timed in rounds of `number` calls."""
+
+    def __init__(self, name, func, number=1000, repeat=5, group=None):
+        self.name = name
+        self.func = func
+        self.number = number
+        self.repeat = repeat
+        self.group = group or name.split(".", 1)[0]
+
+    async def _round(self):
+        func, number = self.func, self.number
+        if asyncio.iscoroutinefunction(func):
+            started = time.perf_counter()
+            for _ in range(number):
+                await func()
+        else:
+            started = time.perf_counter()
+            for _ in range(number):
+                func()
+        return (time.perf_counter() - started) / number
+
+    async def run(self):
+        await self._round()  # Warm up caches, dispatch plans, connections
+        rounds = [await self._round() for _ in range(self.repeat)]
+        return {
+            "name": self.name,
+            "group": self.group,
+            "number": self.number,
+            "repeat": self.repeat,
+            # The fastest round is the least disturbed by the rest of the machine
+            "best_us": round(min(rounds) * 1e6, 3),
+            "median_us": round(statistics.median(rounds) * 1e6, 3),
+            "stdev_us": round(statistics.pstdev(rounds) * 1e6, 3),
+        }
+
+
+def compare(results, baseline, threshold):
+    """
+    [(name, baseline best, current best, ratio, verdict)] for the benchmarks in
+    both runs; verdict is "slower" past `threshold` (0.2 = 20%), "faster" past
+    it the other way, "" otherwise.
+    """
+    before = {result["name"]: result for result in baseline["results"]}
+    rows = []
+    for result in results:
+        old = before.get(result["name"])
+        if old is None:
+            continue
+        ratio = result["best_us"] / old["best_us"] if old["best_us"] else float("inf")
+        verdict = "slower" if ratio > 1 + threshold else "faster" if ratio < 1 - threshold else ""
+        rows.append((result["name"], old["best_us"], result["best_us"], ratio, verdict))
+    return rows
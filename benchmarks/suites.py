@@ -0,0 +1,135 @@
+import json
+from datetime import datetime, timezone
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from ocpp.messages import unpack
+from ocpp.v16 import call, call_result
+from api.models import ChargePoint, Connector, IdTag
+from api.registry import charger_registry
+from ElectricalVehicleCharges.consumers import OCPPConsumer
+from ElectricalVehicleCharges.ocpp_charge_point import ChargePointV16 as cp
+from ElectricalVehicleCharges.ocpp_charge_point import (
+    camel_to_snake_case, remove_nones, serialize_as_dict, snake_to_camel_case,
+)
+from ElectricalVehicleCharges.routing import websocket_urlpatterns
+from .harness import Benchmark
+
+NOW = datetime(2025, 1, 1, tzinfo=timezone.utc).isoformat()
+
+# One representative Call payload per action handled by OCPPConsumer
+PAYLOADS = {
+    "BootNotification": {"chargePointModel": "EVSE-123", "chargePointVendor": "EV-Charger Inc."},
+    "Heartbeat": {},
+    "Authorize": {"idTag": "123456"},
+    "StatusNotification": {"connectorId": 1, "errorCode": "NoError", "status": "Charging"},
+    "MeterValues": {
+        "connectorId": 1,
+        "transactionId": 1,
+        "meterValue": [{
+            "timestamp": NOW,
+            "sampledValue": [
+                {"value": "1520", "measurand": "Energy.Active.Import.Register", "unit": "Wh"},
+                {"value": "7360", "measurand": "Power.Active.Import", "unit": "W"},
+                {"value": "32.1", "measurand": "Current.Import", "unit": "A", "phase": "L1"},
+            ],
+        }],
+    },
+    "StartTransaction": {"connectorId": 1, "idTag": "123456", "meterStart": 0, "timestamp": NOW},
+    "StopTransaction": {"transactionId": 1, "meterStop": 100, "timestamp": NOW, "reason": "Local"},
+}
+
+
+def frame(action, unique_id="bench"):
+    return json.dumps([2, unique_id, action, PAYLOADS[action]])
+
+
+class OfflineConsumer(OCPPConsumer):
+    """OCPPConsumer without a WebSocket, replies are dropped."""
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        pass
+
+
+def provision():
+    """The charger every benchmark talks as, as cached by the registry (connectors prefetched)."""
+    IdTag.objects.get_or_create(id_tag="123456")
+    charge_point, created = ChargePoint.objects.get_or_create(name="bench", defaults={"max_power_kw": 22})
+    if created:
+        Connector.objects.create(
+            charge_point=charge_point, number=1, type="Type2", max_current=32, status="Available", power_type="AC"
+        )
+    return charger_registry.get(charge_point.id)
+
+
+def conversion_benchmarks(number):
+    meter_values = PAYLOADS["MeterValues"]
+    snake_meter_values = camel_to_snake_case(meter_values)
+    boot_result = call_result.BootNotification(current_time=NOW, interval=60, status="Accepted")
+    meter_values_call = call.MeterValues(**snake_meter_values)
+    with_nones = serialize_as_dict(meter_values_call)
+    return [
+        Benchmark("conversion.camel_to_snake_case.MeterValues", lambda: camel_to_snake_case(meter_values), number),
+        Benchmark("conversion.snake_to_camel_case.MeterValues", lambda: snake_to_camel_case(snake_meter_values), number),
+        Benchmark("conversion.serialize_as_dict.BootNotification", lambda: serialize_as_dict(boot_result), number),
+        Benchmark("conversion.serialize_as_dict.MeterValues", lambda: serialize_as_dict(meter_values_call), number),
+        Benchmark("conversion.remove_nones.MeterValues", lambda: remove_nones(with_nones), number),
+    ]
+
+
+def dispatch_benchmarks(charge_point, number):
+    """route_message (raw frame) and _handle_call (decoded Call) per action."""
+    consumer = OfflineConsumer()
+    consumer.charger_id = str(charge_point.id)
+    consumer.charge_point = charge_point
+    cp.__init__(consumer, consumer.charger_id, consumer)
+
+    benchmarks = []
+    for action in PAYLOADS:
+        raw = frame(action)
+        decoded = unpack(raw)
+
+        async def route(raw=raw):
+            await consumer.route_message(raw)
+
+        async def handle(decoded=decoded):
+            await consumer._handle_call(decoded)
+
+        # Transactions write to the database, keep their rounds shorter
+        n = number // 10 if action.endswith("Transaction") else number
+        benchmarks.append(Benchmark(f"route_message.{action}", route, n))
+        benchmarks.append(Benchmark(f"handle_call.{action}", handle, n))
+    return benchmarks
+
+
+class ReceiveBenchmarks:
+    """OCPPConsumer.receive end to end through a Channels WebsocketCommunicator."""
+
+    def __init__(self, charge_point, number):
+        self.charge_point = charge_point
+        self.number = number
+        self.communicator = None
+
+    async def __aenter__(self):
+        application = URLRouter(websocket_urlpatterns)
+        self.communicator = WebsocketCommunicator(application, f"/ws/evcharger/{self.charge_point.id}/")
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise RuntimeError("The benchmark charger was refused")
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.communicator.disconnect()
+
+    def benchmarks(self):
+        communicator = self.communicator
+        benchmarks = []
+        for action in PAYLOADS:
+            raw = frame(action)
+
+            async def round_trip(raw=raw):
+                await communicator.send_to(text_data=raw)
+                await communicator.receive_from()
+
+            n = self.number // 10 if action.endswith("Transaction") else self.number
+            benchmarks.append(Benchmark(f"receive.{action}", round_trip, n))
+        return benchmarks